@@ -1,11 +1,14 @@
 # admin.py
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header
 from pydantic import BaseModel
 from typing import Optional
 import os
+import asyncio
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
+from idempotency import run_idempotent
+
 load_dotenv()
 
 # Initialize Supabase client
@@ -94,7 +97,15 @@ class ApproveRequest(BaseModel):
     admin_name: str
 
 @router.post("/approve_report")
-def approve_report_action(req: ApproveRequest):
+async def approve_report_action(req: ApproveRequest,
+                                idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    """A retry with the same Idempotency-Key does not notify the inspector twice"""
+    return await run_idempotent(
+        idempotency_key, f"approve_report:{req.inspection_id}", req.dict(),
+        lambda: asyncio.to_thread(_approve_report_action, req)
+    )
+
+def _approve_report_action(req: ApproveRequest):
     try:
         # 1. Fetch Inspection Details (to get Inspector ID and ReportNo)
         insp_res = supabase.table("Inspection").select("ReportNo, UserID_Inspector").eq("InspectionID", req.inspection_id).execute()
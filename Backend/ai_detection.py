@@ -1,61 +1,32 @@
 # ai_detection.py
 """
-AI Detection Module - Hugging Face Space Integration
-Handles defect detection by calling external Hugging Face Space API
-This version does NOT load the model locally - saves 2-4GB RAM!
+AI Detection Module
+Detection endpoints on top of the pluggable detector backends (detector.py):
+the Hugging Face Space, an in-process ONNX Runtime engine or a local stub,
+chosen with DETECTOR_BACKEND. The default remote backend does NOT load the
+model locally - saves 2-4GB RAM!
 """
 
 from fastapi import APIRouter, HTTPException, UploadFile, File
 from pydantic import BaseModel
 from typing import List, Optional
-import os
 from dotenv import load_dotenv
 import traceback
-import requests
+import asyncio
+import httpx
 
-load_dotenv()
-
-router = APIRouter(prefix="/ai-detection", tags=["AI Detection"])
-
-# ---------------------------------------------------------
-# Configuration
-# ---------------------------------------------------------
-
-# URL to your Hugging Face Space API
-# After deploying, update this with your actual Space URL
-HF_SPACE_URL = os.environ.get(
-    "HF_SPACE_URL",
-    "https://symmetrixs-edaa.hf.space"
+from detector import (
+    BACKENDS, CONFIDENCE_THRESHOLD, DEFECT_MAPPINGS, DETECT_CONCURRENCY, DETECTOR_BACKEND, HF_SPACE_URL,
+    DetectorUnavailable, detect_image, detect_photo, failed_result, get_detector
 )
+from image_fetch import IMAGE_FETCH_TIMEOUT
+from detection_queue import JOB_RERUN, enqueue, queue_stats
+from detection_results import outdated_photos
+from detect_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, get_scheduler
 
-# Timeout for API requests (seconds)
-API_TIMEOUT = 120
-
-# Confidence threshold for detections
-CONFIDENCE_THRESHOLD = float(os.environ.get("DETECTION_CONFIDENCE", "0.5"))
+load_dotenv()
 
-DEFECT_MAPPINGS = {
-    "corrosion": {
-        "finding": "Surface corrosion and rust detected on metal surface.",
-        "recommendation": "Clean affected area and apply anti-corrosion coating. Monitor for progression."
-    },
-    "dents": {
-        "finding": "Surface deformation/dent observed on structure.",
-        "recommendation": "Assess depth and structural impact. Repair or replace if compromising integrity."
-    },
-    "scratch_mark": {
-        "finding": "Scratch marks detected on surface.",
-        "recommendation": "Evaluate depth. Apply protective coating if surface integrity is compromised."
-    },
-    "welding_defects": {
-        "finding": "Weld irregularity or defect detected.",
-        "recommendation": "Inspect weld quality. Re-weld if structural integrity is at risk."
-    },
-    "no_defect": {
-        "finding": "No significant defects detected.",
-        "recommendation": "Maintain routine monitoring and scheduled inspections."
-    }
-}
+router = APIRouter(prefix="/ai-detection", tags=["AI Detection"])
 
 # ---------------------------------------------------------
 # Pydantic Models
@@ -72,7 +43,6 @@ class DetectionResult(BaseModel):
     finding: str
     recommendation: str
     detection_count: int
-    annotated_image_base64: Optional[str] = None
 
 class BatchDetectionRequest(BaseModel):
     photo_ids: List[int]
@@ -80,217 +50,138 @@ class BatchDetectionRequest(BaseModel):
     category: str
 
 # ---------------------------------------------------------
-# API Client Functions
+# Routes
 # ---------------------------------------------------------
 
-def call_hf_space_api(endpoint: str, **kwargs):
-    """
-    Call Hugging Face Space API
-    
-    Args:
-        endpoint: API endpoint (e.g., "/detect-by-url")
-        **kwargs: Additional arguments to pass to requests
-    
-    Returns:
-        API response JSON
-    """
+@router.get("/health")
+async def health_check(backend: Optional[str] = None):
+    """Check if the AI detection backend is available"""
     try:
-        url = f"{HF_SPACE_URL}{endpoint}"
-        
-        # Add timeout if not specified
-        if 'timeout' not in kwargs:
-            kwargs['timeout'] = API_TIMEOUT
-        
-        response = requests.post(url, **kwargs)
-        response.raise_for_status()
-        
-        return response.json()
-    
-    except requests.exceptions.Timeout:
-        raise HTTPException(
-            status_code=504,
-            detail="AI detection service timeout. Please try again."
-        )
-    except requests.exceptions.RequestException as e:
-        print(f"❌ HF Space API error: {e}")
-        raise HTTPException(
-            status_code=503,
-            detail=f"AI detection service unavailable: {str(e)}"
-        )
-
-def detect_by_url_remote(photo_url: str) -> dict:
-    """
-    Detect defects by calling HF Space with image URL
-    
-    Args:
-        photo_url: URL to image (Supabase storage URL)
-    
-    Returns:
-        Detection result dict
+        detector = get_detector(backend)
+    except DetectorUnavailable as e:
+        return {"status": "error", "error": str(e), "connection": "failed"}
+    return {"backend": detector.name, **(await detector.health())}
+
+@router.get("/backends")
+def list_backends():
+    """Available detector backends and the configured default"""
+    return {"default": DETECTOR_BACKEND, "backends": sorted(BACKENDS)}
+
+@router.get("/queue")
+def queue_status():
+    """Photos waiting in the offline detection queue (see detection_queue.py)"""
+    return queue_stats()
+
+@router.post("/rerun-outdated")
+def rerun_outdated(inspection_id: Optional[int] = None, dry_run: bool = False):
     """
-    try:
-        result = call_hf_space_api(
-            "/detect-by-url",
-            data={"photo_url": photo_url}
-        )
-        return result
-    
-    except Exception as e:
-        print(f"❌ Detection failed for URL {photo_url}: {e}")
-        # Return empty detection on failure
-        return {
-            "success": False,
-            "detections": [],
-            "finding": "Detection failed. Please review manually.",
-            "recommendation": "Manual inspection required.",
-            "detection_count": 0,
-            "annotated_image_base64": None
-        }
+    Re-detect photos whose result came from an older model or another threshold
+
+    The photos are queued on the offline detection queue at low priority and
+    detected in its background rounds (DETECTION_QUEUE_BATCH_SIZE photos every
+    DETECTION_QUEUE_POLL_SECONDS, lowest detector priority), never all at once.
+    Completed and approved inspections are not touched, and photos whose
+    Finding/Recommendation an inspector edited by hand are only reported
+    ("edited_photo_ids"), never overwritten.
 
-def detect_by_file_remote(file_content: bytes, filename: str) -> dict:
-    """
-    Detect defects by uploading file to HF Space
-    
     Args:
-        file_content: Image file bytes
-        filename: Original filename
-    
-    Returns:
-        Detection result dict
+        inspection_id: Limit to one inspection
+        dry_run: Only count them
     """
     try:
-        files = {"file": (filename, file_content, "image/jpeg")}
-        result = call_hf_space_api(
-            "/detect-single",
-            files=files
-        )
-        return result
-    
-    except Exception as e:
-        print(f"❌ Detection failed for file {filename}: {e}")
+        detector = get_detector()
+        outdated, edited = outdated_photos(detector.model_version, CONFIDENCE_THRESHOLD, inspection_id)
+        queued = 0 if dry_run else enqueue(outdated, priority=JOB_RERUN)
+        print(f"🔁 {len(outdated)} photos with outdated results, {queued} queued, {len(edited)} edited by hand")
         return {
-            "success": False,
-            "detections": [],
-            "finding": "Detection failed. Please review manually.",
-            "recommendation": "Manual inspection required.",
-            "detection_count": 0,
-            "annotated_image_base64": None
-        }
-
-# ---------------------------------------------------------
-# Routes
-# ---------------------------------------------------------
-
-@router.get("/health")
-def health_check():
-    """Check if AI detection service is running"""
-    try:
-        # Ping the HF Space health endpoint
-        response = requests.get(f"{HF_SPACE_URL}/health", timeout=10)
-        hf_status = response.json()
-        
-        return {
-            "status": "healthy",
-            "hf_space_url": HF_SPACE_URL,
-            "hf_space_status": hf_status,
-            "connection": "ok"
+            "model_version": detector.model_version,
+            "threshold": CONFIDENCE_THRESHOLD,
+            "outdated": len(outdated) + len(edited),
+            "queued": queued,
+            "edited": len(edited),
+            "edited_photo_ids": [p["PhotoID"] for p in edited],
         }
+    except DetectorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        return {
-            "status": "error",
-            "hf_space_url": HF_SPACE_URL,
-            "error": str(e),
-            "connection": "failed"
-        }
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/scheduler")
+async def scheduler_status():
+    """Detector slots in use, waiting calls and wait times per priority class"""
+    return get_scheduler().stats()
 
 @router.post("/detect-single")
-async def detect_single_image(file: UploadFile = File(...)):
+async def detect_single_image(file: UploadFile = File(...), backend: Optional[str] = None):
     """
     Detect defects in a single uploaded image
-    Forwards request to HF Space API
+    Letterboxes it to the model input locally, then runs the detector
+    (bboxes are returned in the uploaded image's pixels)
     """
     try:
-        # Read file content
         content = await file.read()
-        
-        # Send to HF Space
-        result = detect_by_file_remote(content, file.filename)
-        
-        return result
+        async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT) as client:
+            return await detect_image(client, content, get_detector(backend), "api", PRIORITY_INTERACTIVE)
     
+    except DetectorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Detection failed: {str(e)}")
 
 @router.post("/detect-by-url")
-def detect_by_url(photo_url: str):
+async def detect_by_url(photo_url: str, backend: Optional[str] = None):
     """
     Detect defects in an image from a URL (Supabase storage)
-    Forwards request to HF Space API
     """
     try:
-        result = detect_by_url_remote(photo_url)
-        return result
+        async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as client:
+            return await detect_photo(client, photo_url, get_detector(backend), "api", PRIORITY_INTERACTIVE)
     
+    except DetectorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Detection failed: {str(e)}")
 
 @router.post("/detect-batch")
-def detect_batch(request: BatchDetectionRequest):
+async def detect_batch(request: BatchDetectionRequest, backend: Optional[str] = None):
     """
     Detect defects in multiple photos at once
-    Forwards batch request to HF Space API
+    Photos that fail are reported with an empty detection instead of failing the batch
     """
     try:
-        # Send entire batch to HF Space
-        result = call_hf_space_api(
-            "/detect-batch",
-            json={
-                "photo_ids": request.photo_ids,
-                "photo_urls": request.photo_urls,
-                "category": request.category
-            }
-        )
-        
-        return result
-    
-    except Exception as e:
-        traceback.print_exc()
-        # If batch fails, try one by one
-        print("⚠️ Batch detection failed, trying one by one...")
-        
-        results = []
-        for photo_id, photo_url in zip(request.photo_ids, request.photo_urls):
-            try:
-                detection_result = detect_by_url_remote(photo_url)
-                
-                result = DetectionResult(
-                    photo_id=photo_id,
-                    detections=[Detection(**d) for d in detection_result.get("detections", [])],
-                    finding=detection_result.get("finding", "Detection failed"),
-                    recommendation=detection_result.get("recommendation", "Manual inspection required"),
-                    detection_count=detection_result.get("detection_count", 0),
-                    annotated_image_base64=detection_result.get("annotated_image_base64")
-                )
-                results.append(result)
-            
-            except Exception as e:
-                print(f"❌ Error detecting photo {photo_id}: {e}")
-                results.append(DetectionResult(
-                    photo_id=photo_id,
-                    detections=[],
-                    finding="Detection failed. Please review manually.",
-                    recommendation="Manual inspection required.",
-                    detection_count=0,
-                    annotated_image_base64=None
-                ))
-        
-        return {
-            "success": True,
-            "processed": len(results),
-            "results": [r.dict() for r in results]
-        }
+        detector = get_detector(backend)
+    except DetectorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    semaphore = asyncio.Semaphore(DETECT_CONCURRENCY)
+    async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as client:
+        async def detect(photo_id: int, photo_url: str) -> DetectionResult:
+            async with semaphore:
+                try:
+                    detection_result = await detect_photo(client, photo_url, detector, "api", PRIORITY_BATCH)
+                except Exception as e:
+                    print(f"❌ Error detecting photo {photo_id}: {e}")
+                    detection_result = failed_result()
+            return DetectionResult(
+                photo_id=photo_id,
+                detections=[Detection(**d) for d in detection_result.get("detections", [])],
+                finding=detection_result.get("finding", "Detection failed"),
+                recommendation=detection_result.get("recommendation", "Manual inspection required"),
+                detection_count=detection_result.get("detection_count", 0)
+            )
+
+        results = await asyncio.gather(*[
+            detect(photo_id, photo_url) for photo_id, photo_url in zip(request.photo_ids, request.photo_urls)
+        ])
+
+    return {
+        "success": True,
+        "processed": len(results),
+        "results": [r.dict() for r in results]
+    }
 
 @router.get("/defect-types")
 def get_defect_types():
@@ -301,10 +192,11 @@ def get_defect_types():
     }
 
 @router.get("/test-connection")
-def test_hf_connection():
+async def test_hf_connection():
     """Test connection to Hugging Face Space"""
     try:
-        response = requests.get(f"{HF_SPACE_URL}/", timeout=10)
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.get(f"{HF_SPACE_URL}/")
         return {
             "status": "success",
             "hf_space_url": HF_SPACE_URL,
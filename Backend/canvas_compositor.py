@@ -0,0 +1,237 @@
+# canvas_compositor.py
+"""
+Canvas Compositor - Pillow
+Renders a photo group's canvas on the server from a small vector layout
+instead of the full-size composite the browser used to upload. Coordinates
+in the layout are normalized (0..1) to the canvas width/height and line
+widths / font sizes are fractions of the canvas width, so the same layout can
+be rendered at any resolution:
+
+    {
+        "aspect": 1.5,                      # canvas width / height
+        "background": "#ffffff",
+        "images":  [{"photo_id": 12, "x": 0.0, "y": 0.0, "w": 0.5, "h": 0.6}],
+        "strokes": [{"points": [[0.1, 0.1], [0.2, 0.15]], "color": "#ef4444", "width": 0.004}],
+        "shapes":  [{"type": "rectangle", "x1": 0.1, "y1": 0.1, "x2": 0.3, "y2": 0.3}],
+        "labels":  [{"x": 0.1, "y": 0.9, "text": "Pitting", "size": 0.03, "color": "#ffffff"}]
+    }
+
+Photos are taken from the smallest derivative (thumbnail/preview/print) that
+covers their box, via the memoized report image loader.
+"""
+
+from typing import Dict, List, Optional, Tuple
+import io
+import os
+import math
+import json
+import asyncio
+import hashlib
+import httpx
+from PIL import Image, ImageColor, ImageDraw
+
+from photo_derivatives import DERIVATIVE_SIZES
+from report_assets import AssetCache, load_stamp_font, load_report_image
+from image_fetch import IMAGE_FETCH_CONCURRENCY, IMAGE_FETCH_TIMEOUT
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+# Width of the composite stored as CanvasPhotoURL (A4 width at 290 DPI)
+CANVAS_RENDER_WIDTH = int(os.environ.get("CANVAS_RENDER_WIDTH", "2400"))
+
+# Largest width that may be requested from the render endpoint, and the
+# largest width or height any canvas is rendered at
+CANVAS_MAX_WIDTH = int(os.environ.get("CANVAS_MAX_WIDTH", "6000"))
+
+CANVAS_JPEG_QUALITY = int(os.environ.get("CANVAS_JPEG_QUALITY", "88"))
+
+# Memory used by memoized renders
+CANVAS_CACHE_BYTES = int(os.environ.get("CANVAS_CACHE_MB", "32")) * 1024 * 1024
+
+CANVAS_FORMATS = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+DEFAULT_COLOR = "#ef4444"
+DEFAULT_LINE_WIDTH = 0.003
+
+_cache = AssetCache(CANVAS_CACHE_BYTES)
+
+# ---------------------------------------------------------
+# Photo Sources
+# ---------------------------------------------------------
+
+def canvas_size(layout: dict, width: int) -> Tuple[int, int]:
+    """Pixel size at `width`, scaled down so neither side exceeds CANVAS_MAX_WIDTH"""
+    aspect = layout.get("aspect") or 1.0
+    width = min(width, CANVAS_MAX_WIDTH)
+    height = max(1, round(width / aspect))
+    if height > CANVAS_MAX_WIDTH:
+        height = CANVAS_MAX_WIDTH
+        width = max(1, round(height * aspect))
+    return width, height
+
+def _box(item: dict, size: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    w, h = size
+    left, top = round(item["x"] * w), round(item["y"] * h)
+    return left, top, max(1, round(item["w"] * w)), max(1, round(item["h"] * h))
+
+def source_url(photo: dict, box_px: int) -> Optional[str]:
+    """
+    Image to draw for a photo whose box is box_px on its longest side
+
+    The annotated photo wins (it carries the AI boxes); otherwise the
+    smallest derivative that is at least as large as the box, then the original.
+    """
+    if photo.get("AnnotatedPhotoURL"):
+        return photo["AnnotatedPhotoURL"]
+    for size, column in sorted(DERIVATIVE_SIZES.values()):
+        if size >= box_px and photo.get(column):
+            return photo[column]
+    return photo.get("PrintURL") or photo.get("PhotoURL")
+
+async def load_layout_images(layout: dict, photos: Dict[int, dict], width: int) -> Dict[int, Optional[bytes]]:
+    """photo_id -> JPEG sized for its box (None when missing or not downloadable)"""
+    size = canvas_size(layout, width)
+    jobs: Dict[int, Tuple[str, int, int]] = {}
+    for item in layout.get("images", []):
+        photo = photos.get(item["photo_id"])
+        _, _, box_w, box_h = _box(item, size)
+        image_url = source_url(photo, max(box_w, box_h)) if photo else None
+        if image_url:
+            # Largest box wins when a photo is placed twice
+            current = jobs.get(item["photo_id"])
+            if not current or box_w * box_h > current[1] * current[2]:
+                jobs[item["photo_id"]] = (image_url, box_w, box_h)
+
+    semaphore = asyncio.Semaphore(IMAGE_FETCH_CONCURRENCY)
+    async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as client:
+        # dpi=72 makes the printed box size equal to the pixel size
+        results = await asyncio.gather(*[
+            load_report_image(client, semaphore, image_url, box_w, box_h, dpi=72, quality=92)
+            for image_url, box_w, box_h in jobs.values()
+        ])
+    return dict(zip(jobs.keys(), results))
+
+# ---------------------------------------------------------
+# Rendering
+# ---------------------------------------------------------
+
+def _color(value: Optional[str], default: str = DEFAULT_COLOR) -> Tuple[int, ...]:
+    try:
+        return ImageColor.getrgb(value or default)
+    except ValueError:
+        return ImageColor.getrgb(default)
+
+def _draw_shape(draw: ImageDraw.ImageDraw, shape: dict, size: Tuple[int, int]):
+    w, h = size
+    color = _color(shape.get("color"))
+    line = max(1, round((shape.get("width") or DEFAULT_LINE_WIDTH) * w))
+    x1, y1 = shape["x1"] * w, shape["y1"] * h
+    x2, y2 = shape["x2"] * w, shape["y2"] * h
+    kind = shape.get("type")
+
+    if kind == "rectangle":
+        draw.rectangle((min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)), outline=color, width=line)
+    elif kind == "circle":
+        # Same as the editor: centred between the points, radius half the diagonal
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        radius = math.hypot(x2 - x1, y2 - y1) / 2
+        draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), outline=color, width=line)
+    elif kind in ("arrow", "line"):
+        draw.line((x1, y1, x2, y2), fill=color, width=line)
+        if kind == "arrow":
+            head = max(line * 5, w * 0.012)
+            angle = math.atan2(y2 - y1, x2 - x1)
+            for side in (-1, 1):
+                a = angle + side * math.pi / 6
+                draw.line((x2, y2, x2 - head * math.cos(a), y2 - head * math.sin(a)), fill=color, width=line)
+
+def _draw_stroke(draw: ImageDraw.ImageDraw, stroke: dict, size: Tuple[int, int]):
+    w, h = size
+    points = [(x * w, y * h) for x, y in stroke.get("points", [])]
+    if not points:
+        return
+    color = _color(stroke.get("color"))
+    line = max(1, round((stroke.get("width") or DEFAULT_LINE_WIDTH) * w))
+    if len(points) == 1:
+        x, y = points[0]
+        r = line / 2
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    else:
+        draw.line(points, fill=color, width=line, joint="curve")
+
+def _draw_label(draw: ImageDraw.ImageDraw, label: dict, size: Tuple[int, int]):
+    w, h = size
+    font = load_stamp_font(max(8, round((label.get("size") or 0.02) * w)))
+    # The editor positions text by its baseline
+    position = (label["x"] * w, label["y"] * h)
+    if label.get("background"):
+        left, top, right, bottom = draw.textbbox(position, label["text"], font=font, anchor="ls")
+        pad = max(2, (bottom - top) // 5)
+        draw.rectangle((left - pad, top - pad, right + pad, bottom + pad), fill=_color(label["background"]))
+    draw.text(position, label["text"], fill=_color(label.get("color"), "#ffffff"), font=font, anchor="ls")
+
+def render_canvas(layout: dict, images: Dict[int, Optional[bytes]], width: int, fmt: str = "jpeg") -> bytes:
+    """
+    Draw the layout at `width` pixels: photos first, then strokes, shapes and labels
+
+    Photos that could not be loaded are drawn as grey placeholders.
+    """
+    size = canvas_size(layout, width)
+    canvas = Image.new("RGB", size, _color(layout.get("background"), "#ffffff"))
+    draw = ImageDraw.Draw(canvas)
+
+    for item in layout.get("images", []):
+        left, top, box_w, box_h = _box(item, size)
+        data = images.get(item["photo_id"])
+        if not data:
+            draw.rectangle((left, top, left + box_w, top + box_h), fill="#d1d5db")
+            continue
+        with Image.open(io.BytesIO(data)) as img:
+            # Stretched into the box, like the editor draws it
+            canvas.paste(img.convert("RGB").resize((box_w, box_h), Image.LANCZOS), (left, top))
+
+    for stroke in layout.get("strokes", []):
+        _draw_stroke(draw, stroke, size)
+    for shape in layout.get("shapes", []):
+        _draw_shape(draw, shape, size)
+    for label in layout.get("labels", []):
+        if label.get("text"):
+            _draw_label(draw, label, size)
+
+    out = io.BytesIO()
+    if fmt == "png":
+        canvas.save(out, format="PNG", optimize=True)
+    elif fmt == "webp":
+        canvas.save(out, format="WEBP", quality=CANVAS_JPEG_QUALITY, method=4)
+    else:
+        canvas.save(out, format="JPEG", quality=CANVAS_JPEG_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+async def compose_canvas(layout: dict, photos: List[dict], width: int = CANVAS_RENDER_WIDTH,
+                         fmt: str = "jpeg") -> bytes:
+    """
+    Render a layout, memoized per (layout, photo sources, width, format)
+
+    Args:
+        photos: PhotoReport rows of the photos placed in the layout
+    """
+    by_id = {photo["PhotoID"]: photo for photo in photos}
+    sources = sorted(
+        (photo_id, source_url(photo, 0), photo.get("PhotoURL"))
+        for photo_id, photo in by_id.items()
+    )
+    cache_key = (
+        hashlib.sha1(json.dumps([layout, sources], sort_keys=True, default=str).encode("utf-8")).hexdigest(),
+        width,
+        fmt,
+    )
+    cached = _cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    images = await load_layout_images(layout, by_id, width)
+    rendered = await asyncio.to_thread(render_canvas, layout, images, width, fmt)
+    _cache.put(cache_key, rendered)
+    return rendered
@@ -0,0 +1,220 @@
+# content_store.py
+"""
+Content-Addressed Photo Storage
+Uploaded photos are stored under their SHA-256 (sha256/ab/abcdef...), so
+uploading the same bytes twice reuses the existing object instead of creating
+a new one. The key has no extension: it would come from the client filename
+and split identical bytes into several objects (older keys still carry one). PhotoReport.ContentHash records the hash of each photo row; the
+number of rows (plus profile/equipment photos) pointing at an object is its
+reference count, and the object is only deleted when that count reaches 0.
+
+An upload returns its URL before the caller inserts the row that references
+it, so every store_upload() records a claim on the hash first (local SQLite).
+release_content() leaves an object alone while it was claimed within
+CONTENT_CLAIM_GRACE_MINUTES, and the claim check and the delete hold the
+claims database's write lock, so a concurrent store_upload() either sees the
+object deleted (and uploads it again) or keeps it alive.
+"""
+
+from typing import Iterable, Optional, Tuple
+import os
+import re
+import time
+import asyncio
+import sqlite3
+import hashlib
+from contextlib import closing
+from fastapi import UploadFile
+from supabase import create_client, Client
+from dotenv import load_dotenv
+
+from storage_stream import MAX_UPLOAD_BYTES, ObjectExists, UploadTooLarge, stream_to_storage
+
+load_dotenv()
+
+# Initialize Supabase
+url = os.environ.get("SUPABASE_URL")
+key = os.environ.get("SUPABASE_ANON_KEY")
+
+if not url:
+    raise ValueError("SUPABASE_URL environment variable is not set.")
+if not key:
+    raise ValueError("SUPABASE_ANON_KEY environment variable is not set.")
+
+supabase: Client = create_client(url, key)
+
+HASH_CHUNK_SIZE = 256 * 1024
+
+CONTENT_CLAIMS_DB_PATH = os.environ.get(
+    "CONTENT_CLAIMS_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "content_claims.sqlite3")
+)
+
+# How long an uploaded object is kept before a row must reference it
+CONTENT_CLAIM_GRACE_SECONDS = int(os.environ.get("CONTENT_CLAIM_GRACE_MINUTES", "60")) * 60
+
+_CLAIMS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS content_claims (
+    digest     TEXT PRIMARY KEY,
+    claimed_at REAL NOT NULL
+);
+"""
+
+_CONTENT_PATH_RE = re.compile(r"/sha256/[0-9a-f]{2}/([0-9a-f]{64})(?:\.[A-Za-z0-9]+)?$")
+
+# Tables whose Photo column may point at an uploaded image
+_PROFILE_PHOTO_TABLES = ("Inspector", "Admin", "Equipment")
+
+# ---------------------------------------------------------
+# Hashing
+# ---------------------------------------------------------
+
+async def hash_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> str:
+    """SHA-256 of an upload, read in chunks (the file is rewound afterwards)"""
+    digest = hashlib.sha256()
+    total = 0
+    await upload.seek(0)
+    while True:
+        chunk = await upload.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        digest.update(chunk)
+    await upload.seek(0)
+    return digest.hexdigest()
+
+def content_path(digest: str) -> str:
+    return f"sha256/{digest[:2]}/{digest}"
+
+def content_hash_from_url(photo_url: Optional[str]) -> Optional[str]:
+    """Hash of a content-addressed URL, None for older timestamp-named uploads"""
+    if not photo_url:
+        return None
+    match = _CONTENT_PATH_RE.search(photo_url.split("?")[0])
+    return match.group(1) if match else None
+
+# ---------------------------------------------------------
+# Claims
+# ---------------------------------------------------------
+
+def _connect_claims() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(CONTENT_CLAIMS_DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(CONTENT_CLAIMS_DB_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_CLAIMS_SCHEMA)
+    return conn
+
+def claim_content(digest: str):
+    """Mark an object as about to be referenced (keeps release_content() away)"""
+    now = time.time()
+    with closing(_connect_claims()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM content_claims WHERE claimed_at < ?", (now - CONTENT_CLAIM_GRACE_SECONDS,))
+        conn.execute("INSERT OR REPLACE INTO content_claims (digest, claimed_at) VALUES (?, ?)", (digest, now))
+        conn.execute("COMMIT")
+
+# ---------------------------------------------------------
+# Store / Release
+# ---------------------------------------------------------
+
+async def store_upload(bucket: str, upload: UploadFile) -> Tuple[str, str, bool]:
+    """
+    Store an upload under its content hash
+
+    Returns:
+        (public URL, sha256 hex digest, True if an existing object was reused)
+    """
+    digest = await hash_upload(upload)
+    path = content_path(digest)
+    storage = supabase.storage.from_(bucket)
+
+    # Before looking for the object: a release running now either finishes
+    # first (we upload again) or sees the claim and keeps it
+    await asyncio.to_thread(claim_content, digest)
+
+    try:
+        if await asyncio.to_thread(storage.exists, path):
+            return storage.get_public_url(path), digest, True
+    except Exception as e:
+        print(f"⚠️ Could not check {bucket}/{path}, uploading anyway: {e}")
+
+    try:
+        public_url = await stream_to_storage(bucket, path, upload)
+        return public_url, digest, False
+    except ObjectExists:
+        # Someone stored the same bytes in the meantime
+        return storage.get_public_url(path), digest, True
+
+def adopt_object(bucket: str, path: str, digest: str) -> str:
+    """
+    Move an object that was uploaded elsewhere (and hashes to `digest`) to its
+    content path, or drop it when the same bytes are already stored there
+
+    Call claim_content(digest) first, for the same reason as store_upload().
+
+    Returns:
+        Public URL of the content-addressed object
+    """
+    target = content_path(digest)
+    storage = supabase.storage.from_(bucket)
+    if not storage.exists(target):
+        try:
+            storage.move(path, target)
+            return storage.get_public_url(target)
+        except Exception:
+            # Another upload of the same bytes may have moved in first
+            if not storage.exists(target):
+                raise
+    storage.remove([path])
+    return storage.get_public_url(target)
+
+def reference_count(digest: str) -> int:
+    """Rows that still point at the object with this hash"""
+    res = supabase.table("PhotoReport")\
+        .select("PhotoID", count="exact")\
+        .eq("ContentHash", digest)\
+        .execute()
+    count = res.count or 0
+
+    for table in _PROFILE_PHOTO_TABLES:
+        res = supabase.table(table)\
+            .select("Photo", count="exact")\
+            .like("Photo", f"%/sha256/{digest[:2]}/{digest}%")\
+            .execute()
+        count += res.count or 0
+    return count
+
+def release_content(bucket: str, photo_urls: Iterable[Optional[str]]):
+    """
+    Delete content-addressed objects that are no longer referenced
+
+    Call after the rows pointing at them were deleted or changed (background
+    task). Objects claimed by a recent upload are kept: the row that will
+    reference them may not exist yet.
+    """
+    for photo_url in dict.fromkeys(u for u in photo_urls if u):
+        digest = content_hash_from_url(photo_url)
+        if not digest:
+            continue
+        try:
+            if reference_count(digest) > 0:
+                continue
+            path = photo_url.split("?")[0].split(f"/{bucket}/", 1)[-1]
+            with closing(_connect_claims()) as conn:
+                # Held until the object is gone, so no upload can reuse it meanwhile
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    claim = conn.execute(
+                        "SELECT claimed_at FROM content_claims WHERE digest = ?", (digest,)
+                    ).fetchone()
+                    if claim and time.time() - claim[0] < CONTENT_CLAIM_GRACE_SECONDS:
+                        print(f"⏳ Keeping photo object {path}, claimed by a recent upload")
+                        continue
+                    supabase.storage.from_(bucket).remove([path])
+                finally:
+                    conn.execute("COMMIT")
+            print(f"🗑️ Removed unreferenced photo object {path}")
+        except Exception as e:
+            print(f"⚠️ Could not release photo object {photo_url}: {e}")
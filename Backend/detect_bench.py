@@ -0,0 +1,272 @@
+# detect_bench.py
+"""
+Detector Replay Harness
+Replays stored photos through a detector backend from the command line and
+reports throughput, latency percentiles, per-class counts and agreement with
+stored results. With the stub backend and a local directory nothing leaves
+the machine, and no Supabase credentials are needed.
+
+    python detect_bench.py ./photos --backend stub --concurrency 4
+    python detect_bench.py export.json --backend remote --save run.json
+    python detect_bench.py ./photos --backend onnx --baseline run.json
+
+Inputs:
+    directory        image files (jpg, jpeg, png, webp), recursively
+    .txt             one photo URL per line
+    .json / .jsonl   exported PhotoReport rows (PhotoURL, optional PhotoID
+                     and Detections) or a --save file of an earlier run
+    .csv             the same columns as a CSV export
+
+Stored results come from the rows' Detections or from --baseline; boxes
+agree when the class matches and IoU >= --iou.
+"""
+
+from typing import Dict, List, Optional, Tuple
+import os
+import csv
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+from collections import Counter
+import httpx
+
+from detector import BACKENDS, DETECTOR_BACKEND, DetectorUnavailable, detect_image, get_detector, normalize_detections
+from detect_scheduler import get_scheduler
+from image_fetch import IMAGE_FETCH_TIMEOUT, fetch_image
+from worker_pool import shutdown_pool
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+# ---------------------------------------------------------
+# Inputs
+# ---------------------------------------------------------
+
+def _item(source: str, detections=None, photo_id=None) -> dict:
+    if isinstance(detections, str):
+        detections = json.loads(detections) if detections.strip() else None
+    return {
+        "id": str(photo_id) if photo_id not in (None, "") else source,
+        "source": source,
+        "stored": normalize_detections(detections) if detections is not None else None,
+    }
+
+def load_items(path: str) -> List[dict]:
+    """Photos to replay: {"id", "source" (file path or URL), "stored" (boxes or None)}"""
+    if os.path.isdir(path):
+        return [
+            _item(os.path.join(root, name))
+            for root, _, files in sorted(os.walk(path))
+            for name in sorted(files) if name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".txt"):
+            return [_item(line.strip()) for line in f if line.strip() and not line.startswith("#")]
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        elif path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            data = json.load(f)
+            rows = data.get("results", []) if isinstance(data, dict) else data
+
+    return [
+        _item(row.get("PhotoURL") or row.get("source"),
+              row.get("Detections", row.get("detections")),
+              row.get("PhotoID", row.get("id")))
+        for row in rows if row.get("PhotoURL") or row.get("source")
+    ]
+
+def load_baseline(path: str) -> Dict[str, List[dict]]:
+    """id -> boxes from a --save file (or any input format with detections)"""
+    return {item["id"]: item["stored"] for item in load_items(path) if item["stored"] is not None}
+
+async def _read(client: httpx.AsyncClient, source: str) -> Optional[bytes]:
+    if source.startswith(("http://", "https://")):
+        return await fetch_image(client, asyncio.Semaphore(1), source)
+    with open(source, "rb") as f:
+        return f.read()
+
+# ---------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+def iou(a: List[float], b: List[float]) -> float:
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+def match_boxes(predicted: List[dict], stored: List[dict], min_iou: float) -> int:
+    """Greedy same-class matches with IoU >= min_iou, most confident first"""
+    unmatched = list(stored)
+    matched = 0
+    for p in sorted(predicted, key=lambda d: -d["confidence"]):
+        best, best_iou = None, min_iou
+        for s in unmatched:
+            if s["class_name"] == p["class_name"]:
+                overlap = iou(p["bbox"], s["bbox"])
+                if overlap >= best_iou:
+                    best, best_iou = s, overlap
+        if best is not None:
+            unmatched.remove(best)
+            matched += 1
+    return matched
+
+def summarize_run(runs: List[dict], wall: float, min_iou: float) -> dict:
+    ok = [r for r in runs if r["error"] is None]
+    latencies = [r["latency"] for r in ok]
+    classes = Counter(d["class_name"] for r in ok for d in r["detections"])
+
+    report = {
+        "photos": len(runs),
+        "failed": len(runs) - len(ok),
+        "wall_seconds": round(wall, 3),
+        "throughput_per_s": round(len(ok) / wall, 3) if wall > 0 else 0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0,
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "max": round(max(latencies) * 1000, 1) if latencies else 0,
+        },
+        "class_counts": dict(classes.most_common()),
+    }
+
+    compared = [r for r in ok if r["stored"] is not None]
+    if compared:
+        matched = sum(match_boxes(r["detections"], r["stored"], min_iou) for r in compared)
+        predicted = sum(len(r["detections"]) for r in compared)
+        stored = sum(len(r["stored"]) for r in compared)
+        precision = matched / predicted if predicted else 1.0
+        recall = matched / stored if stored else 1.0
+        same_classes = sum(
+            {d["class_name"] for d in r["detections"]} == {d["class_name"] for d in r["stored"]}
+            for r in compared
+        )
+        report["agreement"] = {
+            "photos_compared": len(compared),
+            "min_iou": min_iou,
+            "precision": round(precision, 4),
+            "recall": round(recall, 4),
+            "f1": round(2 * precision * recall / (precision + recall), 4) if precision + recall else 0,
+            "same_classes": round(same_classes / len(compared), 4),
+        }
+    return report
+
+# ---------------------------------------------------------
+# Replay
+# ---------------------------------------------------------
+
+async def replay(items: List[dict], backend: str, concurrency: int, repeat: int = 1) -> Tuple[List[dict], float]:
+    """
+    Run every item through the backend; latency covers preprocessing and
+    the detector call (reading/downloading the photo is not timed)
+
+    Returns:
+        (one run record per item and repeat, wall-clock seconds)
+    """
+    detector = get_detector(backend)
+    get_scheduler().limit = concurrency
+    semaphore = asyncio.Semaphore(concurrency)
+    runs = []
+
+    async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as client:
+        async def run(item: dict):
+            async with semaphore:
+                record = {"id": item["id"], "stored": item["stored"], "detections": [], "latency": 0.0, "error": None}
+                try:
+                    data = await _read(client, item["source"])
+                    if not data:
+                        raise ValueError("could not read photo")
+                    started = time.perf_counter()
+                    result = await detect_image(client, data, detector, "bench")
+                    record["latency"] = time.perf_counter() - started
+                    record["detections"] = normalize_detections(result.get("detections"))
+                except DetectorUnavailable:
+                    raise
+                except Exception as e:
+                    record["error"] = str(e) or e.__class__.__name__
+                runs.append(record)
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            await asyncio.gather(*[run(item) for item in items])
+        wall = time.perf_counter() - started
+
+    return runs, wall
+
+def _print_report(report: dict, backend: str, concurrency: int):
+    latency = report["latency_ms"]
+    print(f"\nBackend {backend}, concurrency {concurrency}")
+    print(f"  photos      {report['photos']} ({report['failed']} failed) in {report['wall_seconds']}s")
+    print(f"  throughput  {report['throughput_per_s']} photos/s")
+    print(f"  latency ms  mean {latency['mean']}  p50 {latency['p50']}  p95 {latency['p95']}"
+          f"  p99 {latency['p99']}  max {latency['max']}")
+    print("  classes     " + (", ".join(f"{c} {n}" for c, n in report["class_counts"].items()) or "none"))
+    if "agreement" in report:
+        a = report["agreement"]
+        print(f"  agreement   {a['photos_compared']} photos, IoU >= {a['min_iou']}: precision {a['precision']}"
+              f"  recall {a['recall']}  F1 {a['f1']}  same classes {a['same_classes']}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay stored photos through a detector backend")
+    parser.add_argument("input", help="Directory of images, or a .txt/.json/.jsonl/.csv list of photos")
+    parser.add_argument("--backend", default=DETECTOR_BACKEND, choices=sorted(BACKENDS))
+    parser.add_argument("--concurrency", type=int, default=4, help="Detector calls in flight")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the set this many times")
+    parser.add_argument("--limit", type=int, help="Only the first N photos")
+    parser.add_argument("--baseline", help="Stored results to compare with (e.g. an earlier --save)")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU for two boxes to agree")
+    parser.add_argument("--save", help="Write this run's detections (usable as a later --baseline)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    items = load_items(args.input)[:args.limit]
+    if not items:
+        print(f"No photos found in {args.input}", file=sys.stderr)
+        return 1
+    if args.baseline:
+        baseline = load_baseline(args.baseline)
+        for item in items:
+            item["stored"] = baseline.get(item["id"], item["stored"])
+
+    try:
+        runs, wall = asyncio.run(replay(items, args.backend, max(1, args.concurrency), max(1, args.repeat)))
+    except DetectorUnavailable as e:
+        print(f"Detector unavailable: {e}", file=sys.stderr)
+        return 2
+    finally:
+        shutdown_pool()
+
+    report = summarize_run(runs, wall, args.iou)
+    if args.save:
+        first = {}
+        for r in runs:
+            first.setdefault(r["id"], r)
+        sources = {item["id"]: item["source"] for item in items}
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"backend": args.backend, "report": report, "results": [
+                {"id": r["id"], "source": sources[r["id"]], "detections": r["detections"]}
+                for r in first.values() if r["error"] is None
+            ]}, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report, args.backend, args.concurrency)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
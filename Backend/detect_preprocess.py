@@ -0,0 +1,87 @@
+# detect_preprocess.py
+"""
+Detector Input Preprocessing - Pillow
+YOLO resizes every image to its input size anyway, so instead of sending raw
+camera files (or making the Space download them) photos are EXIF-oriented,
+letterboxed to DETECTOR_INPUT_SIZE and JPEG-encoded here, on the shared
+worker pool. Boxes returned for the letterboxed image are mapped back to the
+pixels of the oriented original.
+"""
+
+from typing import Dict, List, Tuple
+import io
+import os
+from PIL import Image, ImageOps
+
+from report_assets import to_rgb
+from worker_pool import run_in_pool
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+# Square model input (YOLO default imgsz)
+DETECTOR_INPUT_SIZE = int(os.environ.get("DETECTOR_INPUT_SIZE", "640"))
+
+DETECTOR_JPEG_QUALITY = int(os.environ.get("DETECTOR_JPEG_QUALITY", "90"))
+
+# Ultralytics letterbox padding colour
+PAD_COLOR = (114, 114, 114)
+
+# ---------------------------------------------------------
+# Letterbox
+# ---------------------------------------------------------
+
+def letterbox(data: bytes, size: int = DETECTOR_INPUT_SIZE,
+              quality: int = DETECTOR_JPEG_QUALITY) -> Tuple[bytes, Dict[str, float]]:
+    """
+    Fit the oriented photo into a size x size square (aspect kept, centred, padded)
+
+    Returns:
+        (JPEG bytes, {"scale", "pad_x", "pad_y", "width", "height"}) where
+        width/height are the oriented original's
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        raw_width = img.width
+        # JPEGs can be decoded at 1/2..1/8 scale directly, much cheaper than a full decode
+        img.draft("RGB", (size, size))
+        draft_ratio = img.width / raw_width
+        img = ImageOps.exif_transpose(img)
+        width, height = round(img.width / draft_ratio), round(img.height / draft_ratio)
+        img = to_rgb(img)
+
+        scale = min(size / width, size / height)
+        new_w, new_h = max(1, round(width * scale)), max(1, round(height * scale))
+        img = img.resize((new_w, new_h), Image.BILINEAR)
+
+        pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+        canvas = Image.new("RGB", (size, size), PAD_COLOR)
+        canvas.paste(img, (pad_x, pad_y))
+
+        out = io.BytesIO()
+        canvas.save(out, format="JPEG", quality=quality)
+        meta = {"scale": scale, "pad_x": pad_x, "pad_y": pad_y, "width": width, "height": height}
+        return out.getvalue(), meta
+
+async def prepare_for_detection(data: bytes) -> Tuple[bytes, Dict[str, float]]:
+    """letterbox() on the worker pool"""
+    return await run_in_pool(letterbox, data)
+
+def rescale_detections(detections: List[dict], meta: Dict[str, float]) -> List[dict]:
+    """Map [x1, y1, x2, y2] from the letterboxed image back to the original"""
+    rescaled = []
+    for d in detections or []:
+        bbox = d.get("bbox") or []
+        if len(bbox) != 4:
+            continue
+        x1, y1, x2, y2 = bbox
+        rescaled.append({
+            **d,
+            "bbox": [
+                min(max((x1 - meta["pad_x"]) / meta["scale"], 0), meta["width"]),
+                min(max((y1 - meta["pad_y"]) / meta["scale"], 0), meta["height"]),
+                min(max((x2 - meta["pad_x"]) / meta["scale"], 0), meta["width"]),
+                min(max((y2 - meta["pad_y"]) / meta["scale"], 0), meta["height"]),
+            ]
+        })
+    return rescaled
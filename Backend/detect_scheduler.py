@@ -0,0 +1,182 @@
+# detect_scheduler.py
+"""
+Detection Scheduler - fair access to the detector
+Every call to a detector backend takes a slot here. At most
+DETECTOR_MAX_INFLIGHT calls run at once across all requests; waiting calls
+are served by priority class first (an inspector's redetect click before
+batch runs, batch runs before the offline queue), and within a class
+round-robin per tenant (the inspection's inspector), so one 200-photo
+inspection cannot starve a colleague.
+"""
+
+from typing import Deque, Dict, Optional
+import os
+import time
+import asyncio
+import weakref
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from supabase import create_client, Client
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Created on the first tenant lookup: the scheduler itself needs no database,
+# so offline tools (detect_bench.py) run without Supabase credentials
+supabase: Optional[Client] = None
+
+def _get_supabase() -> Client:
+    global supabase
+    if supabase is None:
+        url = os.environ.get("SUPABASE_URL")
+        key = os.environ.get("SUPABASE_ANON_KEY")
+
+        if not url:
+            raise ValueError("SUPABASE_URL environment variable is not set.")
+        if not key:
+            raise ValueError("SUPABASE_ANON_KEY environment variable is not set.")
+
+        supabase = create_client(url, key)
+    return supabase
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+# Detector calls in flight at the same time, across all requests
+DETECTOR_MAX_INFLIGHT = int(os.environ.get("DETECTOR_MAX_INFLIGHT", "4"))
+
+# Priority classes (lower is served first)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch", PRIORITY_BACKGROUND: "background"}
+
+# Waits kept per class for the wait-time percentiles
+WAIT_SAMPLES = 500
+
+# ---------------------------------------------------------
+# Scheduler
+# ---------------------------------------------------------
+
+class DetectionScheduler:
+    """Priority classes with per-tenant round-robin under a global slot limit"""
+
+    def __init__(self, limit: int = DETECTOR_MAX_INFLIGHT):
+        self.limit = max(1, limit)
+        self.inflight = 0
+        # priority -> tenant -> waiting futures; tenant order is the round-robin order
+        self._waiting: Dict[int, "OrderedDict[str, Deque[asyncio.Future]]"] = {
+            p: OrderedDict() for p in PRIORITY_NAMES
+        }
+        self._enqueued_at: Dict[asyncio.Future, float] = {}
+        self._waits: Dict[int, Deque[float]] = {p: deque(maxlen=WAIT_SAMPLES) for p in PRIORITY_NAMES}
+        self._served: Dict[int, int] = {p: 0 for p in PRIORITY_NAMES}
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for priority, tenants in self._waiting.items():
+            while tenants:
+                tenant, waiters = next(iter(tenants.items()))
+                future = waiters.popleft()
+                # Tenant goes to the back of its class
+                del tenants[tenant]
+                if waiters:
+                    tenants[tenant] = waiters
+                if not future.done():
+                    return future
+        return None
+
+    def _dispatch(self):
+        while self.inflight < self.limit:
+            future = self._next_waiter()
+            if future is None:
+                return
+            self.inflight += 1
+            future.set_result(None)
+
+    def _remove(self, future: asyncio.Future, priority: int, tenant: str):
+        waiters = self._waiting[priority].get(tenant)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del self._waiting[priority][tenant]
+
+    def _record(self, priority: int, waited: float):
+        self._waits[priority].append(waited)
+        self._served[priority] += 1
+
+    @asynccontextmanager
+    async def slot(self, tenant: str = "system", priority: int = PRIORITY_BATCH):
+        """Hold one detector slot for the duration of the block"""
+        started = time.monotonic()
+        if self.inflight < self.limit and not any(self._waiting.values()):
+            self.inflight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiting[priority].setdefault(tenant, deque()).append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Granted just as we were cancelled: hand the slot on
+                    self.inflight -= 1
+                    self._dispatch()
+                else:
+                    self._remove(future, priority, tenant)
+                raise
+        self._record(priority, time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self._dispatch()
+
+    def stats(self) -> dict:
+        """Queue depth and wait times (seconds) per priority class"""
+        classes = {}
+        for priority, name in PRIORITY_NAMES.items():
+            waits = sorted(self._waits[priority])
+            tenants = self._waiting[priority]
+            classes[name] = {
+                "waiting": sum(len(w) for w in tenants.values()),
+                "waiting_by_tenant": {t: len(w) for t, w in tenants.items()},
+                "served": self._served[priority],
+                "wait_avg": round(sum(waits) / len(waits), 3) if waits else 0,
+                "wait_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0,
+                "wait_max": round(waits[-1], 3) if waits else 0,
+            }
+        return {"limit": self.limit, "inflight": self.inflight, "classes": classes}
+
+# One scheduler per event loop (futures cannot be shared between loops)
+_schedulers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, DetectionScheduler]" = weakref.WeakKeyDictionary()
+
+def get_scheduler() -> DetectionScheduler:
+    loop = asyncio.get_running_loop()
+    if loop not in _schedulers:
+        _schedulers[loop] = DetectionScheduler()
+    return _schedulers[loop]
+
+# ---------------------------------------------------------
+# Tenants
+# ---------------------------------------------------------
+
+_inspection_tenants: Dict[int, str] = {}
+
+def tenant_for_inspection(inspection_id: Optional[int]) -> str:
+    """Fair-queuing key for an inspection: its inspector (cached)"""
+    if not inspection_id:
+        return "system"
+    if inspection_id not in _inspection_tenants:
+        tenant = f"inspection:{inspection_id}"
+        try:
+            res = _get_supabase().table("Inspection")\
+                .select("UserID_Inspector")\
+                .eq("InspectionID", inspection_id)\
+                .execute()
+            if res.data and res.data[0].get("UserID_Inspector"):
+                tenant = f"user:{res.data[0]['UserID_Inspector']}"
+        except Exception as e:
+            print(f"⚠️ Could not look up inspector of inspection {inspection_id}: {e}")
+            return tenant
+        _inspection_tenants[inspection_id] = tenant
+    return _inspection_tenants[inspection_id]
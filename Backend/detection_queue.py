@@ -0,0 +1,332 @@
+# detection_queue.py
+"""
+Offline Detection Queue - SQLite
+Photos whose detection failed (detector down, Space asleep, timeout) or was
+never attempted are kept in a local SQLite queue instead of being written as
+"Detection failed" findings. A background worker retries them with
+exponential backoff once the detector reports healthy, and applies the
+results to the photo they belong to (skipped if the photo changed).
+
+One job per photo: queueing a photo again only refreshes its job. Jobs of
+the rerun-outdated maintenance run are queued with a lower priority than
+failed detections, go through the same rate-limited rounds, and are not
+applied to photos signed off or edited by hand meanwhile.
+"""
+
+from typing import Dict, Iterable, List, Optional
+import os
+import time
+import sqlite3
+import asyncio
+import traceback
+from contextlib import closing
+import httpx
+
+from detector import DETECT_CONCURRENCY, detect_photo, get_detector, normalize_detections
+from detect_scheduler import PRIORITY_BACKGROUND, tenant_for_inspection
+from detection_results import DETECTION_PHOTO_COLUMNS, apply_detections, supabase
+from photo_annotations import render_many
+from report_cache import refresh_reports_many
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+QUEUE_DB_PATH = os.environ.get(
+    "DETECTION_QUEUE_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "detection_queue.sqlite3")
+)
+
+# How often the worker looks for due jobs (seconds)
+QUEUE_POLL_SECONDS = int(os.environ.get("DETECTION_QUEUE_POLL_SECONDS", "30"))
+
+# Jobs taken per worker round
+QUEUE_BATCH_SIZE = int(os.environ.get("DETECTION_QUEUE_BATCH_SIZE", "16"))
+
+# Backoff after a failed attempt: base * 2^(attempts-1), capped
+RETRY_BASE_SECONDS = int(os.environ.get("DETECTION_RETRY_BASE_SECONDS", "60"))
+RETRY_MAX_SECONDS = int(os.environ.get("DETECTION_RETRY_MAX_SECONDS", "3600"))
+
+# Jobs are parked as "dead" after this many failed attempts
+MAX_ATTEMPTS = int(os.environ.get("DETECTION_MAX_ATTEMPTS", "20"))
+
+# Job priorities (lower is claimed first)
+JOB_RETRY = 0   # detection failed or was never attempted
+JOB_RERUN = 1   # result from an outdated model/threshold
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS detection_jobs (
+    photo_id        INTEGER PRIMARY KEY,
+    inspection_id   INTEGER NOT NULL,
+    photo_url       TEXT NOT NULL,
+    status          TEXT NOT NULL DEFAULT 'pending',  -- pending | running | dead
+    priority        INTEGER NOT NULL DEFAULT 0,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error      TEXT,
+    created_at      REAL NOT NULL,
+    updated_at      REAL NOT NULL
+);
+"""
+
+_INDEX = "CREATE INDEX IF NOT EXISTS detection_jobs_due ON detection_jobs (status, priority, next_attempt_at);"
+
+_worker: Optional[asyncio.Task] = None
+
+# ---------------------------------------------------------
+# Storage
+# ---------------------------------------------------------
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(QUEUE_DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(QUEUE_DB_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    # Queues created before job priorities
+    columns = [row["name"] for row in conn.execute("PRAGMA table_info(detection_jobs)")]
+    if "priority" not in columns:
+        conn.execute("ALTER TABLE detection_jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+        conn.execute("DROP INDEX IF EXISTS detection_jobs_due")
+    conn.execute(_INDEX)
+    return conn
+
+def enqueue(photos: Iterable[dict], error: Optional[str] = None, priority: int = JOB_RETRY) -> int:
+    """
+    Queue photos ({PhotoID, InspectionID, PhotoURL}) for detection
+
+    A photo already queued keeps its job (and the higher of the two
+    priorities); a new image resets its attempts and a dead job is revived.
+    """
+    now = time.time()
+    rows = [
+        (p["PhotoID"], p["InspectionID"], p["PhotoURL"], priority, now, error, now, now)
+        for p in photos if p.get("PhotoID") and p.get("PhotoURL")
+    ]
+    if not rows:
+        return 0
+    with closing(_connect()) as conn, conn:
+        conn.executemany("""
+            INSERT INTO detection_jobs
+                (photo_id, inspection_id, photo_url, priority, next_attempt_at, last_error, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (photo_id) DO UPDATE SET
+                attempts = CASE WHEN photo_url != excluded.photo_url OR status = 'dead' THEN 0 ELSE attempts END,
+                next_attempt_at = CASE WHEN photo_url != excluded.photo_url OR status = 'dead'
+                                       THEN excluded.next_attempt_at ELSE next_attempt_at END,
+                status = CASE WHEN status = 'running' THEN status ELSE 'pending' END,
+                priority = MIN(priority, excluded.priority),
+                inspection_id = excluded.inspection_id,
+                photo_url = excluded.photo_url,
+                last_error = COALESCE(excluded.last_error, last_error),
+                updated_at = excluded.updated_at
+        """, rows)
+    print(f"📥 Queued {len(rows)} photo(s) for detection")
+    return len(rows)
+
+def discard(photo_ids: Iterable[int]):
+    """Drop jobs (photo detected another way, or deleted)"""
+    ids = [(p,) for p in photo_ids if p]
+    if ids:
+        with closing(_connect()) as conn, conn:
+            conn.executemany("DELETE FROM detection_jobs WHERE photo_id = ?", ids)
+
+def _claim_due(limit: int) -> List[sqlite3.Row]:
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        jobs = conn.execute("""
+            SELECT * FROM detection_jobs
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY priority, next_attempt_at LIMIT ?
+        """, (now, limit)).fetchall()
+        conn.executemany(
+            "UPDATE detection_jobs SET status = 'running', updated_at = ? WHERE photo_id = ?",
+            [(now, job["photo_id"]) for job in jobs]
+        )
+    return jobs
+
+def _retry_later(photo_id: int, error: str):
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        row = conn.execute("SELECT attempts FROM detection_jobs WHERE photo_id = ?", (photo_id,)).fetchone()
+        if not row:
+            return
+        attempts = row["attempts"] + 1
+        delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+        conn.execute("""
+            UPDATE detection_jobs
+            SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ?
+            WHERE photo_id = ?
+        """, ("dead" if attempts >= MAX_ATTEMPTS else "pending", attempts, now + delay, error[:500], now, photo_id))
+
+def _has_due() -> bool:
+    with closing(_connect()) as conn:
+        return conn.execute(
+            "SELECT 1 FROM detection_jobs WHERE status = 'pending' AND next_attempt_at <= ? LIMIT 1",
+            (time.time(),)
+        ).fetchone() is not None
+
+def _recover_running():
+    """Jobs left 'running' by a crash or restart go back to pending"""
+    with closing(_connect()) as conn, conn:
+        conn.execute("UPDATE detection_jobs SET status = 'pending' WHERE status = 'running'")
+
+def _unclaim(photo_ids: Iterable[int]):
+    """Claimed jobs a round did not finish go back to pending, due at once"""
+    with closing(_connect()) as conn, conn:
+        conn.executemany(
+            "UPDATE detection_jobs SET status = 'pending', updated_at = ? WHERE photo_id = ? AND status = 'running'",
+            [(time.time(), p) for p in photo_ids]
+        )
+
+def queue_stats() -> dict:
+    with closing(_connect()) as conn:
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM detection_jobs GROUP BY status").fetchall())
+        reruns = conn.execute(
+            "SELECT COUNT(*) FROM detection_jobs WHERE status = 'pending' AND priority = ?", (JOB_RERUN,)
+        ).fetchone()[0]
+        next_due = conn.execute(
+            "SELECT MIN(next_attempt_at) FROM detection_jobs WHERE status = 'pending'"
+        ).fetchone()[0]
+    return {
+        "pending": counts.get("pending", 0),
+        "running": counts.get("running", 0),
+        "dead": counts.get("dead", 0),
+        "reruns_pending": reruns,
+        "next_attempt_in": max(0, round(next_due - time.time())) if next_due is not None else None,
+    }
+
+# ---------------------------------------------------------
+# Worker
+# ---------------------------------------------------------
+
+async def process_due() -> Dict[str, int]:
+    """
+    Run one round of due jobs if the detector is healthy
+
+    Returns:
+        {"done", "failed", "skipped"} counts
+    """
+    counts = {"done": 0, "failed": 0, "skipped": 0}
+    if not _has_due():
+        return counts
+
+    detector = get_detector()
+    health = await detector.health()
+    if health.get("status") != "healthy":
+        print(f"⏸️ Detection queue waiting, detector '{detector.name}' is not healthy")
+        return counts
+
+    jobs = _claim_due(QUEUE_BATCH_SIZE)
+    if not jobs:
+        return counts
+
+    try:
+        touched = await _run_jobs(jobs, detector, counts)
+    finally:
+        # Finished jobs were discarded or rescheduled; anything still 'running'
+        # (the round failed or was cancelled part way) must not wait for a restart
+        _unclaim([job["photo_id"] for job in jobs])
+
+    print(f"📤 Detection queue round: {counts}")
+    if touched:
+        await refresh_reports_many(touched)
+    return counts
+
+async def _run_jobs(jobs: List[sqlite3.Row], detector, counts: Dict[str, int]) -> set:
+    """
+    Detect and apply claimed jobs, updating counts
+
+    Returns:
+        InspectionIDs whose photos were updated
+    """
+    response = await asyncio.to_thread(
+        supabase.table("PhotoReport")
+        .select(DETECTION_PHOTO_COLUMNS)
+        .in_("PhotoID", [job["photo_id"] for job in jobs])
+        .execute
+    )
+    rows = response.data or []
+    photos = {row["PhotoID"]: row for row in rows}
+
+    # Deleted photos have nothing left to detect
+    gone = [job["photo_id"] for job in jobs if job["photo_id"] not in photos or not photos[job["photo_id"]].get("PhotoURL")]
+    discard(gone)
+    counts["skipped"] = len(gone)
+
+    semaphore = asyncio.Semaphore(DETECT_CONCURRENCY)
+    async with httpx.AsyncClient(timeout=300.0, follow_redirects=True) as client:
+        async def detect(photo: dict):
+            async with semaphore:
+                try:
+                    result = await detect_photo(
+                        client, photo["PhotoURL"], detector,
+                        tenant_for_inspection(photo["InspectionID"]), PRIORITY_BACKGROUND
+                    )
+                    if result.get("success") is False:
+                        raise RuntimeError(result.get("error") or "detector reported failure")
+                    # Stored boxes use the same shape as every other detection path
+                    result["detections"] = normalize_detections(result.get("detections"))
+                    return photo, result, None
+                except Exception as e:
+                    return photo, None, str(e) or e.__class__.__name__
+
+        outcomes = await asyncio.gather(*[detect(p) for p in photos.values() if p["PhotoID"] not in gone])
+
+    succeeded = [(photo, result) for photo, result, error in outcomes if result is not None]
+    annotated_urls = await render_many([
+        {"PhotoID": photo["PhotoID"], "PhotoURL": photo["PhotoURL"], "Detections": result.get("detections") or []}
+        for photo, result in succeeded
+    ])
+
+    failures = [(photo, error) for photo, result, error in outcomes if result is None]
+    reruns = {job["photo_id"] for job in jobs if job["priority"] == JOB_RERUN}
+    try:
+        applied = set()
+        for rerun in (False, True):
+            applied.update(await asyncio.to_thread(apply_detections, [
+                (photo, result, annotated_urls.get(photo["PhotoID"]))
+                for photo, result in succeeded if (photo["PhotoID"] in reruns) == rerun
+            ], rerun))
+        # Photos changed since they were queued need no result either
+        discard([photo["PhotoID"] for photo, _ in succeeded])
+        counts["done"] = len(applied)
+        counts["skipped"] += len(succeeded) - len(applied)
+    except Exception as e:
+        applied = set()
+        failures += [(photo, str(e)) for photo, _ in succeeded]
+
+    for photo, error in failures:
+        print(f"  ❌ Queued detection failed for photo {photo['PhotoID']}: {error}")
+        _retry_later(photo["PhotoID"], error)
+        counts["failed"] += 1
+
+    return {photo["InspectionID"] for photo, _ in succeeded if photo["PhotoID"] in applied}
+
+async def _run_worker():
+    _recover_running()
+    while True:
+        try:
+            await process_due()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Detection queue worker error: {e}")
+            traceback.print_exc()
+        await asyncio.sleep(QUEUE_POLL_SECONDS)
+
+def start_worker():
+    """Start the background worker (app startup)"""
+    global _worker
+    if _worker is None or _worker.done():
+        _worker = asyncio.get_running_loop().create_task(_run_worker())
+
+async def stop_worker():
+    global _worker
+    if _worker is not None:
+        _worker.cancel()
+        try:
+            await _worker
+        except asyncio.CancelledError:
+            pass
+        _worker = None
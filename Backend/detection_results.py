@@ -0,0 +1,280 @@
+# detection_results.py
+"""
+Detection Results
+Writes detector results to photos: their Finding and Recommendation (reused
+when the photo already has them, so re-running does not pile up rows, and
+written in bulk for many photos) and the PhotoReport AI columns. Shared by
+the detection endpoints and the offline detection queue.
+
+Each result is stamped with the image it was computed on (DetectedPhotoURL),
+the model that produced it (DetectionModel) and the confidence threshold it
+was filtered with (DetectionThreshold), so incremental runs and the
+rerun-outdated maintenance job only send photos whose result is out of date.
+The text it wrote is stamped too (DetectionTextHash): reruns never touch a
+Finding/Recommendation an inspector edited by hand, nor photos of completed
+or approved inspections.
+"""
+
+from typing import List, Optional, Tuple
+import os
+import hashlib
+from datetime import datetime
+from supabase import create_client, Client
+from dotenv import load_dotenv
+
+from detector import summarize
+
+load_dotenv()
+
+# Initialize Supabase
+url = os.environ.get("SUPABASE_URL")
+key = os.environ.get("SUPABASE_ANON_KEY")
+
+if not url:
+    raise ValueError("SUPABASE_URL environment variable is not set.")
+if not key:
+    raise ValueError("SUPABASE_ANON_KEY environment variable is not set.")
+
+supabase: Client = create_client(url, key)
+
+# PhotoReport columns apply_detection() needs
+DETECTION_PHOTO_COLUMNS = "PhotoID, InspectionID, PhotoURL, FindingID, RecommendID"
+
+# Rows read per request when scanning for outdated results
+OUTDATED_PAGE_SIZE = 1000
+
+# Inspections whose report is signed off; reruns leave their photos alone
+SIGNED_OFF_STATUSES = ("Completed", "Approved")
+
+# What reruns need to tell hand-edited text and signed-off inspections apart
+_RERUN_COLUMNS = (
+    "Detections, DetectionTextHash, Inspection!inner(Status), "
+    "Finding(Description), Recommendation(Description)"
+)
+
+# ---------------------------------------------------------
+# Helper Functions
+# ---------------------------------------------------------
+
+def deduplicate_detection_text(text: str) -> str:
+    """
+    Remove duplicate detection messages from text.
+    If the same sentence is repeated multiple times, keep only one instance.
+    For example: "Surface corrosion and rust detected on metal surface. Surface corrosion..."
+    becomes: "Surface corrosion and rust detected on metal surface."
+    """
+    if not text:
+        return text
+
+    # Split by period and filter out empty strings
+    sentences = [s.strip() for s in text.split('.') if s.strip()]
+
+    # Remove duplicates while preserving order (using dict to maintain insertion order in Python 3.7+)
+    unique_sentences = list(dict.fromkeys(sentences))
+
+    # Join back with periods and add final period
+    return '. '.join(unique_sentences) + '.' if unique_sentences else text
+
+def _upsert_texts(table: str, id_column: str, entries: List[Tuple[Optional[int], str]]) -> List[int]:
+    """
+    Write Descriptions in bulk: rows that exist are updated (one upsert),
+    the rest created (one insert)
+
+    Args:
+        entries: (existing id or None, text) per photo
+
+    Returns:
+        Row id per entry
+    """
+    ids: List[Optional[int]] = [existing_id for existing_id, _ in entries]
+
+    # Photos sharing a row would make one upsert touch it twice; last text wins
+    updates = {existing_id: text for existing_id, text in entries if existing_id}
+    if updates:
+        supabase.table(table)\
+            .upsert([{id_column: existing_id, "Description": text} for existing_id, text in updates.items()])\
+            .execute()
+
+    new = [i for i, (existing_id, _) in enumerate(entries) if not existing_id]
+    if new:
+        response = supabase.table(table).insert([{"Description": entries[i][1]} for i in new]).execute()
+        if len(response.data or []) != len(new):
+            raise RuntimeError(f"Failed to create {table} rows")
+        for i, row in zip(new, response.data):
+            ids[i] = row[id_column]
+    return ids
+
+def detection_text_hash(finding: str, recommendation: str) -> str:
+    """Stamp of the Finding/Recommendation text a detection wrote"""
+    payload = f"{(finding or '').strip()}\n{(recommendation or '').strip()}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def _result_texts(result: dict) -> Tuple[str, str]:
+    return (
+        deduplicate_detection_text(result.get("finding", "No finding description")),
+        deduplicate_detection_text(result.get("recommendation", "No recommendation")),
+    )
+
+def is_hand_edited(photo: dict) -> bool:
+    """
+    True if the photo's Finding/Recommendation no longer hold the detector's text
+
+    Args:
+        photo: PhotoReport row with DetectionTextHash, Detections and the
+               embedded Finding(Description)/Recommendation(Description)
+    """
+    current = detection_text_hash(
+        (photo.get("Finding") or {}).get("Description"),
+        (photo.get("Recommendation") or {}).get("Description"),
+    )
+    if photo.get("DetectionTextHash"):
+        return current != photo["DetectionTextHash"]
+    # Detected before the text was stamped: compare with the text its boxes produce
+    return current != detection_text_hash(*_result_texts(summarize(photo.get("Detections") or [])))
+
+def is_signed_off(photo: dict) -> bool:
+    return (photo.get("Inspection") or {}).get("Status") in SIGNED_OFF_STATUSES
+
+def is_outdated(photo: dict, model_version: str, threshold: float) -> bool:
+    """True if the photo's result came from another model or threshold"""
+    stored_threshold = photo.get("DetectionThreshold")
+    if stored_threshold is None or abs(float(stored_threshold) - threshold) > 1e-6:
+        return True
+    return photo.get("DetectionModel") != model_version
+
+def needs_detection(photo: dict, model_version: str, threshold: float) -> bool:
+    """
+    True if the photo has no result for its current image, model and threshold
+
+    Args:
+        photo: PhotoReport row with PhotoURL, AIDetectionDate,
+               DetectedPhotoURL, DetectionModel and DetectionThreshold
+        model_version: Detector.model_version of the backend about to run
+        threshold: Confidence threshold it will be filtered with
+    """
+    if not photo.get("AIDetectionDate"):
+        return True
+    if (photo.get("DetectedPhotoURL") or "").split("?")[0] != (photo.get("PhotoURL") or "").split("?")[0]:
+        return True
+    return is_outdated(photo, model_version, threshold)
+
+def outdated_photos(model_version: str, threshold: float,
+                    inspection_id: Optional[int] = None) -> Tuple[List[dict], List[dict]]:
+    """
+    Detected photos (DETECTION_PHOTO_COLUMNS) whose result is_outdated()
+
+    Photos of completed or approved inspections are not considered.
+
+    Returns:
+        (photos to re-detect, photos left alone because their text was edited by hand)
+    """
+    outdated, edited = [], []
+    start = 0
+    while True:
+        query = supabase.table("PhotoReport")\
+            .select(f"{DETECTION_PHOTO_COLUMNS}, DetectionModel, DetectionThreshold, {_RERUN_COLUMNS}")\
+            .not_.is_("AIDetectionDate", "null")\
+            .not_.in_("Inspection.Status", list(SIGNED_OFF_STATUSES))
+        if inspection_id:
+            query = query.eq("InspectionID", inspection_id)
+        rows = query.order("PhotoID")\
+            .range(start, start + OUTDATED_PAGE_SIZE - 1)\
+            .execute().data or []
+
+        for row in rows:
+            if not row.get("PhotoURL") or is_signed_off(row) or not is_outdated(row, model_version, threshold):
+                continue
+            (edited if is_hand_edited(row) else outdated).append(row)
+        if len(rows) < OUTDATED_PAGE_SIZE:
+            return outdated, edited
+        start += OUTDATED_PAGE_SIZE
+
+# ---------------------------------------------------------
+# Apply
+# ---------------------------------------------------------
+
+def apply_detections(items: List[Tuple[dict, dict, Optional[str]]], rerun: bool = False) -> List[int]:
+    """
+    Store successful detector results on their photos
+
+    Photos are re-read in one query, and Findings/Recommendations written in
+    bulk, reusing the rows a photo already has.
+
+    Args:
+        items: (photo, result, annotated_url) where photo is a PhotoReport
+               row (DETECTION_PHOTO_COLUMNS); a result with "shared_from"
+               was copied from a near-duplicate, so its boxes are not stored
+               on this photo
+        rerun: Results of the rerun-outdated job; photos whose inspection
+               was signed off or whose text was edited by hand since they
+               were queued are left alone
+
+    Returns:
+        PhotoIDs written; photos deleted or given a new image since
+        detection are left alone
+    """
+    if not items:
+        return []
+    response = supabase.table("PhotoReport")\
+        .select(f"{DETECTION_PHOTO_COLUMNS}, {_RERUN_COLUMNS}" if rerun else DETECTION_PHOTO_COLUMNS)\
+        .in_("PhotoID", [photo["PhotoID"] for photo, _, _ in items])\
+        .execute()
+    current = {row["PhotoID"]: row for row in response.data or []}
+
+    live = []
+    for photo, result, annotated_url in items:
+        row = current.get(photo["PhotoID"])
+        if not row or row["PhotoURL"] != photo["PhotoURL"]:
+            print(f"⚠️ Photo {photo['PhotoID']} changed since detection, result discarded")
+            continue
+        if rerun and (is_signed_off(row) or is_hand_edited(row)):
+            print(f"⚠️ Photo {photo['PhotoID']} was signed off or edited by hand, rerun result discarded")
+            continue
+        live.append((photo, result, annotated_url, row))
+    if not live:
+        return []
+
+    texts = [_result_texts(result) for _, result, _, _ in live]
+    finding_ids = _upsert_texts("Finding", "FindingID", [
+        (row.get("FindingID"), finding) for (_, _, _, row), (finding, _) in zip(live, texts)
+    ])
+    recommendation_ids = _upsert_texts("Recommendation", "RecommendID", [
+        (row.get("RecommendID"), recommendation) for (_, _, _, row), (_, recommendation) in zip(live, texts)
+    ])
+
+    detected_at = datetime.now().isoformat()
+    for (photo, result, annotated_url, _), (finding, recommendation), finding_id, recommendation_id in zip(
+        live, texts, finding_ids, recommendation_ids
+    ):
+        update_data = {
+            "FindingID": finding_id,
+            "RecommendID": recommendation_id,
+            "AIDetectionDate": detected_at,
+            "DetectedPhotoURL": photo["PhotoURL"],
+            "DetectionModel": result.get("model_version"),
+            "DetectionThreshold": result.get("threshold"),
+            "DetectionTextHash": detection_text_hash(finding, recommendation),
+        }
+        if not result.get("shared_from"):
+            update_data["Detections"] = result.get("detections") or []
+        if annotated_url:
+            update_data["AnnotatedPhotoURL"] = annotated_url
+        if result.get("detections"):
+            update_data["DetectionConfidence"] = max(d["confidence"] for d in result["detections"])
+
+        # Guarded by PhotoURL in case the image is replaced meanwhile
+        supabase.table("PhotoReport")\
+            .update(update_data)\
+            .eq("PhotoID", photo["PhotoID"])\
+            .eq("PhotoURL", photo["PhotoURL"])\
+            .execute()
+    return [photo["PhotoID"] for photo, _, _, _ in live]
+
+def apply_detection(photo: dict, result: dict, annotated_url: Optional[str] = None) -> bool:
+    """
+    apply_detections() for one photo
+
+    Returns:
+        False if the photo was deleted or its image replaced since detection
+    """
+    return bool(apply_detections([(photo, result, annotated_url)]))
@@ -0,0 +1,447 @@
+# detector.py
+"""
+Defect Detector Backends
+Detection goes through one interface with interchangeable engines, chosen by
+DETECTOR_BACKEND:
+
+    remote  - the Hugging Face Space (default)
+    onnx    - in-process CPU inference with ONNX Runtime (YOLOv8 export),
+              loaded on first use and unloaded when idle
+    stub    - deterministic fake boxes derived from the image bytes, for
+              tests and benchmarks without network access
+
+Every backend receives the letterboxed JPEG from detect_preprocess and
+returns boxes in that image's pixels; detect_photo() maps them back to the
+original photo.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from abc import ABC, abstractmethod
+import io
+import os
+import time
+import asyncio
+import hashlib
+import threading
+import httpx
+
+from detect_preprocess import DETECTOR_INPUT_SIZE, prepare_for_detection, rescale_detections
+from detect_scheduler import PRIORITY_BATCH, get_scheduler
+from image_fetch import fetch_image
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+DETECTOR_BACKEND = os.environ.get("DETECTOR_BACKEND", "remote").lower()
+
+# URL to your Hugging Face Space API
+HF_SPACE_URL = os.environ.get(
+    "HF_SPACE_URL",
+    "https://symmetrixs-edaa.hf.space"
+)
+
+# Timeout for API requests (seconds)
+API_TIMEOUT = 120
+
+# Bump when the deployed model changes; results stamped with another version
+# are detected again by incremental batch runs
+DETECTOR_MODEL_VERSION = os.environ.get("DETECTOR_MODEL_VERSION", "1")
+
+# Photos one batch request prepares at the same time (the detector calls
+# themselves are limited across requests by detect_scheduler)
+DETECT_CONCURRENCY = int(os.environ.get("DETECT_CONCURRENCY", "4"))
+
+# Minimum confidence kept. Applied here to every backend's boxes (the Space
+# filters with its own, lower one) and stored with each result.
+CONFIDENCE_THRESHOLD = float(os.environ.get("DETECTION_CONFIDENCE", "0.5"))
+
+# ONNX Runtime engine
+ONNX_MODEL_PATH = os.environ.get("DETECTOR_ONNX_MODEL", "models/defects.onnx")
+ONNX_THREADS = int(os.environ.get("DETECTOR_ONNX_THREADS", "2"))
+# Refuse to load a model file bigger than this. Only the .onnx file size is
+# checked; memory used while running is not capped.
+ONNX_MAX_MODEL_FILE_MB = int(os.environ.get("DETECTOR_ONNX_MAX_FILE_MB", "150"))
+# Free the session after this many idle seconds (0 = keep loaded)
+ONNX_IDLE_UNLOAD = int(os.environ.get("DETECTOR_ONNX_IDLE_SECONDS", "600"))
+IOU_THRESHOLD = float(os.environ.get("DETECTOR_IOU", "0.45"))
+
+DEFECT_MAPPINGS = {
+    "corrosion": {
+        "finding": "Surface corrosion and rust detected on metal surface.",
+        "recommendation": "Clean affected area and apply anti-corrosion coating. Monitor for progression."
+    },
+    "dents": {
+        "finding": "Surface deformation/dent observed on structure.",
+        "recommendation": "Assess depth and structural impact. Repair or replace if compromising integrity."
+    },
+    "scratch_mark": {
+        "finding": "Scratch marks detected on surface.",
+        "recommendation": "Evaluate depth. Apply protective coating if surface integrity is compromised."
+    },
+    "welding_defects": {
+        "finding": "Weld irregularity or defect detected.",
+        "recommendation": "Inspect weld quality. Re-weld if structural integrity is at risk."
+    },
+    "no_defect": {
+        "finding": "No significant defects detected.",
+        "recommendation": "Maintain routine monitoring and scheduled inspections."
+    }
+}
+
+# Model output order of the classes (local backends)
+DEFECT_CLASSES = [
+    c.strip() for c in os.environ.get(
+        "DETECTOR_CLASSES", ",".join(k for k in DEFECT_MAPPINGS if k != "no_defect")
+    ).split(",") if c.strip()
+]
+
+class DetectorUnavailable(Exception):
+    pass
+
+def failed_result(photo_id: Optional[int] = None) -> dict:
+    """Result recorded for a photo the detector could not process"""
+    result = {
+        "success": False,
+        "detections": [],
+        "finding": "Detection failed. Please review manually.",
+        "recommendation": "Manual inspection required.",
+        "detection_count": 0
+    }
+    if photo_id is not None:
+        result["photo_id"] = photo_id
+    return result
+
+def normalize_detections(detections: Optional[Iterable[dict]]) -> List[dict]:
+    """Keep only class, confidence and [x1, y1, x2, y2] (original image pixels)"""
+    cleaned = []
+    for d in detections or []:
+        bbox = d.get("bbox") or []
+        if len(bbox) != 4:
+            continue
+        cleaned.append({
+            "class_name": d.get("class_name") or "defect",
+            "confidence": round(float(d.get("confidence") or 0), 4),
+            "bbox": [round(float(v), 1) for v in bbox],
+        })
+    return cleaned
+
+def summarize(detections: List[dict]) -> dict:
+    """Finding/recommendation text for a set of boxes (most confident class first)"""
+    classes = list(dict.fromkeys(
+        d["class_name"] for d in sorted(detections, key=lambda d: -d["confidence"])
+        if d["class_name"] in DEFECT_MAPPINGS
+    )) or ["no_defect"]
+    return {
+        "success": True,
+        "detections": detections,
+        "finding": " ".join(DEFECT_MAPPINGS[c]["finding"] for c in classes),
+        "recommendation": " ".join(DEFECT_MAPPINGS[c]["recommendation"] for c in classes),
+        "detection_count": len(detections),
+    }
+
+def apply_threshold(result: dict, threshold: float = CONFIDENCE_THRESHOLD) -> dict:
+    """Drop boxes below threshold; finding/recommendation are rebuilt if any were dropped"""
+    detections = result.get("detections") or []
+    kept = [d for d in detections if float(d.get("confidence") or 0) >= threshold]
+    if len(kept) != len(detections):
+        result.update(summarize(kept))
+    return result
+
+# ---------------------------------------------------------
+# Backends
+# ---------------------------------------------------------
+
+class Detector(ABC):
+    """Backend interface"""
+
+    name = "base"
+
+    # Errors worth another attempt, and the seconds to wait before each retry.
+    # The scheduler slot is released while waiting (see _call_in_slot).
+    transient_errors: Tuple[type, ...] = ()
+    retry_delays: Tuple[float, ...] = ()
+
+    @property
+    def model_version(self) -> str:
+        """Stamp stored with each result (PhotoReport.DetectionModel)"""
+        return f"{self.name}/{DETECTOR_MODEL_VERSION}"
+
+    @abstractmethod
+    async def detect(self, client: httpx.AsyncClient, image: bytes) -> dict:
+        """Detect on a letterboxed JPEG; boxes in its pixels"""
+
+    async def detect_url(self, client: httpx.AsyncClient, photo_url: str) -> dict:
+        """Detect on a photo the backend fetches itself; boxes in original pixels"""
+        raise DetectorUnavailable(f"{self.name} detector cannot fetch photos by URL")
+
+    async def health(self) -> dict:
+        return {"status": "healthy", "connection": "ok"}
+
+class RemoteDetector(Detector):
+    """Hugging Face Space"""
+
+    name = "remote"
+
+    # Spaces may be sleeping and need time to start
+    transient_errors = (httpx.TimeoutException, httpx.ConnectError, httpx.HTTPStatusError)
+    retry_delays = (10, 20)
+
+    async def _post(self, client: httpx.AsyncClient, endpoint: str, **kwargs) -> dict:
+        url = f"{HF_SPACE_URL}{endpoint}"
+        print(f"🔄 Calling HF Space: {url}")
+        response = await client.post(url, timeout=API_TIMEOUT, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    async def detect(self, client: httpx.AsyncClient, image: bytes) -> dict:
+        return await self._post(client, "/detect-single", files={"file": ("photo.jpg", image, "image/jpeg")})
+
+    async def detect_url(self, client: httpx.AsyncClient, photo_url: str) -> dict:
+        # photo_url must be a query parameter, not JSON body
+        return await self._post(client, "/detect-by-url", params={"photo_url": photo_url})
+
+    async def health(self) -> dict:
+        try:
+            async with httpx.AsyncClient(timeout=10) as client:
+                response = await client.get(f"{HF_SPACE_URL}/health")
+            return {
+                "status": "healthy",
+                "hf_space_url": HF_SPACE_URL,
+                "hf_space_status": response.json(),
+                "connection": "ok"
+            }
+        except Exception as e:
+            return {"status": "error", "hf_space_url": HF_SPACE_URL, "error": str(e), "connection": "failed"}
+
+class OnnxDetector(Detector):
+    """
+    YOLOv8 ONNX export on ONNX Runtime (CPU)
+
+    Needs the optional onnxruntime and numpy packages and a model at
+    DETECTOR_ONNX_MODEL. The session is created on first use without the
+    CPU memory arena, and released after DETECTOR_ONNX_IDLE_SECONDS idle.
+    """
+
+    name = "onnx"
+
+    def __init__(self):
+        self._session = None
+        self._lock = threading.Lock()
+        self._last_used = 0.0
+        self._unload_task: Optional[asyncio.Task] = None
+
+    def _load(self):
+        try:
+            import numpy  # noqa: F401
+            import onnxruntime as ort
+        except ImportError:
+            raise DetectorUnavailable("onnxruntime is not installed (pip install onnxruntime numpy)")
+        if not os.path.exists(ONNX_MODEL_PATH):
+            raise DetectorUnavailable(f"ONNX model not found: {ONNX_MODEL_PATH}")
+        size_mb = os.path.getsize(ONNX_MODEL_PATH) / (1024 * 1024)
+        if size_mb > ONNX_MAX_MODEL_FILE_MB:
+            raise DetectorUnavailable(f"ONNX model file is {size_mb:.0f} MB, limit is {ONNX_MAX_MODEL_FILE_MB} MB")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = ONNX_THREADS
+        options.inter_op_num_threads = 1
+        # Allocate per run instead of keeping a growing arena
+        options.enable_cpu_mem_arena = False
+        options.enable_mem_pattern = False
+        print(f"🧠 Loading ONNX detector {ONNX_MODEL_PATH} ({size_mb:.0f} MB)")
+        return ort.InferenceSession(ONNX_MODEL_PATH, sess_options=options, providers=["CPUExecutionProvider"])
+
+    def _infer(self, image: bytes) -> List[dict]:
+        with self._lock:
+            if self._session is None:
+                self._session = self._load()
+            session = self._session
+            self._last_used = time.monotonic()
+
+            import numpy as np
+            from PIL import Image
+
+            with Image.open(io.BytesIO(image)) as img:
+                pixels = np.asarray(img.convert("RGB"), dtype=np.float32) / 255.0
+            tensor = pixels.transpose(2, 0, 1)[None]
+            output = session.run(None, {session.get_inputs()[0].name: tensor})[0][0]
+
+        # (4 + classes, N): cx, cy, w, h, class scores
+        scores = output[4:]
+        class_ids = scores.argmax(axis=0)
+        confidences = scores.max(axis=0)
+        keep = confidences >= CONFIDENCE_THRESHOLD
+        if not keep.any():
+            return []
+        cx, cy, w, h = output[:4, keep]
+        boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+        confidences, class_ids = confidences[keep], class_ids[keep]
+
+        detections = []
+        for c in np.unique(class_ids):
+            idx = np.where(class_ids == c)[0]
+            for i in _nms(boxes[idx], confidences[idx], IOU_THRESHOLD):
+                j = idx[i]
+                detections.append({
+                    "class_name": DEFECT_CLASSES[c] if c < len(DEFECT_CLASSES) else f"class_{c}",
+                    "confidence": float(confidences[j]),
+                    "bbox": [float(v) for v in boxes[j]],
+                })
+        return detections
+
+    async def _unload_when_idle(self):
+        while self._session is not None:
+            await asyncio.sleep(ONNX_IDLE_UNLOAD / 4)
+            if time.monotonic() - self._last_used >= ONNX_IDLE_UNLOAD:
+                with self._lock:
+                    self._session = None
+                print("🧠 ONNX detector unloaded (idle)")
+        self._unload_task = None
+
+    async def detect(self, client: httpx.AsyncClient, image: bytes) -> dict:
+        detections = await asyncio.to_thread(self._infer, image)
+        if ONNX_IDLE_UNLOAD and self._unload_task is None:
+            self._unload_task = asyncio.create_task(self._unload_when_idle())
+        return summarize(detections)
+
+    async def health(self) -> dict:
+        try:
+            import numpy  # noqa: F401
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            return {"status": "error", "error": "onnxruntime/numpy are not installed", "connection": "failed"}
+        if not os.path.exists(ONNX_MODEL_PATH):
+            return {"status": "error", "error": f"model not found: {ONNX_MODEL_PATH}", "connection": "failed"}
+        return {"status": "healthy", "connection": "ok", "model": ONNX_MODEL_PATH, "loaded": self._session is not None}
+
+def _nms(boxes, scores, iou_threshold: float) -> List[int]:
+    """Greedy non-maximum suppression, indices of the boxes kept"""
+    import numpy as np
+
+    order = scores.argsort()[::-1]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    kept = []
+    while order.size:
+        i = order[0]
+        kept.append(int(i))
+        xx1 = np.maximum(boxes[i, 0], boxes[order[1:], 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[order[1:], 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[order[1:], 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[order[1:], 3])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][iou <= iou_threshold]
+    return kept
+
+class StubDetector(Detector):
+    """Deterministic boxes from a hash of the image (no model, no network)"""
+
+    name = "stub"
+
+    async def detect(self, client: httpx.AsyncClient, image: bytes) -> dict:
+        digest = hashlib.sha256(image).digest()
+        size = DETECTOR_INPUT_SIZE
+        detections = []
+        for n in range(digest[0] % 3):
+            b = digest[1 + n * 5: 6 + n * 5]
+            x1, y1 = b[0] / 255 * size * 0.6, b[1] / 255 * size * 0.6
+            w, h = (0.1 + b[2] / 255 * 0.3) * size, (0.1 + b[3] / 255 * 0.3) * size
+            confidence = round(max(CONFIDENCE_THRESHOLD, 0.5 + b[4] / 510), 4)
+            detections.append({
+                "class_name": DEFECT_CLASSES[b[4] % len(DEFECT_CLASSES)] if DEFECT_CLASSES else "defect",
+                "confidence": confidence,
+                "bbox": [x1, y1, x1 + w, y1 + h],
+            })
+        return summarize(detections)
+
+BACKENDS = {
+    RemoteDetector.name: RemoteDetector,
+    OnnxDetector.name: OnnxDetector,
+    StubDetector.name: StubDetector,
+}
+
+_instances: Dict[str, Detector] = {}
+
+def get_detector(name: Optional[str] = None) -> Detector:
+    """Backend by name (DETECTOR_BACKEND by default), one instance per backend"""
+    name = (name or DETECTOR_BACKEND).lower()
+    if name not in BACKENDS:
+        raise DetectorUnavailable(f"Unknown detector backend '{name}' (choose from {sorted(BACKENDS)})")
+    if name not in _instances:
+        _instances[name] = BACKENDS[name]()
+    return _instances[name]
+
+# ---------------------------------------------------------
+# Detection
+# ---------------------------------------------------------
+
+async def _call_in_slot(detector: Detector, tenant: str, priority: int, call, *args) -> dict:
+    """
+    Run a backend call inside a detect_scheduler slot, retrying the
+    detector's transient errors
+
+    The slot is given back before each wait, so a backend that is waking up
+    does not block other requests while we back off.
+    """
+    attempts = len(detector.retry_delays) + 1
+    for attempt, wait_time in enumerate(detector.retry_delays + (None,), start=1):
+        try:
+            async with get_scheduler().slot(tenant, priority):
+                return await call(*args)
+        except detector.transient_errors as e:
+            if wait_time is None:
+                print(f"❌ All {attempts} attempts failed")
+                raise
+            print(f"⏳ Attempt {attempt}/{attempts} failed: {e}")
+            print(f"⏳ Backend might be waking up, waiting {wait_time}s before retry...")
+            await asyncio.sleep(wait_time)
+
+async def detect_image(client: httpx.AsyncClient, data: bytes, detector: Optional[Detector] = None,
+                       tenant: str = "system", priority: int = PRIORITY_BATCH) -> dict:
+    """
+    Detect on raw image bytes: letterbox, run the backend, map boxes back,
+    apply CONFIDENCE_THRESHOLD
+
+    The backend call waits for a detect_scheduler slot (tenant, priority).
+    """
+    detector = detector or get_detector()
+    compact, meta = await prepare_for_detection(data)
+    print(f"🗜️ Detector input {len(data)} -> {len(compact)} bytes")
+    result = await _call_in_slot(detector, tenant, priority, detector.detect, client, compact)
+    # Drawn on the letterboxed copy, and annotations are rendered locally anyway
+    result.pop("annotated_image_base64", None)
+    result["detections"] = rescale_detections(result.get("detections"), meta)
+    return _stamp(result, detector)
+
+def _stamp(result: dict, detector: Detector) -> dict:
+    """Apply CONFIDENCE_THRESHOLD and record it with the model that ran"""
+    result = apply_threshold(result)
+    result["model_version"] = detector.model_version
+    result["threshold"] = CONFIDENCE_THRESHOLD
+    return result
+
+async def detect_photo(client: httpx.AsyncClient, photo_url: str, detector: Optional[Detector] = None,
+                       tenant: str = "system", priority: int = PRIORITY_BATCH) -> dict:
+    """
+    Detect defects in one stored photo
+
+    The photo is downloaded and preprocessed here; if it cannot be
+    downloaded, a backend that can fetch URLs (remote) gets the URL instead.
+
+    Args:
+        tenant, priority: Fair-queuing key and class for the detector slot
+                          (see detect_scheduler.py)
+
+    Returns:
+        Detector result with bboxes in original-image pixels, filtered by
+        CONFIDENCE_THRESHOLD and stamped with model_version and threshold
+    """
+    detector = detector or get_detector()
+    data = await fetch_image(client, asyncio.Semaphore(1), photo_url)
+    if not data:
+        print(f"⚠️ Could not download {photo_url}, letting the detector fetch it")
+        result = await _call_in_slot(detector, tenant, priority, detector.detect_url, client, photo_url)
+        result.pop("annotated_image_base64", None)
+        return _stamp(result, detector)
+    return await detect_image(client, data, detector, tenant, priority)
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, BackgroundTasks
 from pydantic import BaseModel
 from typing import Optional, List
 import os
@@ -6,6 +6,8 @@ from supabase import create_client, Client
 from dotenv import load_dotenv
 import traceback
 
+from report_cache import inspections_for_field, refresh_reports_many
+
 load_dotenv()
 
 # Initialize Supabase
@@ -73,7 +75,7 @@ def get_finding(finding_id: int):
 
 # 4. Update Finding
 @router.put("/{finding_id}")
-def update_finding(finding_id: int, finding: FindingUpdate):
+def update_finding(finding_id: int, finding: FindingUpdate, background_tasks: BackgroundTasks):
     try:
         update_data = {k: v for k, v in finding.dict().items() if v is not None}
         response = supabase.table("Finding").update(update_data).eq("FindingID", finding_id).execute()
@@ -81,17 +83,22 @@ def update_finding(finding_id: int, finding: FindingUpdate):
         if not response.data:
             raise HTTPException(status_code=404, detail="Finding not found or update failed")
             
+        # Reports showing this finding are now stale
+        background_tasks.add_task(refresh_reports_many, inspections_for_field("FindingID", finding_id))
+
         return response.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # 5. Delete Finding
 @router.delete("/{finding_id}")
-def delete_finding(finding_id: int):
+def delete_finding(finding_id: int, background_tasks: BackgroundTasks):
     try:
+        affected = inspections_for_field("FindingID", finding_id)
         response = supabase.table("Finding").delete().eq("FindingID", finding_id).execute()
         if not response.data:
             raise HTTPException(status_code=404, detail="Finding not found")
+        background_tasks.add_task(refresh_reports_many, affected)
         return {"message": "Finding deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
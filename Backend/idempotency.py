@@ -0,0 +1,162 @@
+# idempotency.py
+"""
+Idempotency Keys - SQLite
+Expensive endpoints (batch detection, redetect, report approval) accept an
+Idempotency-Key header. The first request with a key runs; a retry with the
+same key gets the stored response back, and a duplicate that arrives while
+the first is still running waits for it instead of starting a second run.
+
+Only successful responses are stored: a request that failed can be retried
+with the same key. Keys expire after IDEMPOTENCY_TTL_HOURS.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+from contextlib import closing
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+IDEMPOTENCY_DB_PATH = os.environ.get(
+    "IDEMPOTENCY_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "idempotency.sqlite3")
+)
+
+# How long a key's response is kept
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get("IDEMPOTENCY_TTL_HOURS", "24"))
+
+# A key left "running" longer than this (crashed worker) may be run again
+IDEMPOTENCY_STALE_SECONDS = int(os.environ.get("IDEMPOTENCY_STALE_SECONDS", "1800"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope       TEXT NOT NULL,
+    key         TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    status      TEXT NOT NULL,  -- running | done
+    response    TEXT,
+    created_at  REAL NOT NULL,
+    expires_at  REAL NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+"""
+
+# (scope, key) -> (future of the run in this process, its fingerprint)
+_inflight: Dict[Tuple[str, str], Tuple[asyncio.Future, str]] = {}
+
+# ---------------------------------------------------------
+# Storage
+# ---------------------------------------------------------
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(IDEMPOTENCY_DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(IDEMPOTENCY_DB_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+def fingerprint(params: Any) -> str:
+    """Hash of the request parameters a key was first used with"""
+    payload = json.dumps(jsonable_encoder(params), sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _claim(scope: str, key: str, digest: str) -> Optional[sqlite3.Row]:
+    """
+    Mark the key as running, unless it is already known
+
+    Returns:
+        None if claimed, else the existing (unexpired) row
+    """
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        conn.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+        row = conn.execute(
+            "SELECT * FROM idempotency_keys WHERE scope = ? AND key = ?", (scope, key)
+        ).fetchone()
+        if row and not (row["status"] == "running" and now - row["created_at"] > IDEMPOTENCY_STALE_SECONDS):
+            return row
+        conn.execute("""
+            INSERT OR REPLACE INTO idempotency_keys (scope, key, fingerprint, status, created_at, expires_at)
+            VALUES (?, ?, ?, 'running', ?, ?)
+        """, (scope, key, digest, now, now + IDEMPOTENCY_TTL_HOURS * 3600))
+    return None
+
+def _store(scope: str, key: str, response: Any):
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "UPDATE idempotency_keys SET status = 'done', response = ? WHERE scope = ? AND key = ?",
+            (json.dumps(response), scope, key)
+        )
+
+def _release(scope: str, key: str):
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND status = 'running'", (scope, key)
+        )
+
+# ---------------------------------------------------------
+# Run
+# ---------------------------------------------------------
+
+async def run_idempotent(key: Optional[str], scope: str, params: Any,
+                         run: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Run an endpoint body at most once per Idempotency-Key
+
+    Args:
+        key: Idempotency-Key header (None runs normally)
+        scope: Endpoint and path parameters, e.g. "redetect:12"
+        params: Other request parameters; reusing a key with different
+                ones is rejected (422)
+        run: The endpoint body
+
+    Raises:
+        HTTPException 409 if another process is still running the key
+    """
+    if not key:
+        return await run()
+
+    digest = fingerprint(params)
+    inflight, inflight_digest = _inflight.get((scope, key), (None, None))
+    if inflight is not None and inflight.get_loop() is asyncio.get_running_loop():
+        if inflight_digest != digest:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with different parameters")
+        print(f"🔁 Idempotency-Key {key}: waiting for the request in progress")
+        return await asyncio.shield(inflight)
+
+    existing = _claim(scope, key, digest)
+    if existing is not None:
+        if existing["fingerprint"] != digest:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with different parameters")
+        if existing["status"] == "done":
+            print(f"🔁 Idempotency-Key {key}: returning the stored response")
+            return json.loads(existing["response"])
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[(scope, key)] = (future, digest)
+    try:
+        response = jsonable_encoder(await run())
+        _store(scope, key, response)
+        future.set_result(response)
+        return response
+    except BaseException as e:
+        _release(scope, key)
+        if isinstance(e, Exception):
+            future.set_exception(e)
+            # Nobody may be waiting; keep asyncio from reporting it as unretrieved
+            future.exception()
+        else:
+            future.cancel()
+        raise
+    finally:
+        _inflight.pop((scope, key), None)
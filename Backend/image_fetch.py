@@ -0,0 +1,72 @@
+# image_fetch.py
+"""
+Image Fetching
+Bounded, size-capped downloads of photos and report images over httpx.
+Needs no Supabase client, so offline tools (detect_bench.py) can use it
+without credentials.
+"""
+
+from typing import Dict, Iterable, Optional
+import os
+import asyncio
+import httpx
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+# Max number of images downloaded at the same time
+IMAGE_FETCH_CONCURRENCY = int(os.environ.get("REPORT_IMAGE_CONCURRENCY", "6"))
+
+# Images larger than this are skipped instead of being loaded into memory
+MAX_IMAGE_BYTES = int(os.environ.get("REPORT_MAX_IMAGE_MB", "25")) * 1024 * 1024
+
+IMAGE_FETCH_TIMEOUT = 60.0
+
+# ---------------------------------------------------------
+# Fetching
+# ---------------------------------------------------------
+
+
+async def fetch_image(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, image_url: str) -> Optional[bytes]:
+    """Download one image, giving up on anything above MAX_IMAGE_BYTES"""
+    async with semaphore:
+        try:
+            async with client.stream("GET", image_url) as response:
+                response.raise_for_status()
+                declared = int(response.headers.get("content-length") or 0)
+                if declared > MAX_IMAGE_BYTES:
+                    print(f"⚠️ Skipping oversized image ({declared} bytes): {image_url}")
+                    return None
+
+                buffer = bytearray()
+                async for chunk in response.aiter_bytes():
+                    buffer.extend(chunk)
+                    if len(buffer) > MAX_IMAGE_BYTES:
+                        print(f"⚠️ Skipping oversized image: {image_url}")
+                        return None
+                return bytes(buffer)
+        except Exception as e:
+            print(f"❌ Failed to fetch report image {image_url}: {e}")
+            return None
+
+async def fetch_images(image_urls: Iterable[str], client: Optional[httpx.AsyncClient] = None) -> Dict[str, Optional[bytes]]:
+    """
+    Download images concurrently (bounded by IMAGE_FETCH_CONCURRENCY)
+
+    Returns:
+        url -> bytes (None when the image could not be loaded)
+    """
+    unique_urls = list(dict.fromkeys(u for u in image_urls if u))
+    if not unique_urls:
+        return {}
+
+    semaphore = asyncio.Semaphore(IMAGE_FETCH_CONCURRENCY)
+
+    if client is None:
+        async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as own_client:
+            results = await asyncio.gather(*[fetch_image(own_client, semaphore, u) for u in unique_urls])
+    else:
+        results = await asyncio.gather(*[fetch_image(client, semaphore, u) for u in unique_urls])
+
+    return dict(zip(unique_urls, results))
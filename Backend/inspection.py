@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, BackgroundTasks
 from pydantic import BaseModel
 from typing import Optional
 import os
@@ -6,6 +6,10 @@ from supabase import create_client, Client
 from dotenv import load_dotenv
 import traceback
 
+from content_store import release_content
+from photo_derivatives import remove_derivatives
+from report_cache import refresh_reports
+
 load_dotenv()
 
 # Initialize Supabase
@@ -135,7 +139,7 @@ def get_inspection(inspection_id: int):
 
 # 4. Update Inspection
 @router.put("/{inspection_id}")
-def update_inspection(inspection_id: int, inspection: InspectionUpdate):
+def update_inspection(inspection_id: int, inspection: InspectionUpdate, background_tasks: BackgroundTasks):
     try:
         # Filter out None values to only update provided fields
         update_data = {k: v for k, v in inspection.dict().items() if v is not None}
@@ -222,6 +226,9 @@ def update_inspection(inspection_id: int, inspection: InspectionUpdate):
                 traceback.print_exc()
                 # Don't fail the whole request if notification fails
         
+        # Invalidate cached report files; on "Completed" this pre-generates DOCX/PDF
+        background_tasks.add_task(refresh_reports, inspection_id)
+        
         return updated_inspection
     except Exception as e:
         print(f"❌ Error updating inspection {inspection_id}: {str(e)}")
@@ -230,7 +237,7 @@ def update_inspection(inspection_id: int, inspection: InspectionUpdate):
 
 # 5. Delete Inspection (Cascade)
 @router.delete("/{inspection_id}")
-def delete_inspection(inspection_id: int):
+def delete_inspection(inspection_id: int, background_tasks: BackgroundTasks):
     try:
         # 1a. Handle Team Dependencies (Inspector_Team -> Team -> Inspection)
         # Fetch TeamIDs associated with this inspection
@@ -260,7 +267,9 @@ def delete_inspection(inspection_id: int):
         supabase.table("Report").delete().eq("InspectionID", inspection_id).execute()
 
         # 2b. Delete associated photos
-        supabase.table("PhotoReport").delete().eq("InspectionID", inspection_id).execute()
+        deleted_photos = supabase.table("PhotoReport").delete().eq("InspectionID", inspection_id).execute()
+        background_tasks.add_task(release_content, "inspection-images", [p.get("PhotoURL") for p in deleted_photos.data or []])
+        background_tasks.add_task(remove_derivatives, deleted_photos.data or [])
 
         # 3. Delete Findings (if any)
         if finding_ids:
@@ -16,6 +16,10 @@ from recommendation import router as recommendation_router
 from report import router as report_router
 from team import router as team_router
 from notification import router as notification_router
+from upload import router as upload_router
+from worker_pool import shutdown_pool
+from storage_stream import RequestSizeLimit
+import detection_queue
 
 # 1. Load Environment Variables
 load_dotenv()
@@ -32,6 +36,9 @@ supabase: Client = create_client(url, key)
 # 3. Initialize FastAPI
 app = FastAPI()
 
+# Reject oversized uploads while they arrive (added first so CORS headers still apply)
+app.add_middleware(RequestSizeLimit)
+
 # 4. Setup CORS (Allow Frontend to talk to Backend)
 origins = [
     "http://localhost:5173",
@@ -61,6 +68,18 @@ app.include_router(report_router)
 app.include_router(team_router)
 app.include_router(notification_router)
 app.include_router(ai_detection_router)
+app.include_router(upload_router)
+
+
+# 6. Background Workers
+@app.on_event("startup")
+async def start_workers():
+    detection_queue.start_worker()
+
+@app.on_event("shutdown")
+async def stop_workers():
+    await detection_queue.stop_worker()
+    shutdown_pool()
 
 
 if __name__ == "__main__":
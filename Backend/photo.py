@@ -1,6 +1,7 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, BackgroundTasks, Request, Response, Header
+from fastapi.responses import RedirectResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, List, Literal
 import os
 from supabase import create_client, Client
 from dotenv import load_dotenv
@@ -10,6 +11,25 @@ from datetime import datetime
 import time
 import httpx
 import asyncio
+import json
+import itertools
+
+from report_cache import refresh_reports
+from storage_stream import UploadTooLarge, stream_to_storage
+import upload_sessions
+from photo_derivatives import claim_stale, generate_derivatives, remove_derivatives, with_webp_urls
+from content_store import content_hash_from_url, release_content, store_upload
+from photo_hash import NEAR_DUPLICATE_DISTANCE, near_duplicate_clusters
+from canvas_compositor import CANVAS_FORMATS, CANVAS_MAX_WIDTH, CANVAS_RENDER_WIDTH, compose_canvas
+from photo_annotations import ensure_annotated, render_many
+from detector import (
+    CONFIDENCE_THRESHOLD, DETECT_CONCURRENCY, DetectorUnavailable, detect_photo, failed_result, get_detector,
+    normalize_detections
+)
+from detection_results import DETECTION_PHOTO_COLUMNS, apply_detection, apply_detections, needs_detection
+import detection_queue
+from detect_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, tenant_for_inspection
+from idempotency import run_idempotent
 
 load_dotenv()
 
@@ -26,10 +46,16 @@ supabase: Client = create_client(url, key)
 
 router = APIRouter(prefix="/photo", tags=["Photo Reporting"])
 
-# HuggingFace Space Configuration
-HF_SPACE_URL = os.environ.get(
-    "HF_SPACE_URL",
-    "https://symmetrixs-edaa.hf.space"
+# Files uploaded to storage at the same time by /photo/batch-upload
+PHOTO_UPLOAD_CONCURRENCY = int(os.environ.get("PHOTO_UPLOAD_CONCURRENCY", "4"))
+
+# Detection units detected and saved together by /photo/detect-inspection
+DETECT_CHUNK_SIZE = int(os.environ.get("DETECT_CHUNK_SIZE", "24"))
+
+# Columns batch detection reads for each photo
+BATCH_DETECT_COLUMNS = (
+    f"{DETECTION_PHOTO_COLUMNS}, Category, Caption, PhotoNumbering, PHash, DHash, "
+    "AIDetectionDate, DetectedPhotoURL, DetectionModel, DetectionThreshold, AnnotatedPhotoURL, Detections"
 )
 
 # ---------------------------------------------------------
@@ -56,98 +82,225 @@ class PhotoUpdate(BaseModel):
     FindingID: Optional[int] = None
     RecommendID: Optional[int] = None
 
+class BatchPhotoMeta(BaseModel):
+    PhotoNumbering: Optional[float] = None
+    Category: Optional[str] = None
+    Caption: Optional[str] = None
+    FindingID: Optional[int] = None
+    RecommendID: Optional[int] = None
+
+class ResumableUploadCreate(BaseModel):
+    filename: str
+    length: int
+    content_type: Optional[str] = None
+
 class CanvasSaveRequest(BaseModel):
     inspection_id: int
     group_photo_ids: List[int]
     canvas_image_base64: str
 
+class CanvasImage(BaseModel):
+    photo_id: int
+    x: float
+    y: float
+    w: float = Field(..., gt=0, le=1)
+    h: float = Field(..., gt=0, le=1)
+
+class CanvasStroke(BaseModel):
+    points: List[List[float]] = Field(..., max_length=5000)
+    color: Optional[str] = None
+    width: Optional[float] = None
+
+class CanvasShape(BaseModel):
+    type: Literal["rectangle", "circle", "arrow", "line"]
+    x1: float
+    y1: float
+    x2: float
+    y2: float
+    color: Optional[str] = None
+    width: Optional[float] = None
+
+class CanvasLabel(BaseModel):
+    x: float
+    y: float
+    text: str = Field(..., max_length=500)
+    size: Optional[float] = None
+    color: Optional[str] = None
+    background: Optional[str] = None
+
+class CanvasLayout(BaseModel):
+    """Vector canvas; coordinates are 0..1 of the canvas width/height (see canvas_compositor)"""
+    aspect: float = Field(1.0, gt=0.05, lt=20)
+    background: Optional[str] = None
+    images: List[CanvasImage] = Field([], max_length=50)
+    strokes: List[CanvasStroke] = Field([], max_length=500)
+    shapes: List[CanvasShape] = Field([], max_length=500)
+    labels: List[CanvasLabel] = Field([], max_length=200)
+
+class CanvasComposeRequest(BaseModel):
+    inspection_id: int
+    group_photo_ids: List[int]
+    layout: CanvasLayout
+
+class RedetectBatchRequest(BaseModel):
+    photo_ids: List[int]
+
 # ---------------------------------------------------------
 # Helper Functions
 # ---------------------------------------------------------
 
-def deduplicate_detection_text(text: str) -> str:
+def _split_stale(photos: List[dict], detector, force: bool):
     """
-    Remove duplicate detection messages from text.
-    If the same sentence is repeated multiple times, keep only one instance.
-    For example: "Surface corrosion and rust detected on metal surface. Surface corrosion..."
-    becomes: "Surface corrosion and rust detected on metal surface."
+    Photos that need detection, and stored results for the rest
+
+    Returns:
+        (stale photos, results marked "skipped")
     """
-    if not text:
-        return text
-    
-    # Split by period and filter out empty strings
-    sentences = [s.strip() for s in text.split('.') if s.strip()]
-    
-    # Remove duplicates while preserving order (using dict to maintain insertion order in Python 3.7+)
-    unique_sentences = list(dict.fromkeys(sentences))
-    
-    # Join back with periods and add final period
-    return '. '.join(unique_sentences) + '.' if unique_sentences else text
+    stale = photos if force else [
+        p for p in photos if needs_detection(p, detector.model_version, CONFIDENCE_THRESHOLD)
+    ]
+    stale_ids = {p["PhotoID"] for p in stale}
+    skipped = [
+        {
+            "photo_id": p["PhotoID"],
+            "skipped": True,
+            "detections": p.get("Detections") or [],
+            "detection_count": len(p.get("Detections") or []),
+            "annotated_photo_url": p.get("AnnotatedPhotoURL")
+        }
+        for p in photos if p["PhotoID"] not in stale_ids
+    ]
+    return stale, skipped
 
-async def upload_annotated_image_to_storage(annotated_image_base64, inspection_id, photo_id):
-    """Upload annotated image to Supabase Storage"""
-    if not annotated_image_base64:
-        return None
-    
-    try:
-        # Decode base64
-        image_bytes = base64.b64decode(annotated_image_base64)
-        
-        # Generate filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"annotated_{inspection_id}_{photo_id}_{timestamp}.jpg"
-        
-        # Upload to storage
-        supabase.storage.from_("inspection-photos").upload(
-            path=f"annotated/{filename}",
-            file=image_bytes,
-            file_options={"content-type": "image/jpeg"}
-        )
-        
-        # Get public URL
-        url = supabase.storage.from_("inspection-photos").get_public_url(f"annotated/{filename}")
-        
-        print(f"✅ Uploaded: {url}")
-        return url
-        
-    except Exception as e:
-        print(f"❌ Upload failed: {e}")
-        traceback.print_exc()
-        return None
+def _detection_units(photos: List[dict], dedupe: bool) -> List[List[dict]]:
+    """
+    Group photos into detection units: [representative, *members]
 
-async def call_hf_with_retry(client, url, data, max_retries=3):
+    With dedupe, near-duplicates of the same category share one unit;
+    otherwise every photo is its own unit.
     """
-    Retry logic for HuggingFace Space wake-up
-    Spaces may be sleeping and need time to start
+    if not dedupe:
+        return [[p] for p in photos]
+    by_category = {}
+    for photo in photos:
+        by_category.setdefault(photo.get("Category"), []).append(photo)
+    units = []
+    for group in by_category.values():
+        units += near_duplicate_clusters(group)
+    print(f"🧬 {len(photos)} photos form {len(units)} near-duplicate clusters")
+    return units
+
+async def _detect_and_apply(client: httpx.AsyncClient, units: List[List[dict]], detector,
+                            semaphore: asyncio.Semaphore, priority: int = PRIORITY_BATCH) -> dict:
     """
-    for attempt in range(max_retries):
-        try:
-            print(f"🔄 Calling HF Space (attempt {attempt+1}/{max_retries}): {url}")
-            print(f"📦 Payload: {data}")
-            response = await client.post(url, json=data, timeout=120.0)
-            response.raise_for_status()
-            print(f"✅ HF Space responded successfully")
-            return response
-        except (httpx.TimeoutException, httpx.ConnectError, httpx.HTTPStatusError) as e:
-            if attempt < max_retries - 1:
-                wait_time = 10 * (2 ** attempt)  # 10s, 20s, 40s
-                print(f"⏳ Attempt {attempt+1} failed: {e}")
-                print(f"⏳ Space might be waking up, waiting {wait_time}s before retry...")
-                await asyncio.sleep(wait_time)
-            else:
-                print(f"❌ All {max_retries} attempts failed")
+    Detect each unit's representative and store the results
+
+    Cluster members get a copy of their representative's finding and
+    recommendation. Failed photos (and their members) go to the offline
+    detection queue. Detector calls are scheduled at priority for the tenant
+    of each representative's inspection, and the results are saved in bulk
+    (apply_detections).
+
+    Returns:
+        {"results": per-photo results, "applied": PhotoIDs saved, "queued": count}
+    """
+    photos_by_id = {p["PhotoID"]: p for unit in units for p in unit}
+    # representative PhotoID -> the other photos of its near-duplicate cluster
+    cluster_members = {u[0]["PhotoID"]: [p["PhotoID"] for p in u[1:]] for u in units if len(u) > 1}
+
+    async def detect(idx, photo):
+        photo_id = photo["PhotoID"]
+        async with semaphore:
+            try:
+                print(f"  📷 Detecting photo {idx+1}/{len(units)} (ID: {photo_id})...")
+                result = await detect_photo(
+                    client, photo["PhotoURL"], detector, tenant_for_inspection(photo["InspectionID"]), priority
+                )
+                result["photo_id"] = photo_id
+                print(f"  ✅ Photo {photo_id} detected: {result.get('detection_count', 0)} defects")
+                return result
+            except DetectorUnavailable:
                 raise
-    raise Exception("Max retries exceeded")
+            except Exception as e:
+                print(f"  ❌ Failed to detect photo {photo_id}: {e}")
+                return {**failed_result(photo_id), "error": str(e) or e.__class__.__name__}
+
+    # Run AI detection, a few compact photos at a time
+    results = list(await asyncio.gather(*[detect(idx, unit[0]) for idx, unit in enumerate(units)]))
+
+    # Only box coordinates are kept; annotated images are drawn locally
+    for result in results:
+        result.pop("annotated_image_base64", None)
+        result["detections"] = normalize_detections(result.get("detections"))
+
+    # Fan each representative's result out to the rest of its cluster.
+    # Boxes belong to the representative, so members get no boxes or annotated image.
+    for result in list(results):
+        for member_id in cluster_members.get(result["photo_id"], []):
+            results.append({
+                **result,
+                "photo_id": member_id,
+                "shared_from": result["photo_id"]
+            })
+
+    detected = {
+        r["photo_id"]: r for r in results
+        if r.get("success") is not False and not r.get("shared_from")
+    }
+    annotated_urls = await render_many([
+        {"PhotoID": photo_id, "PhotoURL": photos_by_id[photo_id]["PhotoURL"], "Detections": r["detections"]}
+        for photo_id, r in detected.items()
+    ])
+
+    # Failed photos (and their cluster members) wait in the offline queue
+    failed = [r for r in results if r.get("success") is False]
+    if failed:
+        detection_queue.enqueue(
+            [photos_by_id[r["photo_id"]] for r in failed],
+            error=next((r["error"] for r in failed if r.get("error")), None)
+        )
+
+    # Process AI results and update database
+    succeeded = [r for r in results if r.get("success") is not False]
+    print(f"💾 Saving {len(succeeded)} detection results...")
+    try:
+        applied_ids = apply_detections([
+            (photos_by_id[r["photo_id"]], r, annotated_urls.get(r["photo_id"])) for r in succeeded
+        ])
+    except Exception as e:
+        # Detected but not saved: the offline queue will detect and save them again
+        print(f"  ❌ Error saving detection results: {e}")
+        traceback.print_exc()
+        applied_ids = []
+        detection_queue.enqueue([photos_by_id[r["photo_id"]] for r in succeeded], error=str(e))
+        failed += succeeded
+
+    applied = set(applied_ids)
+    queued_ids = {r["photo_id"] for r in failed}
+    processed_results = [
+        {**r, "success": False, "queued": True, "annotated_photo_url": None} if r["photo_id"] in queued_ids
+        else {**r, "annotated_photo_url": annotated_urls.get(r["photo_id"])}
+        for r in results if r["photo_id"] in queued_ids or r["photo_id"] in applied
+    ]
+    print(f"  ✅ Updated {len(applied_ids)} photos in database")
+
+    # Photos queued by an earlier run are done now
+    detection_queue.discard(applied_ids)
+
+    return {"results": processed_results, "applied": applied_ids, "queued": len(failed)}
 
 # ---------------------------------------------------------
 # Basic Photo CRUD Routes
 # ---------------------------------------------------------
 
 @router.post("/", status_code=201)
-def add_photo(photo: PhotoCreate):
+def add_photo(photo: PhotoCreate, background_tasks: BackgroundTasks):
     try:
         new_data = photo.dict()
+        new_data["ContentHash"] = content_hash_from_url(photo.PhotoURL)
         response = supabase.table("PhotoReport").insert(new_data).execute()
+        background_tasks.add_task(refresh_reports, photo.InspectionID)
+        background_tasks.add_task(generate_derivatives, claim_stale(response.data or []))
         
         if not response.data:
             return {"message": "Photo added", "request_data": new_data}
@@ -158,24 +311,59 @@ def add_photo(photo: PhotoCreate):
         raise HTTPException(status_code=500, detail=f"Failed to add photo: {str(e)}")
 
 @router.get("/inspection/{inspection_id}")
-def get_photos_by_inspection(inspection_id: int):
+def get_photos_by_inspection(inspection_id: int, background_tasks: BackgroundTasks):
     try:
         response = supabase.table("PhotoReport")\
             .select("*, Finding(Description), Recommendation(Description)")\
             .eq("InspectionID", inspection_id)\
             .order("PhotoNumbering", desc=False)\
             .execute()
-        return response.data
+        # Older photos get their thumbnails built lazily, the first time they are listed
+        background_tasks.add_task(generate_derivatives, claim_stale(response.data or []))
+        return [with_webp_urls(photo) for photo in response.data or []]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/duplicates/{inspection_id}")
+def get_near_duplicates(inspection_id: int, category: Optional[str] = None,
+                        max_distance: int = NEAR_DUPLICATE_DISTANCE):
+    """
+    Near-duplicate photo clusters of an inspection (perceptual hash distance)
+
+    Returns:
+        Clusters with 2+ photos; the first photo of each is the representative.
+        "unhashed" lists photos whose hashes are not computed yet.
+    """
+    try:
+        query = supabase.table("PhotoReport")\
+            .select("PhotoID, PhotoURL, ThumbnailURL, PhotoNumbering, Category, PHash, DHash")\
+            .eq("InspectionID", inspection_id)
+        if category:
+            query = query.eq("Category", category)
+        photos = query.order("PhotoNumbering").execute().data or []
+
+        clusters = [c for c in near_duplicate_clusters(photos, max_distance) if len(c) > 1]
+        return {
+            "clusters": [
+                {"representative": c[0]["PhotoID"], "photo_ids": [p["PhotoID"] for p in c], "photos": c}
+                for c in clusters
+            ],
+            "unhashed": [p["PhotoID"] for p in photos if not p.get("PHash") or not p.get("DHash")]
+        }
     except Exception as e:
+        traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/all/{inspection_id}")
-def delete_all_photos(inspection_id: int):
+def delete_all_photos(inspection_id: int, background_tasks: BackgroundTasks):
     try:
         response = supabase.table("PhotoReport")\
             .delete()\
             .eq("InspectionID", inspection_id)\
             .execute()
+        background_tasks.add_task(refresh_reports, inspection_id)
+        background_tasks.add_task(release_content, "inspection-images", [p.get("PhotoURL") for p in response.data or []])
+        background_tasks.add_task(remove_derivatives, response.data or [])
         return {"message": "All photos deleted successfully", "data": response.data}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -194,9 +382,18 @@ def get_photo(photo_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/{photo_id}")
-def update_photo(photo_id: int, photo: PhotoUpdate):
+def update_photo(photo_id: int, photo: PhotoUpdate, background_tasks: BackgroundTasks):
     try:
         update_data = {k: v for k, v in photo.dict().items() if v is not None}
+
+        old_photo = None
+        if "PhotoURL" in update_data:
+            update_data["ContentHash"] = content_hash_from_url(update_data["PhotoURL"])
+            old_res = supabase.table("PhotoReport")\
+                .select("PhotoID, PhotoURL, ThumbnailURL, PreviewURL, PrintURL")\
+                .eq("PhotoID", photo_id)\
+                .execute()
+            old_photo = old_res.data[0] if old_res.data else None
         
         response = supabase.table("PhotoReport")\
             .update(update_data)\
@@ -204,12 +401,18 @@ def update_photo(photo_id: int, photo: PhotoUpdate):
             .execute()
         if not response.data:
             raise HTTPException(status_code=404, detail="Photo not found")
+        background_tasks.add_task(refresh_reports, response.data[0]["InspectionID"])
+        if "PhotoURL" in update_data:
+            background_tasks.add_task(generate_derivatives, claim_stale(response.data))
+            if old_photo and old_photo["PhotoURL"] != update_data["PhotoURL"]:
+                background_tasks.add_task(release_content, "inspection-images", [old_photo["PhotoURL"]])
+                background_tasks.add_task(remove_derivatives, [old_photo])
         return response.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/{photo_id}")
-def delete_photo(photo_id: int):
+def delete_photo(photo_id: int, background_tasks: BackgroundTasks):
     try:
         response = supabase.table("PhotoReport")\
             .delete()\
@@ -217,46 +420,218 @@ def delete_photo(photo_id: int):
             .execute()
         if not response.data:
             raise HTTPException(status_code=404, detail="Photo not found")
+        background_tasks.add_task(refresh_reports, response.data[0]["InspectionID"])
+        background_tasks.add_task(release_content, "inspection-images", [response.data[0].get("PhotoURL")])
+        background_tasks.add_task(remove_derivatives, response.data)
         return {"message": "Photo deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/upload")
-def upload_photo(file: UploadFile = File(...)):
+async def upload_photo(file: UploadFile = File(...)):
     try:
         bucket_name = "inspection-images" 
-        file_ext = file.filename.split('.')[-1]
-        filename = f"{int(time.time())}_{file.filename}"
-        
-        file_content = file.file.read()
         
-        supabase.storage.from_(bucket_name).upload(
-            path=filename,
-            file=file_content,
-            file_options={"content-type": file.content_type}
-        )
-        
-        public_url = supabase.storage.from_(bucket_name).get_public_url(filename)
+        # Stored under its SHA-256: the same photo uploaded twice reuses one object
+        public_url, content_hash, reused = await store_upload(bucket_name, file)
         
-        return {"url": public_url}
+        return {"url": public_url, "content_hash": content_hash, "reused": reused}
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to upload: {str(e)}")
 
+@router.post("/batch-upload", status_code=201)
+async def batch_upload_photos(
+    background_tasks: BackgroundTasks,
+    inspection_id: int = Form(...),
+    metadata: Optional[str] = Form(None),
+    files: List[UploadFile] = File(...)
+):
+    """
+    Upload many photos and create their PhotoReport rows in one request
+
+    Args:
+        inspection_id: Inspection the photos belong to
+        metadata: JSON list, one {PhotoNumbering, Category, Caption, FindingID,
+                  RecommendID} object per file (same order as files)
+        files: The photo files
+
+    Returns:
+        One result per file: {"index", "filename", "status", "url", "content_hash",
+        "reused", "photo", "error"}
+    """
+    try:
+        try:
+            raw_meta = json.loads(metadata) if metadata else [{} for _ in files]
+            if not isinstance(raw_meta, list) or len(raw_meta) != len(files):
+                raise ValueError("metadata must be a list with one entry per file")
+            meta = [BatchPhotoMeta(**(m or {})) for m in raw_meta]
+        except (ValueError, TypeError, ValidationError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid metadata: {str(e)}")
+
+        bucket_name = "inspection-images"
+        semaphore = asyncio.Semaphore(PHOTO_UPLOAD_CONCURRENCY)
+        results = [
+            {"index": idx, "filename": f.filename, "status": "error", "url": None,
+             "content_hash": None, "reused": False, "photo": None, "error": None}
+            for idx, f in enumerate(files)
+        ]
+
+        async def upload_one(idx: int, file: UploadFile):
+            async with semaphore:
+                try:
+                    public_url, content_hash, reused = await store_upload(bucket_name, file)
+                    results[idx].update({"url": public_url, "content_hash": content_hash, "reused": reused})
+                except Exception as e:
+                    print(f"❌ Batch upload failed for {file.filename}: {e}")
+                    results[idx]["error"] = str(e)
+
+        print(f"📤 Batch uploading {len(files)} photo(s) for inspection {inspection_id}")
+        await asyncio.gather(*[upload_one(idx, f) for idx, f in enumerate(files)])
+
+        # One insert for every photo that reached storage
+        uploaded = [r for r in results if r["url"]]
+        if uploaded:
+            rows = [
+                {"InspectionID": inspection_id, "PhotoURL": r["url"], "ContentHash": r["content_hash"], **meta[r["index"]].dict()}
+                for r in uploaded
+            ]
+            try:
+                insert_res = supabase.table("PhotoReport").insert(rows).execute()
+                for r, row in zip(uploaded, insert_res.data or []):
+                    r["photo"] = row
+                for r in uploaded:
+                    r["status"] = "ok"
+                background_tasks.add_task(refresh_reports, inspection_id)
+                background_tasks.add_task(generate_derivatives, claim_stale(insert_res.data or []))
+            except Exception as e:
+                traceback.print_exc()
+                # Rows were not created, so do not leave orphaned files behind
+                # (objects other rows still use are kept)
+                release_content(bucket_name, [r["url"] for r in uploaded])
+                for r in uploaded:
+                    r["url"] = None
+                    r["error"] = f"Failed to create photo record: {str(e)}"
+
+        ok = sum(1 for r in results if r["status"] == "ok")
+        print(f"✅ Batch upload done: {ok}/{len(files)} photo(s) saved")
+        return {"saved": ok, "failed": len(files) - ok, "results": results}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Batch upload failed: {str(e)}")
+
+# ---------------------------------------------------------
+# Resumable Uploads (tus-style)
+# ---------------------------------------------------------
+# POST creates a session, PATCH appends bytes at Upload-Offset (optionally
+# with "Upload-Checksum: sha256 <base64>"), GET reports the current offset so
+# an interrupted client only re-sends what is missing.
+
+def _session_status(session: dict, response: Response) -> dict:
+    response.headers["Upload-Offset"] = str(session["offset"])
+    response.headers["Upload-Length"] = str(session["length"])
+    response.headers["Cache-Control"] = "no-store"
+    return {
+        "upload_id": session["upload_id"],
+        "offset": session["offset"],
+        "length": session["length"],
+        "expires_at": session["expires_at"],
+        "complete": bool(session.get("url")),
+        "url": session.get("url")
+    }
+
+@router.post("/uploads", status_code=201)
+def create_resumable_upload(req: ResumableUploadCreate, response: Response):
+    try:
+        session = upload_sessions.create_session(req.filename, req.length, req.content_type, "inspection-images")
+        print(f"📤 Resumable upload {session['upload_id']} started: {req.filename} ({req.length} bytes)")
+        return _session_status(session, response)
+    except upload_sessions.ChunkTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Failed to start upload: {str(e)}")
+
+@router.get("/uploads/{upload_id}")
+def get_resumable_upload(upload_id: str, response: Response):
+    try:
+        return _session_status(upload_sessions.load_session(upload_id), response)
+    except upload_sessions.SessionNotFound:
+        raise HTTPException(status_code=404, detail="Upload session not found or expired")
+
+@router.patch("/uploads/{upload_id}")
+async def append_resumable_upload(
+    upload_id: str,
+    request: Request,
+    response: Response,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    upload_checksum: Optional[str] = Header(None, alias="Upload-Checksum")
+):
+    try:
+        session = await upload_sessions.append_chunk(upload_id, upload_offset, request.stream(), upload_checksum)
+        if session.get("url"):
+            print(f"✅ Resumable upload {upload_id} complete: {session['url']}")
+        return _session_status(session, response)
+    except upload_sessions.SessionNotFound:
+        raise HTTPException(status_code=404, detail="Upload session not found or expired")
+    except upload_sessions.OffsetMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+    except upload_sessions.ChecksumMismatch as e:
+        # 460 is the tus "Checksum Mismatch" status
+        raise HTTPException(status_code=460, detail=str(e))
+    except (upload_sessions.ChunkTooLarge, UploadTooLarge) as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Failed to write chunk: {str(e)}")
+
+@router.delete("/uploads/{upload_id}")
+def cancel_resumable_upload(upload_id: str):
+    try:
+        upload_sessions.delete_session(upload_id)
+        return {"message": "Upload cancelled"}
+    except upload_sessions.SessionNotFound:
+        raise HTTPException(status_code=404, detail="Upload session not found or expired")
+
 # ---------------------------------------------------------
-# AI Detection Endpoints with HuggingFace Space Integration
+# AI Detection Endpoints (backend chosen by DETECTOR_BACKEND)
 # ---------------------------------------------------------
 
 @router.post("/batch-detect/{inspection_id}")
-async def batch_detect_and_save(inspection_id: int, category: str):
+async def batch_detect_and_save(inspection_id: int, category: str, background_tasks: BackgroundTasks,
+                                dedupe: bool = False, force: bool = False,
+                                idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     """
-    AI detection with HuggingFace Space integration
-    Handles Space wake-up and retry logic
+    AI detection with the configured detector backend (see detector.py)
+    The remote Space backend handles wake-up and retry logic
+
+    With dedupe=true, near-duplicate photos are detected once per cluster and
+    the representative's finding/recommendation is copied to the others.
+
+    Photos the detector fails on are not given a "Detection failed" finding;
+    they go to the offline detection queue (detection_queue.py) and are
+    detected once the detector is healthy again ("queued": true).
+
+    Runs are incremental: photos that already have a result for their current
+    image, model and threshold are returned as stored ("skipped": true)
+    without calling the detector. force=true re-detects every photo.
     """
+    return await run_idempotent(
+        idempotency_key, f"batch-detect:{inspection_id}",
+        {"category": category, "dedupe": dedupe, "force": force},
+        lambda: _batch_detect_and_save(inspection_id, category, background_tasks, dedupe, force)
+    )
+
+async def _batch_detect_and_save(inspection_id: int, category: str, background_tasks: BackgroundTasks,
+                                 dedupe: bool, force: bool):
     try:
         # Get photos from database
         photos_response = supabase.table("PhotoReport")\
-            .select("PhotoID, PhotoURL, Caption, PhotoNumbering")\
+            .select(BATCH_DETECT_COLUMNS)\
             .eq("InspectionID", inspection_id)\
             .eq("Category", category)\
             .order("PhotoNumbering")\
@@ -266,155 +641,35 @@ async def batch_detect_and_save(inspection_id: int, category: str):
             return {"success": True, "processed": 0, "results": []}
         
         all_photos = photos_response.data
-        photo_ids = [p["PhotoID"] for p in all_photos]
-        photo_urls = [p["PhotoURL"] for p in all_photos]
+        detector = get_detector()
+
+        # Incremental run: leave photos alone whose result is still current
+        stale_photos, skipped_results = _split_stale(all_photos, detector, force)
+        if not stale_photos:
+            print(f"⏭️ All {len(all_photos)} photos in category '{category}' are up to date")
+            return {"success": True, "processed": 0, "queued": 0, "skipped": len(skipped_results), "results": skipped_results}
+
+        units = _detection_units(stale_photos, dedupe)
+        print(f"📸 Detecting {len(stale_photos)} of {len(all_photos)} photos in category '{category}'")
+        print(f"🌐 Detector backend: {detector.name}")
         
-        print(f"📸 Detecting {len(all_photos)} photos in category '{category}'")
-        print(f"🌐 Using HuggingFace Space: {HF_SPACE_URL}")
+        async with httpx.AsyncClient(timeout=300.0, follow_redirects=True) as client:
+            outcome = await _detect_and_apply(client, units, detector, asyncio.Semaphore(DETECT_CONCURRENCY))
         
-        # Call HuggingFace Space for AI detection
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            ai_results = None
-            
-            try:
-                # Try batch detection first
-                print("🚀 Attempting batch detection...")
-                ai_response = await call_hf_with_retry(
-                    client,
-                    f"{HF_SPACE_URL}/detect-batch",
-                    {
-                        "photo_ids": photo_ids,
-                        "photo_urls": photo_urls,
-                        "category": category
-                    },
-                    max_retries=3
-                )
-                ai_results = ai_response.json()
-                print(f"✅ Batch detection successful")
-                
-            except Exception as batch_err:
-                print(f"⚠️ Batch detection failed: {batch_err}")
-                print(f"🔄 Falling back to one-by-one detection...")
-                
-                # Fallback: detect photos one by one
-                ai_results = {"success": True, "results": []}
-                
-                for idx, (photo_id, photo_url) in enumerate(zip(photo_ids, photo_urls)):
-                    try:
-                        print(f"  📷 Detecting photo {idx+1}/{len(photo_ids)} (ID: {photo_id})...")
-                        
-                        # Direct call with query parameter (not JSON body)
-                        single_response = await client.post(
-                            f"{HF_SPACE_URL}/detect-by-url",
-                            params={"photo_url": photo_url},  # Query parameter
-                            timeout=120.0
-                        )
-                        single_response.raise_for_status()
-                        
-                        result = single_response.json()
-                        result["photo_id"] = photo_id
-                        ai_results["results"].append(result)
-                        print(f"  ✅ Photo {photo_id} detected: {result.get('detection_count', 0)} defects")
-                        
-                        # Add small delay to avoid rate limiting
-                        if idx < len(photo_ids) - 1:
-                            await asyncio.sleep(2)
-                        
-                    except Exception as e:
-                        print(f"  ❌ Failed to detect photo {photo_id}: {e}")
-                        ai_results["results"].append({
-                            "photo_id": photo_id,
-                            "success": False,
-                            "detections": [],
-                            "finding": "Detection failed. Please review manually.",
-                            "recommendation": "Manual inspection required.",
-                            "detection_count": 0,
-                            "annotated_image_base64": None
-                        })
-        
-        if not ai_results or not ai_results.get("success"):
-            raise HTTPException(status_code=500, detail="AI detection failed")
-        
-        # Process AI results and update database
-        print(f"💾 Processing {len(ai_results['results'])} detection results...")
-        processed_results = []
-        
-        for result in ai_results["results"]:
-            photo_id = result["photo_id"]
-            
-            try:
-                # Create Finding record
-                finding_text = deduplicate_detection_text(result.get("finding", "No finding description"))
-                finding_response = supabase.table("Finding").insert({
-                    "Description": finding_text
-                }).execute()
-                
-                if not finding_response.data:
-                    print(f"⚠️ Failed to create finding for photo {photo_id}")
-                    continue
-                
-                finding_id = finding_response.data[0]["FindingID"]
-                
-                # Create Recommendation record
-                recommendation_text = deduplicate_detection_text(result.get("recommendation", "No recommendation"))
-                recommendation_response = supabase.table("Recommendation").insert({
-                    "Description": recommendation_text
-                }).execute()
-                
-                if not recommendation_response.data:
-                    print(f"⚠️ Failed to create recommendation for photo {photo_id}")
-                    continue
-                
-                recommendation_id = recommendation_response.data[0]["RecommendID"]
-                
-                # Upload annotated image to storage (if available)
-                annotated_url = None
-                if result.get("annotated_image_base64"):
-                    annotated_url = await upload_annotated_image_to_storage(
-                        result["annotated_image_base64"],
-                        inspection_id,
-                        photo_id
-                    )
-                
-                # Update PhotoReport with AI results
-                update_data = {
-                    "FindingID": finding_id,
-                    "RecommendID": recommendation_id,
-                }
-                
-                if annotated_url:
-                    update_data["AnnotatedPhotoURL"] = annotated_url
-                    update_data["AIDetectionDate"] = datetime.now().isoformat()
-                    
-                    # Store confidence score if available
-                    if result.get("detections"):
-                        max_conf = max([d["confidence"] for d in result["detections"]])
-                        update_data["DetectionConfidence"] = max_conf
-                
-                supabase.table("PhotoReport")\
-                    .update(update_data)\
-                    .eq("PhotoID", photo_id)\
-                    .execute()
-                
-                processed_results.append({
-                    **result,
-                    "annotated_photo_url": annotated_url
-                })
-                
-                print(f"  ✅ Updated photo {photo_id} in database")
-                
-            except Exception as e:
-                print(f"  ❌ Error processing photo {photo_id}: {e}")
-                traceback.print_exc()
-        
-        print(f"🎉 Batch detection complete: {len(processed_results)}/{len(all_photos)} photos processed")
+        print(f"🎉 Batch detection complete: {len(outcome['applied'])}/{len(stale_photos)} photos processed, "
+              f"{outcome['queued']} queued, {len(skipped_results)} up to date")
+        background_tasks.add_task(refresh_reports, inspection_id)
         
         return {
             "success": True,
-            "processed": len(processed_results),
-            "results": processed_results
+            "processed": len(outcome["applied"]),
+            "queued": outcome["queued"],
+            "skipped": len(skipped_results),
+            "results": outcome["results"] + skipped_results
         }
     
+    except DetectorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -422,12 +677,110 @@ async def batch_detect_and_save(inspection_id: int, category: str):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/detect-inspection/{inspection_id}")
+async def detect_inspection(inspection_id: int, background_tasks: BackgroundTasks,
+                            dedupe: bool = False, force: bool = False,
+                            idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    """
+    Batch detection for every category of an inspection in one job
+
+    Photos are loaded once and detected in shared chunks of DETECT_CHUNK_SIZE
+    that take photos from all categories in turn, so the detector is woken
+    up once and every category gets results early. Each chunk is saved before
+    the next one starts. Options are the same as /batch-detect.
+
+    Returns:
+        Counts for the whole inspection and results grouped by category
+    """
+    return await run_idempotent(
+        idempotency_key, f"detect-inspection:{inspection_id}",
+        {"dedupe": dedupe, "force": force},
+        lambda: _detect_inspection(inspection_id, background_tasks, dedupe, force)
+    )
+
+async def _detect_inspection(inspection_id: int, background_tasks: BackgroundTasks,
+                             dedupe: bool, force: bool):
+    try:
+        photos_response = supabase.table("PhotoReport")\
+            .select(BATCH_DETECT_COLUMNS)\
+            .eq("InspectionID", inspection_id)\
+            .order("Category")\
+            .order("PhotoNumbering")\
+            .execute()
+        
+        all_photos = photos_response.data or []
+        categories = {}
+        for photo in all_photos:
+            categories.setdefault(photo.get("Category") or "", [])
+        if not all_photos:
+            return {"success": True, "processed": 0, "queued": 0, "skipped": 0, "categories": categories}
+        
+        detector = get_detector()
+        stale_photos, skipped_results = _split_stale(all_photos, detector, force)
+        category_of = {p["PhotoID"]: p.get("Category") or "" for p in all_photos}
+        
+        # Round-robin over categories so each chunk mixes them
+        by_category = {}
+        for unit in _detection_units(stale_photos, dedupe):
+            by_category.setdefault(category_of[unit[0]["PhotoID"]], []).append(unit)
+        units = [
+            unit for round_units in itertools.zip_longest(*by_category.values())
+            for unit in round_units if unit
+        ]
+        chunks = [units[i:i + DETECT_CHUNK_SIZE] for i in range(0, len(units), DETECT_CHUNK_SIZE)]
+        
+        print(f"📸 Detecting {len(stale_photos)} of {len(all_photos)} photos in {len(categories)} categories "
+              f"({len(chunks)} chunks)")
+        print(f"🌐 Detector backend: {detector.name}")
+        
+        applied, queued = [], 0
+        semaphore = asyncio.Semaphore(DETECT_CONCURRENCY)
+        async with httpx.AsyncClient(timeout=300.0, follow_redirects=True) as client:
+            for idx, chunk in enumerate(chunks):
+                print(f"📦 Chunk {idx+1}/{len(chunks)}: {sum(len(u) for u in chunk)} photos")
+                outcome = await _detect_and_apply(client, chunk, detector, semaphore)
+                applied += outcome["applied"]
+                queued += outcome["queued"]
+                for result in outcome["results"]:
+                    categories[category_of[result["photo_id"]]].append(result)
+        
+        for result in skipped_results:
+            categories[category_of[result["photo_id"]]].append(result)
+        
+        print(f"🎉 Inspection detection complete: {len(applied)}/{len(stale_photos)} photos processed, "
+              f"{queued} queued, {len(skipped_results)} up to date")
+        background_tasks.add_task(refresh_reports, inspection_id)
+        
+        return {
+            "success": True,
+            "processed": len(applied),
+            "queued": queued,
+            "skipped": len(skipped_results),
+            "categories": categories
+        }
+    
+    except DetectorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print(f"❌ Inspection detection error: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
 
 @router.post("/redetect/{photo_id}")
-async def redetect_single_photo(photo_id: int):
+async def redetect_single_photo(photo_id: int, background_tasks: BackgroundTasks,
+                                idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     """
-    Re-detect a single photo using HuggingFace Space
+    Re-detect a single photo using the configured detector backend
     """
+    return await run_idempotent(
+        idempotency_key, f"redetect:{photo_id}", {},
+        lambda: _redetect_single_photo(photo_id, background_tasks)
+    )
+
+async def _redetect_single_photo(photo_id: int, background_tasks: BackgroundTasks):
     try:
         # Get photo from database
         photo_response = supabase.table("PhotoReport")\
@@ -441,100 +794,55 @@ async def redetect_single_photo(photo_id: int):
         photo = photo_response.data[0]
         
         print(f"🔄 Re-detecting photo {photo_id}")
-        print(f"🌐 Using HuggingFace Space: {HF_SPACE_URL}")
+        print(f"🌐 Detector backend: {get_detector().name}")
         print(f"📸 Photo URL: {photo['PhotoURL']}")
         
-        # Call HuggingFace Space - photo_url must be a query parameter, not JSON body
-        async with httpx.AsyncClient(timeout=120.0) as client:
+        # Run the configured detector on the preprocessed photo
+        async with httpx.AsyncClient(timeout=120.0, follow_redirects=True) as client:
             try:
-                print(f"🔄 Calling HF Space: {HF_SPACE_URL}/detect-by-url?photo_url={photo['PhotoURL']}")
-                response = await client.post(
-                    f"{HF_SPACE_URL}/detect-by-url",
-                    params={"photo_url": photo["PhotoURL"]},  # Query parameter, not JSON body
-                    timeout=120.0
+                ai_result = await detect_photo(
+                    client, photo["PhotoURL"],
+                    tenant=tenant_for_inspection(photo["InspectionID"]), priority=PRIORITY_INTERACTIVE
                 )
-                response.raise_for_status()
-                ai_result = response.json()
-                print(f"✅ HF Space responded successfully")
-            except httpx.HTTPStatusError as e:
-                print(f"❌ HF Space error: {e}")
-                print(f"Response body: {e.response.text if hasattr(e, 'response') else 'N/A'}")
-                raise HTTPException(status_code=500, detail=f"AI detection failed: {str(e)}")
+                print(f"✅ Detector responded successfully")
+            except DetectorUnavailable as e:
+                raise HTTPException(status_code=503, detail=str(e))
             except Exception as e:
-                print(f"❌ Unexpected error: {e}")
-                raise HTTPException(status_code=500, detail=f"AI detection failed: {str(e)}")
+                # Space asleep/down: detect it later instead of failing the edit
+                print(f"❌ Detector error, queueing photo {photo_id}: {e}")
+                detection_queue.enqueue([photo], error=str(e) or e.__class__.__name__)
+                return {
+                    "success": False,
+                    "queued": True,
+                    "photo_id": photo_id,
+                    "error": f"AI detection failed: {str(e)}"
+                }
         
         print(f"✅ Detection complete: {ai_result.get('detection_count', 0)} defects found")
         
-        # Update or create Finding
-        finding_text = deduplicate_detection_text(ai_result["finding"])
-        if photo.get("FindingID"):
-            supabase.table("Finding")\
-                .update({"Description": finding_text})\
-                .eq("FindingID", photo["FindingID"])\
-                .execute()
-            finding_id = photo["FindingID"]
-            print(f"  ✅ Updated existing Finding {finding_id}")
-        else:
-            finding_response = supabase.table("Finding").insert({
-                "Description": finding_text
-            }).execute()
-            finding_id = finding_response.data[0]["FindingID"]
-            print(f"  ✅ Created new Finding {finding_id}")
-        
-        # Update or create Recommendation
-        recommendation_text = deduplicate_detection_text(ai_result["recommendation"])
-        if photo.get("RecommendID"):
-            supabase.table("Recommendation")\
-                .update({"Description": recommendation_text})\
-                .eq("RecommendID", photo["RecommendID"])\
-                .execute()
-            recommendation_id = photo["RecommendID"]
-            print(f"  ✅ Updated existing Recommendation {recommendation_id}")
-        else:
-            recommendation_response = supabase.table("Recommendation").insert({
-                "Description": recommendation_text
-            }).execute()
-            recommendation_id = recommendation_response.data[0]["RecommendID"]
-            print(f"  ✅ Created new Recommendation {recommendation_id}")
-        
-        # Upload annotated image
-        annotated_url = None
-        if ai_result.get("annotated_image_base64"):
-            annotated_url = await upload_annotated_image_to_storage(
-                ai_result["annotated_image_base64"],
-                photo["InspectionID"],
-                photo_id
-            )
+        # Draw the annotated image from the boxes
+        detections = normalize_detections(ai_result.get("detections"))
+        ai_result["detections"] = detections
+        annotated_url = (await render_many([
+            {"PhotoID": photo_id, "PhotoURL": photo["PhotoURL"], "Detections": detections}
+        ]))[photo_id]
         
-        # Update PhotoReport
-        update_data = {
-            "FindingID": finding_id,
-            "RecommendID": recommendation_id,
-        }
-        
-        if annotated_url:
-            update_data["AnnotatedPhotoURL"] = annotated_url
-            update_data["AIDetectionDate"] = datetime.now().isoformat()
-            if ai_result.get("detections"):
-                max_conf = max([d["confidence"] for d in ai_result["detections"]])
-                update_data["DetectionConfidence"] = max_conf
-        
-        supabase.table("PhotoReport")\
-            .update(update_data)\
-            .eq("PhotoID", photo_id)\
-            .execute()
+        # Update Finding/Recommendation and PhotoReport
+        if not apply_detection(photo, ai_result, annotated_url):
+            raise HTTPException(status_code=409, detail="Photo was replaced or deleted during detection")
+        detection_queue.discard([photo_id])
         
         print(f"✅ Photo {photo_id} updated in database")
+        background_tasks.add_task(refresh_reports, photo["InspectionID"])
         
         return {
             "success": True,
             "photo_id": photo_id,
             "finding": ai_result["finding"],
             "recommendation": ai_result["recommendation"],
-            "annotated_image_base64": ai_result.get("annotated_image_base64"),
+            "detections": detections,
             "annotated_photo_url": annotated_url,
-            "detection_count": ai_result.get("detection_count", 0)
+            "detection_count": ai_result.get("detection_count", len(detections))
         }
     
     except HTTPException as he:
@@ -544,13 +852,139 @@ async def redetect_single_photo(photo_id: int):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/redetect-batch")
+async def redetect_photos(request: RedetectBatchRequest, background_tasks: BackgroundTasks,
+                          idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    """
+    Re-detect a selected set of photos in one job
+
+    The photos are loaded in one query and detected over one shared client;
+    their existing Finding/Recommendation rows are updated in bulk (new ones
+    created where missing), as /redetect does for a single photo. Photos the
+    detector fails on go to the offline detection queue ("queued": true).
+
+    Returns:
+        Counts, per-photo results in request order, and IDs not found
+    """
+    return await run_idempotent(
+        idempotency_key, "redetect-batch", {"photo_ids": sorted(set(request.photo_ids))},
+        lambda: _redetect_photos(request.photo_ids, background_tasks)
+    )
+
+async def _redetect_photos(photo_ids: List[int], background_tasks: BackgroundTasks):
+    try:
+        ids = list(dict.fromkeys(photo_ids))
+        if not ids:
+            return {"success": True, "processed": 0, "queued": 0, "missing": [], "results": []}
+
+        photos_response = supabase.table("PhotoReport")\
+            .select(BATCH_DETECT_COLUMNS)\
+            .in_("PhotoID", ids)\
+            .execute()
+        found = {p["PhotoID"]: p for p in photos_response.data or [] if p.get("PhotoURL")}
+        photos = [found[photo_id] for photo_id in ids if photo_id in found]
+        missing = [photo_id for photo_id in ids if photo_id not in found]
+        if not photos:
+            raise HTTPException(status_code=404, detail="Photos not found")
+
+        detector = get_detector()
+        inspections = dict.fromkeys(p["InspectionID"] for p in photos)
+        # A few photos are a click to wait for; a large selection is batch work
+        priority = PRIORITY_INTERACTIVE if len(photos) <= DETECT_CONCURRENCY else PRIORITY_BATCH
+        print(f"🔄 Re-detecting {len(photos)} photos")
+        print(f"🌐 Detector backend: {detector.name}")
+
+        async with httpx.AsyncClient(timeout=300.0, follow_redirects=True) as client:
+            outcome = await _detect_and_apply(
+                client, [[p] for p in photos], detector, asyncio.Semaphore(DETECT_CONCURRENCY), priority
+            )
+
+        print(f"✅ Re-detection complete: {len(outcome['applied'])}/{len(photos)} photos updated, "
+              f"{outcome['queued']} queued")
+        for inspection_id in inspections:
+            background_tasks.add_task(refresh_reports, inspection_id)
+
+        order = {photo_id: idx for idx, photo_id in enumerate(ids)}
+        return {
+            "success": True,
+            "processed": len(outcome["applied"]),
+            "queued": outcome["queued"],
+            "missing": missing,
+            "results": sorted(outcome["results"], key=lambda r: order[r["photo_id"]])
+        }
+
+    except DetectorUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print(f"❌ Batch re-detection error: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/annotated/{photo_id}")
+async def get_annotated_photo(photo_id: int):
+    """
+    Redirect to the photo's annotated image, drawing it from the stored boxes
+    on first view (or when the boxes/photo changed since it was drawn)
+    """
+    try:
+        photo_response = supabase.table("PhotoReport")\
+            .select("PhotoID, PhotoURL, AnnotatedPhotoURL, Detections")\
+            .eq("PhotoID", photo_id)\
+            .execute()
+        if not photo_response.data:
+            raise HTTPException(status_code=404, detail="Photo not found")
+
+        photo = photo_response.data[0]
+        annotated_url = await ensure_annotated(photo) if photo.get("Detections") is not None \
+            else photo.get("AnnotatedPhotoURL")
+        if not annotated_url:
+            raise HTTPException(status_code=404, detail="Photo has no AI annotations")
+
+        return RedirectResponse(annotated_url, status_code=307)
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print(f"❌ Error loading annotated photo: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
 
 # ======================================================================
 # Canvas Annotation Endpoints
 # ======================================================================
 
+def _apply_canvas_url(photo_ids: List[int], public_url: str) -> int:
+    """Point every photo of the group at a client-rendered canvas (one query)"""
+    if not photo_ids:
+        return 0
+    # A raster canvas replaces any vector layout the group had
+    response = supabase.table("PhotoReport")\
+        .update({"CanvasPhotoURL": public_url, "CanvasLayout": None})\
+        .in_("PhotoID", photo_ids)\
+        .execute()
+    updated = len(response.data or [])
+    print(f"✅ Updated {updated} photo(s) with canvas URL")
+    return updated
+
+def _recompress_canvas(source, fmt: str) -> bytes:
+    """Re-encode a canvas image as lossless WebP or optimized PNG"""
+    from PIL import Image
+    import io
+
+    with Image.open(source) as img:
+        out = io.BytesIO()
+        if fmt == "webp":
+            img.save(out, format="WEBP", lossless=True, method=4)
+        else:
+            img.save(out, format="PNG", optimize=True)
+        return out.getvalue()
+
 @router.post("/save-canvas-annotation")
-async def save_canvas_annotation(request: CanvasSaveRequest):
+async def save_canvas_annotation(request: CanvasSaveRequest, background_tasks: BackgroundTasks):
     """Save canvas annotation for a group of photos"""
     try:
         canvas_image_base64 = request.canvas_image_base64
@@ -559,8 +993,8 @@ async def save_canvas_annotation(request: CanvasSaveRequest):
         if canvas_image_base64.startswith('data:image'):
             canvas_image_base64 = canvas_image_base64.split(',')[1]
         
-        # Decode base64 to bytes
-        image_bytes = base64.b64decode(canvas_image_base64)
+        # Decode base64 to bytes (off the event loop, canvases are large)
+        image_bytes = await asyncio.to_thread(base64.b64decode, canvas_image_base64)
         
         # Generate unique filename
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -583,17 +1017,9 @@ async def save_canvas_annotation(request: CanvasSaveRequest):
         print(f"🎨 Canvas URL: {public_url}")
         
         # Update all photos in the group with the canvas URL
-        updated_count = 0
-        for photo_id in request.group_photo_ids:
-            try:
-                supabase.table("PhotoReport")\
-                    .update({"CanvasPhotoURL": public_url})\
-                    .eq("PhotoID", photo_id)\
-                    .execute()
-                updated_count += 1
-                print(f"✅ Updated photo {photo_id} with canvas URL")
-            except Exception as e:
-                print(f"⚠️ Failed to update photo {photo_id}: {e}")
+        updated_count = _apply_canvas_url(request.group_photo_ids, public_url)
+        
+        background_tasks.add_task(refresh_reports, request.inspection_id)
         
         return {
             "success": True,
@@ -610,18 +1036,197 @@ async def save_canvas_annotation(request: CanvasSaveRequest):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/save-canvas-annotation/upload")
+async def save_canvas_annotation_upload(
+    background_tasks: BackgroundTasks,
+    inspection_id: int = Form(...),
+    group_photo_ids: str = Form(...),
+    recompress: Optional[str] = Form(None),
+    file: UploadFile = File(...)
+):
+    """
+    Save canvas annotation sent as a binary file (multipart) instead of base64 JSON
+
+    Args:
+        group_photo_ids: Comma-separated or JSON list of PhotoIDs
+        recompress: None (store as sent), "png" (optimized PNG) or "webp" (lossless WebP)
+        file: The canvas image
+    """
+    try:
+        try:
+            raw_ids = json.loads(group_photo_ids) if group_photo_ids.strip().startswith("[") \
+                else group_photo_ids.split(",")
+            photo_ids = [int(p) for p in raw_ids if str(p).strip()]
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="group_photo_ids must be a list of PhotoIDs")
+        if recompress not in (None, "", "png", "webp"):
+            raise HTTPException(status_code=400, detail="recompress must be 'png' or 'webp'")
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        bucket_name = "inspection-photos"
+
+        if recompress:
+            # Decoding needs the whole image anyway; done in a thread from the spooled upload
+            image_bytes = await asyncio.to_thread(_recompress_canvas, file.file, recompress)
+            path = f"canvas/canvas_{inspection_id}_{timestamp}.{recompress}"
+            await asyncio.to_thread(
+                supabase.storage.from_(bucket_name).upload,
+                path, image_bytes, {"content-type": f"image/{recompress}", "upsert": "true"}
+            )
+            public_url = supabase.storage.from_(bucket_name).get_public_url(path)
+            size = len(image_bytes)
+        else:
+            content_type = file.content_type or "image/png"
+            ext = "webp" if content_type == "image/webp" else "png"
+            path = f"canvas/canvas_{inspection_id}_{timestamp}.{ext}"
+            public_url = await stream_to_storage(bucket_name, path, file, content_type, upsert=True)
+            size = file.size
+
+        print(f"🎨 Canvas URL: {public_url} ({size} bytes)")
+        updated_count = _apply_canvas_url(photo_ids, public_url)
+        background_tasks.add_task(refresh_reports, inspection_id)
+
+        return {
+            "success": True,
+            "message": "Canvas saved successfully",
+            "canvas_url": public_url,
+            "updated_photos": updated_count,
+            "photo_ids": photo_ids
+        }
+
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print(f"❌ Error saving canvas: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/canvas/compose")
+async def compose_canvas_annotation(request: CanvasComposeRequest, background_tasks: BackgroundTasks):
+    """
+    Render a group's canvas on the server from its vector layout
+
+    The layout is stored on every photo of the group (CanvasLayout) so the
+    canvas can be re-rendered at any size; a CANVAS_RENDER_WIDTH JPEG is
+    stored as CanvasPhotoURL for the reports.
+    """
+    try:
+        layout = request.layout.dict()
+        placed_ids = list(dict.fromkeys(item["photo_id"] for item in layout["images"]))
+        if not placed_ids:
+            raise HTTPException(status_code=400, detail="Layout has no photos")
+
+        # The group being updated must belong to the inspection as well as the placed photos
+        wanted_ids = list(dict.fromkeys(placed_ids + request.group_photo_ids))
+        photos_response = supabase.table("PhotoReport")\
+            .select("*")\
+            .eq("InspectionID", request.inspection_id)\
+            .in_("PhotoID", wanted_ids)\
+            .execute()
+        found = {photo["PhotoID"]: photo for photo in photos_response.data or []}
+        missing = set(wanted_ids) - set(found)
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Photos not found in inspection: {sorted(missing)}")
+        photos = [found[photo_id] for photo_id in placed_ids]
+
+        image_bytes = await compose_canvas(layout, photos)
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = f"canvas/canvas_{request.inspection_id}_{timestamp}.jpg"
+        await asyncio.to_thread(
+            supabase.storage.from_("inspection-photos").upload,
+            path, image_bytes, {"content-type": "image/jpeg", "upsert": "true"}
+        )
+        public_url = supabase.storage.from_("inspection-photos").get_public_url(path)
+        print(f"🎨 Composed canvas {public_url} ({len(image_bytes)} bytes)")
+
+        response = supabase.table("PhotoReport")\
+            .update({"CanvasPhotoURL": public_url, "CanvasLayout": layout})\
+            .eq("InspectionID", request.inspection_id)\
+            .in_("PhotoID", request.group_photo_ids)\
+            .execute()
+        background_tasks.add_task(refresh_reports, request.inspection_id)
+
+        return {
+            "success": True,
+            "message": "Canvas composed successfully",
+            "canvas_url": public_url,
+            "updated_photos": len(response.data or []),
+            "photo_ids": request.group_photo_ids
+        }
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print(f"❌ Error composing canvas: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/canvas/{photo_id}/render")
+async def render_canvas_annotation(photo_id: int, width: int = CANVAS_RENDER_WIDTH, format: str = "jpeg"):
+    """
+    Re-render the stored canvas layout of a photo's group at any width
+
+    Args:
+        width: Output width in pixels (height follows the layout aspect; neither side exceeds CANVAS_MAX_WIDTH)
+        format: jpeg, png or webp
+    """
+    try:
+        if not 16 <= width <= CANVAS_MAX_WIDTH:
+            raise HTTPException(status_code=400, detail=f"width must be between 16 and {CANVAS_MAX_WIDTH}")
+        if format not in CANVAS_FORMATS:
+            raise HTTPException(status_code=400, detail=f"format must be one of {sorted(CANVAS_FORMATS)}")
+
+        photo_response = supabase.table("PhotoReport")\
+            .select("InspectionID, CanvasLayout")\
+            .eq("PhotoID", photo_id)\
+            .execute()
+        if not photo_response.data:
+            raise HTTPException(status_code=404, detail="Photo not found")
+        layout = photo_response.data[0].get("CanvasLayout")
+        if isinstance(layout, str):
+            layout = json.loads(layout)
+        if not layout:
+            raise HTTPException(status_code=404, detail="Photo has no canvas layout")
+
+        placed_ids = list(dict.fromkeys(item["photo_id"] for item in layout.get("images", [])))
+        photos = []
+        if placed_ids:
+            photos = supabase.table("PhotoReport")\
+                .select("*")\
+                .eq("InspectionID", photo_response.data[0]["InspectionID"])\
+                .in_("PhotoID", placed_ids)\
+                .execute().data or []
+
+        image_bytes = await compose_canvas(layout, photos, width, format)
+        return Response(
+            content=image_bytes,
+            media_type=CANVAS_FORMATS[format],
+            headers={"Cache-Control": "private, max-age=300"}
+        )
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print(f"❌ Error rendering canvas: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
 
 # ======================================================================
 # Remove AI/Canvas Endpoints
 # ======================================================================
 
 @router.delete("/remove-ai/{photo_id}")
-async def remove_ai_findings(photo_id: int):
+async def remove_ai_findings(photo_id: int, background_tasks: BackgroundTasks):
     """Remove AI-generated findings, recommendations, and annotated image"""
     try:
         # Get current photo data
         photo_response = supabase.table("PhotoReport")\
-            .select("FindingID, RecommendID, AnnotatedPhotoURL")\
+            .select("InspectionID, FindingID, RecommendID, AnnotatedPhotoURL")\
             .eq("PhotoID", photo_id)\
             .execute()
         
@@ -664,7 +1269,11 @@ async def remove_ai_findings(photo_id: int):
             "RecommendID": None,
             "AnnotatedPhotoURL": None,
             "AIDetectionDate": None,
-            "DetectionConfidence": None
+            "DetectionConfidence": None,
+            "Detections": None,
+            "DetectedPhotoURL": None,
+            "DetectionModel": None,
+            "DetectionThreshold": None
         }
         
         supabase.table("PhotoReport")\
@@ -673,6 +1282,7 @@ async def remove_ai_findings(photo_id: int):
             .execute()
         
         print(f"✅ Cleared AI data for photo {photo_id}")
+        background_tasks.add_task(refresh_reports, photo_data["InspectionID"])
         
         return {
             "success": True,
@@ -689,12 +1299,12 @@ async def remove_ai_findings(photo_id: int):
 
 
 @router.delete("/remove-canvas/{photo_id}")
-async def remove_canvas(photo_id: int):
+async def remove_canvas(photo_id: int, background_tasks: BackgroundTasks):
     """Remove canvas annotation from a photo"""
     try:
         # Get current photo data
         photo_response = supabase.table("PhotoReport")\
-            .select("CanvasPhotoURL")\
+            .select("InspectionID, CanvasPhotoURL")\
             .eq("PhotoID", photo_id)\
             .execute()
         
@@ -715,11 +1325,12 @@ async def remove_canvas(photo_id: int):
         
         # Clear CanvasPhotoURL from database
         supabase.table("PhotoReport")\
-            .update({"CanvasPhotoURL": None})\
+            .update({"CanvasPhotoURL": None, "CanvasLayout": None})\
             .eq("PhotoID", photo_id)\
             .execute()
         
         print(f"✅ Cleared canvas data for photo {photo_id}")
+        background_tasks.add_task(refresh_reports, photo_data["InspectionID"])
         
         return {
             "success": True,
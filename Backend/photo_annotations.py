@@ -0,0 +1,203 @@
+# photo_annotations.py
+"""
+AI Annotation Rendering - Pillow
+Detection boxes are stored as coordinates (PhotoReport.Detections) and the
+annotated photo is drawn here from the original, instead of decoding and
+re-uploading the annotated_image_base64 the detection Space sends back.
+
+Drawing runs on the shared worker process pool. The stored file name contains a hash
+of PhotoURL + Detections, so an annotated image is only rendered once per
+set of boxes: after detection, or lazily the first time it is requested.
+"""
+
+from typing import Dict, List, Optional
+import io
+import os
+import json
+import asyncio
+import hashlib
+import weakref
+import traceback
+import httpx
+from PIL import Image, ImageDraw, ImageOps
+from supabase import create_client, Client
+from dotenv import load_dotenv
+
+from report_assets import load_stamp_font, to_rgb
+from detector import normalize_detections
+from image_fetch import IMAGE_FETCH_TIMEOUT, fetch_image
+from worker_pool import run_in_pool
+
+load_dotenv()
+
+# Initialize Supabase
+url = os.environ.get("SUPABASE_URL")
+key = os.environ.get("SUPABASE_ANON_KEY")
+
+if not url:
+    raise ValueError("SUPABASE_URL environment variable is not set.")
+if not key:
+    raise ValueError("SUPABASE_ANON_KEY environment variable is not set.")
+
+supabase: Client = create_client(url, key)
+
+BUCKET_NAME = "inspection-photos"
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+# Longest side of the stored annotated image
+ANNOTATION_MAX_PX = int(os.environ.get("ANNOTATION_MAX_PX", "2048"))
+
+ANNOTATION_JPEG_QUALITY = int(os.environ.get("ANNOTATION_JPEG_QUALITY", "85"))
+
+# Photos annotated at the same time
+ANNOTATION_CONCURRENCY = int(os.environ.get("ANNOTATION_CONCURRENCY", "2"))
+
+# Box colour per defect class (anything else uses the default)
+CLASS_COLORS = {
+    "corrosion": "#ef4444",
+    "dents": "#f59e0b",
+    "scratch_mark": "#3b82f6",
+    "welding_defects": "#a855f7",
+}
+DEFAULT_BOX_COLOR = "#22c55e"
+
+# One limit per event loop (a semaphore cannot be shared between loops)
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+# ---------------------------------------------------------
+# Detections
+# ---------------------------------------------------------
+
+def annotation_token(photo_url: str, detections: List[dict]) -> str:
+    payload = json.dumps([photo_url.split("?")[0], detections], sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+def annotated_path(photo_id: int, token: str) -> str:
+    return f"annotated/{photo_id}-{token}.jpg"
+
+def is_current(photo: dict) -> bool:
+    """True if AnnotatedPhotoURL was rendered from the photo's current boxes"""
+    detections = photo.get("Detections")
+    annotated = photo.get("AnnotatedPhotoURL") or ""
+    if detections is None or not photo.get("PhotoURL"):
+        return True
+    token = annotation_token(photo["PhotoURL"], detections)
+    return annotated.split("?")[0].endswith(annotated_path(photo["PhotoID"], token))
+
+# ---------------------------------------------------------
+# Drawing (runs in the worker processes)
+# ---------------------------------------------------------
+
+def draw_detections(data: bytes, detections: List[dict], max_px: int = ANNOTATION_MAX_PX,
+                    quality: int = ANNOTATION_JPEG_QUALITY) -> bytes:
+    """
+    Draw boxes and "class 0.87" tags on the photo, downsized to max_px
+
+    Boxes are in pixels of the EXIF-oriented original and are scaled with it.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        original_w, original_h = img.size
+        img = to_rgb(img)
+        if max(img.size) > max_px:
+            img.thumbnail((max_px, max_px), Image.LANCZOS)
+        sx, sy = img.width / original_w, img.height / original_h
+
+        draw = ImageDraw.Draw(img)
+        line = max(2, round(max(img.size) / 400))
+        font = load_stamp_font(max(12, round(max(img.size) / 60)))
+
+        for d in detections:
+            x1, y1, x2, y2 = d["bbox"]
+            box = (x1 * sx, y1 * sy, x2 * sx, y2 * sy)
+            color = CLASS_COLORS.get(d["class_name"], DEFAULT_BOX_COLOR)
+            draw.rectangle(box, outline=color, width=line)
+
+            tag = f"{d['class_name']} {d['confidence']:.2f}"
+            left, top, right, bottom = draw.textbbox((0, 0), tag, font=font)
+            tag_h = bottom - top + line * 2
+            tag_y = box[1] - tag_h if box[1] - tag_h >= 0 else box[1]
+            draw.rectangle((box[0], tag_y, box[0] + right - left + line * 2, tag_y + tag_h), fill=color)
+            draw.text((box[0] + line - left, tag_y + line - top), tag, fill="white", font=font)
+
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+        return out.getvalue()
+
+# ---------------------------------------------------------
+# Rendering
+# ---------------------------------------------------------
+
+def _upload(path: str, data: bytes) -> str:
+    supabase.storage.from_(BUCKET_NAME).upload(
+        path=path,
+        file=data,
+        file_options={"content-type": "image/jpeg", "upsert": "true", "cache-control": "31536000"}
+    )
+    return supabase.storage.from_(BUCKET_NAME).get_public_url(path)
+
+def _semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(ANNOTATION_CONCURRENCY)
+    return _semaphores[loop]
+
+async def render_annotated(client: httpx.AsyncClient, photo: dict) -> Optional[str]:
+    """
+    Annotated image URL for a PhotoReport row ({PhotoID, PhotoURL, Detections})
+
+    Reuses AnnotatedPhotoURL when it was drawn from the same boxes. Does not
+    update the row.
+
+    A photo without boxes (Detections == []) still gets a plain copy, the
+    same as the detection Space returned before.
+
+    Returns:
+        Public URL, or None without Detections or when the photo could not be loaded
+    """
+    detections = photo.get("Detections")
+    if detections is None or not photo.get("PhotoURL"):
+        return None
+    if photo.get("AnnotatedPhotoURL") and is_current(photo):
+        return photo["AnnotatedPhotoURL"]
+
+    path = annotated_path(photo["PhotoID"], annotation_token(photo["PhotoURL"], detections))
+    async with _semaphore():
+        data = await fetch_image(client, asyncio.Semaphore(1), photo["PhotoURL"])
+        if not data:
+            print(f"⚠️ Could not load photo {photo['PhotoID']} for annotation")
+            return None
+        rendered = await run_in_pool(draw_detections, data, detections)
+        del data
+        return await asyncio.to_thread(_upload, path, rendered)
+
+async def render_many(photos: List[dict]) -> Dict[int, Optional[str]]:
+    """render_annotated() for several photos (PhotoID -> URL), failures map to None"""
+    async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as client:
+        async def run(photo: dict) -> Optional[str]:
+            try:
+                return await render_annotated(client, photo)
+            except Exception as e:
+                print(f"❌ Annotation failed for photo {photo.get('PhotoID')}: {e}")
+                traceback.print_exc()
+                return None
+
+        results = await asyncio.gather(*[run(photo) for photo in photos])
+    return {photo["PhotoID"]: result for photo, result in zip(photos, results)}
+
+async def ensure_annotated(photo: dict) -> Optional[str]:
+    """Render on first view and store AnnotatedPhotoURL (skipped if the photo changed meanwhile)"""
+    if photo.get("AnnotatedPhotoURL") and is_current(photo):
+        return photo["AnnotatedPhotoURL"]
+
+    annotated_url = (await render_many([photo])).get(photo["PhotoID"])
+    if annotated_url:
+        supabase.table("PhotoReport")\
+            .update({"AnnotatedPhotoURL": annotated_url})\
+            .eq("PhotoID", photo["PhotoID"])\
+            .eq("PhotoURL", photo["PhotoURL"])\
+            .execute()
+    return annotated_url
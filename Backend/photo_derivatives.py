@@ -0,0 +1,240 @@
+# photo_derivatives.py
+"""
+Photo Derivatives - Pillow
+Builds smaller copies of every inspection photo so galleries do not download
+full-resolution originals:
+
+    thumbnail  320 px   -> PhotoReport.ThumbnailURL
+    preview   1024 px   -> PhotoReport.PreviewURL
+    print     2048 px   -> PhotoReport.PrintURL
+
+Each size is stored as JPEG (URL kept in the column) and as WebP next to it
+(same path, .webp extension). Derivative names contain a hash of PhotoURL, so
+replacing a photo makes its old derivatives stale and they are rebuilt.
+Generation runs in the background, after upload or lazily when listed.
+The same pass stores the photo's perceptual hashes (see photo_hash).
+"""
+
+from typing import Dict, Iterable, Optional, Tuple
+import io
+import os
+import hashlib
+import asyncio
+import weakref
+import traceback
+import httpx
+from PIL import Image, ImageOps
+from supabase import create_client, Client
+from dotenv import load_dotenv
+
+from photo_hash import image_hashes
+from image_fetch import IMAGE_FETCH_TIMEOUT, fetch_image
+
+load_dotenv()
+
+# Initialize Supabase
+url = os.environ.get("SUPABASE_URL")
+key = os.environ.get("SUPABASE_ANON_KEY")
+
+if not url:
+    raise ValueError("SUPABASE_URL environment variable is not set.")
+if not key:
+    raise ValueError("SUPABASE_ANON_KEY environment variable is not set.")
+
+supabase: Client = create_client(url, key)
+
+BUCKET_NAME = "inspection-images"
+
+# name -> (longest side in px, PhotoReport column)
+DERIVATIVE_SIZES = {
+    "thumbnail": (320, "ThumbnailURL"),
+    "preview": (1024, "PreviewURL"),
+    "print": (2048, "PrintURL"),
+}
+
+DERIVATIVE_JPEG_QUALITY = int(os.environ.get("DERIVATIVE_JPEG_QUALITY", "82"))
+DERIVATIVE_WEBP_QUALITY = int(os.environ.get("DERIVATIVE_WEBP_QUALITY", "78"))
+
+# Photos processed at the same time (decoding full-size photos is memory heavy)
+DERIVATIVE_CONCURRENCY = int(os.environ.get("DERIVATIVE_CONCURRENCY", "2"))
+
+# One limit per event loop (a semaphore cannot be shared between loops)
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+# Photos with a generation queued or running
+_pending: set = set()
+
+# ---------------------------------------------------------
+# Naming
+# ---------------------------------------------------------
+
+def _source_token(photo_url: str) -> str:
+    return hashlib.sha1(photo_url.split("?")[0].encode("utf-8")).hexdigest()[:10]
+
+def derivative_path(photo_id: int, photo_url: str, name: str, ext: str) -> str:
+    return f"derivatives/{photo_id}-{_source_token(photo_url)}-{name}.{ext}"
+
+def webp_url(jpeg_url: Optional[str]) -> Optional[str]:
+    """WebP sibling of a derivative JPEG URL"""
+    if not jpeg_url or not jpeg_url.split("?")[0].endswith(".jpg"):
+        return None
+    base, _, query = jpeg_url.partition("?")
+    return base[:-4] + ".webp" + (f"?{query}" if query else "")
+
+def _object_path(public_url: Optional[str]) -> Optional[str]:
+    marker = f"/{BUCKET_NAME}/"
+    if not public_url or marker not in public_url:
+        return None
+    return public_url.split("?")[0].split(marker, 1)[1]
+
+def derivative_paths(photo: dict) -> list:
+    """Every derivative object (JPEG and WebP) of a photo row: built from its PhotoURL or stored in its columns"""
+    paths = set()
+    if photo.get("PhotoID") and photo.get("PhotoURL"):
+        for name in DERIVATIVE_SIZES:
+            for ext in ("jpg", "webp"):
+                paths.add(derivative_path(photo["PhotoID"], photo["PhotoURL"], name, ext))
+    for _, column in DERIVATIVE_SIZES.values():
+        path = _object_path(photo.get(column))
+        if path:
+            paths.add(path)
+            paths.add(path[:-4] + ".webp" if path.endswith(".jpg") else path)
+    return sorted(paths)
+
+def needs_derivatives(photo: dict) -> bool:
+    """True if hashes or any derivative are missing, or were built from a different PhotoURL"""
+    photo_url = photo.get("PhotoURL")
+    if not photo_url or not photo.get("PhotoID"):
+        return False
+    if not photo.get("PHash") or not photo.get("DHash"):
+        return True
+    token = f"/derivatives/{photo['PhotoID']}-{_source_token(photo_url)}-"
+    return any(token not in (photo.get(column) or "") for _, column in DERIVATIVE_SIZES.values())
+
+# ---------------------------------------------------------
+# Image Processing
+# ---------------------------------------------------------
+
+def render_derivatives(data: bytes) -> Tuple[Dict[str, Tuple[bytes, bytes]], Dict[str, str]]:
+    """
+    Decode once and produce every size (largest first) plus the perceptual hashes
+
+    Returns:
+        (name -> (jpeg bytes, webp bytes), {"PHash", "DHash"}); metadata is not carried over
+    """
+    results = {}
+    largest = max(size for size, _ in DERIVATIVE_SIZES.values())
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("RGB", (largest, largest))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, "white")
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        hashes = image_hashes(img)
+
+        for name, (size, _) in sorted(DERIVATIVE_SIZES.items(), key=lambda item: -item[1][0]):
+            if max(img.size) > size:
+                img.thumbnail((size, size), Image.LANCZOS)
+            jpeg, webp = io.BytesIO(), io.BytesIO()
+            img.save(jpeg, format="JPEG", quality=DERIVATIVE_JPEG_QUALITY, optimize=True, progressive=True)
+            img.save(webp, format="WEBP", quality=DERIVATIVE_WEBP_QUALITY, method=4)
+            results[name] = (jpeg.getvalue(), webp.getvalue())
+    return results, hashes
+
+def _upload(path: str, data: bytes, content_type: str) -> str:
+    supabase.storage.from_(BUCKET_NAME).upload(
+        path=path,
+        file=data,
+        file_options={"content-type": content_type, "upsert": "true", "cache-control": "31536000"}
+    )
+    return supabase.storage.from_(BUCKET_NAME).get_public_url(path)
+
+def remove_derivatives(photos: Iterable[dict]):
+    """Delete the derivatives of deleted or replaced photos (background task)"""
+    paths = sorted({path for photo in photos if photo for path in derivative_paths(photo)})
+    if not paths:
+        return
+    try:
+        supabase.storage.from_(BUCKET_NAME).remove(paths)
+        print(f"🗑️ Removed {len(paths)} derivative object(s)")
+    except Exception as e:
+        print(f"⚠️ Could not remove derivatives {paths}: {e}")
+
+# ---------------------------------------------------------
+# Generation
+# ---------------------------------------------------------
+
+def _semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(DERIVATIVE_CONCURRENCY)
+    return _semaphores[loop]
+
+async def _generate(client: httpx.AsyncClient, photo_id: int):
+    res = supabase.table("PhotoReport").select("*").eq("PhotoID", photo_id).execute()
+    if not res.data or not needs_derivatives(res.data[0]):
+        return
+    photo = res.data[0]
+    photo_url = photo["PhotoURL"]
+
+    data = await fetch_image(client, asyncio.Semaphore(1), photo_url)
+    if not data:
+        print(f"⚠️ Could not load photo {photo_id} for derivatives")
+        return
+
+    rendered, hashes = await asyncio.to_thread(render_derivatives, data)
+    del data
+
+    update = dict(hashes)
+    for name, (jpeg, webp) in rendered.items():
+        column = DERIVATIVE_SIZES[name][1]
+        await asyncio.to_thread(_upload, derivative_path(photo_id, photo_url, name, "webp"), webp, "image/webp")
+        update[column] = await asyncio.to_thread(
+            _upload, derivative_path(photo_id, photo_url, name, "jpg"), jpeg, "image/jpeg"
+        )
+
+    # Skip the update if the photo was replaced or deleted while we were working
+    res = supabase.table("PhotoReport").update(update)\
+        .eq("PhotoID", photo_id)\
+        .eq("PhotoURL", photo_url)\
+        .execute()
+    if not res.data:
+        await asyncio.to_thread(remove_derivatives, [{"PhotoID": photo_id, "PhotoURL": photo_url}])
+        return
+    print(f"🖼️ Derivatives ready for photo {photo_id}")
+
+async def generate_derivatives(photo_ids: Iterable[int]):
+    """Build missing/stale derivatives for the given photos (background task)"""
+    semaphore = _semaphore()
+    ids = [p for p in dict.fromkeys(photo_ids) if p]
+    if not ids:
+        return
+
+    async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as client:
+        async def run(photo_id: int):
+            async with semaphore:
+                try:
+                    await _generate(client, photo_id)
+                except Exception as e:
+                    print(f"❌ Derivative generation failed for photo {photo_id}: {e}")
+                    traceback.print_exc()
+                finally:
+                    _pending.discard(photo_id)
+
+        await asyncio.gather(*[run(photo_id) for photo_id in ids])
+
+def claim_stale(photos: Iterable[dict]) -> list:
+    """PhotoIDs needing derivatives that are not already queued (marks them queued)"""
+    claimed = []
+    for photo in photos:
+        if needs_derivatives(photo) and photo["PhotoID"] not in _pending:
+            _pending.add(photo["PhotoID"])
+            claimed.append(photo["PhotoID"])
+    return claimed
+
+def with_webp_urls(photo: dict) -> dict:
+    """Add ThumbnailWebpURL/PreviewWebpURL/PrintWebpURL next to the JPEG columns"""
+    for _, column in DERIVATIVE_SIZES.values():
+        photo[column.replace("URL", "WebpURL")] = webp_url(photo.get(column))
+    return photo
@@ -0,0 +1,101 @@
+# photo_hash.py
+"""
+Perceptual Photo Hashes - Pillow
+dHash (gradient) and pHash (DCT) as 64-bit hex strings, stored on
+PhotoReport.DHash / PhotoReport.PHash. Near-identical shots of the same
+defect have hashes a few bits apart, so an inspection's photos can be
+grouped into near-duplicate clusters by Hamming distance.
+"""
+
+from typing import Dict, List, Optional
+import os
+import math
+from PIL import Image, ImageOps
+
+# Max differing bits (out of 64) for two photos to count as near-duplicates
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get("NEAR_DUPLICATE_DISTANCE", "10"))
+
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+
+# cos((2x + 1) * u * pi / 2N) for the coefficients we keep
+_COS = [
+    [math.cos((2 * x + 1) * u * math.pi / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)]
+    for u in range(_DCT_KEEP)
+]
+
+# ---------------------------------------------------------
+# Hashing
+# ---------------------------------------------------------
+
+def _gray(img: Image.Image, size: tuple) -> List[int]:
+    small = ImageOps.exif_transpose(img).convert("L").resize(size, Image.LANCZOS)
+    return list(small.getdata())
+
+def _to_hex(bits: List[bool]) -> str:
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f"{value:016x}"
+
+def dhash(img: Image.Image) -> str:
+    """Row-wise gradient hash: is each pixel brighter than its right neighbour"""
+    pixels = _gray(img, (9, 8))
+    bits = [pixels[row * 9 + col] > pixels[row * 9 + col + 1] for row in range(8) for col in range(8)]
+    return _to_hex(bits)
+
+def phash(img: Image.Image) -> str:
+    """DCT hash: low-frequency 8x8 DCT coefficients compared to their median"""
+    pixels = _gray(img, (_DCT_SIZE, _DCT_SIZE))
+    rows = [pixels[y * _DCT_SIZE:(y + 1) * _DCT_SIZE] for y in range(_DCT_SIZE)]
+
+    # Separable 2D DCT, only the first 8x8 coefficients
+    row_dct = [[sum(c * p for c, p in zip(_COS[u], row)) for u in range(_DCT_KEEP)] for row in rows]
+    coeffs = [
+        sum(_COS[v][y] * row_dct[y][u] for y in range(_DCT_SIZE))
+        for v in range(_DCT_KEEP) for u in range(_DCT_KEEP)
+    ]
+
+    # The DC term only reflects overall brightness
+    median = sorted(coeffs[1:])[len(coeffs[1:]) // 2]
+    return _to_hex([c > median for c in coeffs])
+
+def image_hashes(img: Image.Image) -> Dict[str, str]:
+    """PhotoReport columns for an already-decoded image"""
+    return {"PHash": phash(img), "DHash": dhash(img)}
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+# ---------------------------------------------------------
+# Clustering
+# ---------------------------------------------------------
+
+def _distance(a: dict, b: dict) -> Optional[int]:
+    if not (a.get("PHash") and a.get("DHash") and b.get("PHash") and b.get("DHash")):
+        return None
+    return max(hamming(a["PHash"], b["PHash"]), hamming(a["DHash"], b["DHash"]))
+
+def near_duplicate_clusters(photos: List[dict], max_distance: int = NEAR_DUPLICATE_DISTANCE) -> List[List[dict]]:
+    """
+    Group photos whose pHash and dHash are both within max_distance bits
+
+    Complete linkage: a photo joins the first cluster whose every member
+    (the representative included) is within max_distance, so a chain of
+    small steps A-B-C never pulls C in when it is far from A. Photos without
+    hashes stay on their own. Clusters keep the input order, so the first
+    photo (lowest numbering) is the cluster's representative.
+
+    Returns:
+        Every photo exactly once, as a list of clusters
+    """
+    clusters: List[List[dict]] = []
+    for photo in photos:
+        for cluster in clusters:
+            distances = [_distance(photo, member) for member in cluster]
+            if all(d is not None and d <= max_distance for d in distances):
+                cluster.append(photo)
+                break
+        else:
+            clusters.append([photo])
+    return clusters
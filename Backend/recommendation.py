@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, BackgroundTasks
 from pydantic import BaseModel
 from typing import Optional, List
 import os
@@ -6,6 +6,8 @@ from supabase import create_client, Client
 from dotenv import load_dotenv
 import traceback
 
+from report_cache import inspections_for_field, refresh_reports_many
+
 load_dotenv()
 
 # Initialize Supabase
@@ -83,7 +85,7 @@ def get_recommendation(recommend_id: int):
 
 # 4. Update Recommendation
 @router.put("/{recommend_id}")
-def update_recommendation(recommend_id: int, recommendation: RecommendationUpdate):
+def update_recommendation(recommend_id: int, recommendation: RecommendationUpdate, background_tasks: BackgroundTasks):
     try:
         update_data = {k: v for k, v in recommendation.dict().items() if v is not None}
         response = supabase.table("Recommendation").update(update_data).eq("RecommendID", recommend_id).execute()
@@ -91,17 +93,22 @@ def update_recommendation(recommend_id: int, recommendation: RecommendationUpdat
         if not response.data:
             raise HTTPException(status_code=404, detail="Recommendation not found or update failed")
             
+        # Reports showing this recommendation are now stale
+        background_tasks.add_task(refresh_reports_many, inspections_for_field("RecommendID", recommend_id))
+
         return response.data[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # 5. Delete Recommendation
 @router.delete("/{recommend_id}")
-def delete_recommendation(recommend_id: int):
+def delete_recommendation(recommend_id: int, background_tasks: BackgroundTasks):
     try:
+        affected = inspections_for_field("RecommendID", recommend_id)
         response = supabase.table("Recommendation").delete().eq("RecommendID", recommend_id).execute()
         if not response.data:
             raise HTTPException(status_code=404, detail="Recommendation not found")
+        background_tasks.add_task(refresh_reports_many, affected)
         return {"message": "Recommendation deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
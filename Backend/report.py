@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, BackgroundTasks, Header
 from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
@@ -20,14 +20,22 @@ from dotenv import load_dotenv
 import traceback
 import time
 import io
+import asyncio
+import zipfile
+
+from report_assets import compact_docx_images
+from report_data import load_report_bundle
+from report_docx import DOCX_CONTENT_TYPE, render_inspection_docx
+from report_cache import content_version, generated_version, refresh_reports
+from report_export import FILE_FIELDS, list_export_files, stream_export_zip
+from storage_stream import UploadTooLarge, stream_to_storage
+from idempotency import run_idempotent
 
 # Optional PDF generator
 try:
-    from reportlab.lib.pagesizes import A4
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.units import cm
+    from report_pdf import build_inspection_pdf, iter_file
     REPORTLAB_AVAILABLE = True
-except Exception:
+except ImportError:
     REPORTLAB_AVAILABLE = False
 
 load_dotenv()
@@ -107,6 +115,22 @@ def find_libreoffice():
     
     return None
 
+def _store_word_file(inspection_id: int, filename: str, docx_bytes: bytes, has_report: bool) -> str:
+    """Upload a generated DOCX and attach it to the Report entry (create it if this is the first file)"""
+    bucket_name = "inspection-reports"
+    supabase.storage.from_(bucket_name).upload(
+        path=filename,
+        file=docx_bytes,
+        file_options={"content-type": DOCX_CONTENT_TYPE, "upsert": "true"}
+    )
+    docx_url = supabase.storage.from_(bucket_name).get_public_url(filename)
+
+    if has_report:
+        supabase.table("Report").update({"WordFile": docx_url}).eq("InspectionID", inspection_id).execute()
+    else:
+        supabase.table("Report").insert({"InspectionID": inspection_id, "WordFile": docx_url}).execute()
+    return docx_url
+
 # ---------------------------------------------------------
 # Routes
 # ---------------------------------------------------------
@@ -118,14 +142,24 @@ def create_report(report: ReportCreate):
         new_data = report.dict()
         existing = supabase.table("Report").select("*").eq("InspectionID", report.InspectionID).execute()
         if existing.data:
-            raise HTTPException(status_code=400, detail="Report already exists for this Inspection ID. Use Update instead.")
-
-        response = supabase.table("Report").insert(new_data).execute()
+            row = existing.data[0]
+            # A row holding only pre-generated files (report_cache) is taken over
+            generated_only = all(
+                not row.get(f) or generated_version(row.get(f), report.InspectionID) for f in ("WordFile", "PdfFile")
+            ) and not row.get("UserID") and not row.get("Comment")
+            if not generated_only:
+                raise HTTPException(status_code=400, detail="Report already exists for this Inspection ID. Use Update instead.")
+            update_data = {k: v for k, v in new_data.items() if v is not None and k != "InspectionID"}
+            response = supabase.table("Report").update(update_data).eq("InspectionID", report.InspectionID).execute()
+        else:
+            response = supabase.table("Report").insert(new_data).execute()
         
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to create report entry")
             
         return response.data[0]
+    except HTTPException as he:
+        raise he
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
@@ -143,6 +177,98 @@ def get_all_reports():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# 2a. Export approved reports as a ZIP (declared before /{inspection_id})
+@router.get("/export")
+async def export_approved_reports(
+    vessel_id: Optional[int] = None,
+    plant: Optional[str] = None,
+    year: Optional[int] = None,
+    kind: str = "pdf"
+):
+    try:
+        if kind not in FILE_FIELDS:
+            raise HTTPException(status_code=400, detail=f"kind must be one of: {', '.join(FILE_FIELDS)}")
+
+        files = await asyncio.to_thread(list_export_files, vessel_id, plant, year, kind)
+        if not files:
+            raise HTTPException(status_code=404, detail="No approved reports match this filter")
+
+        parts = ["Approved-Reports"] + [str(v) for v in (vessel_id, plant, year) if v is not None]
+        filename = "-".join(parts).replace("/", "-").replace('"', "") + ".zip"
+        print(f"📦 Exporting {len(files)} approved report file(s) as {filename}")
+        return StreamingResponse(
+            stream_export_zip(files),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
+
+# 2b. Generate Report PDF on the server (ReportLab)
+@router.get("/{inspection_id}/pdf")
+async def generate_report_pdf(inspection_id: int):
+    if not REPORTLAB_AVAILABLE:
+        raise HTTPException(status_code=503, detail="PDF generation is not available (ReportLab/pypdf not installed)")
+    try:
+        bundle = await asyncio.to_thread(load_report_bundle, inspection_id)
+        if not bundle:
+            raise HTTPException(status_code=404, detail="Inspection not found")
+
+        print(f"📄 Generating PDF for inspection {inspection_id} ({len(bundle['photos'])} photos)")
+        spool = await build_inspection_pdf(bundle)
+
+        report_no = str(bundle["inspection"].get("ReportNo") or inspection_id).replace("/", "-")
+        return StreamingResponse(
+            iter_file(spool),
+            media_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="Inspection-{report_no}.pdf"'}
+        )
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"PDF generation failed: {str(e)}")
+
+# 2c. Generate Report DOCX on the server (docxtpl) and store it
+@router.post("/generate-docx")
+async def generate_report_docx(req: GenerateReportRequest):
+    try:
+        bundle = await asyncio.to_thread(load_report_bundle, req.InspectionID)
+        if not bundle:
+            raise HTTPException(status_code=404, detail="Inspection not found")
+
+        # Reuse the pre-generated file if the content has not changed
+        version = content_version(bundle)
+        existing = await asyncio.to_thread(
+            supabase.table("Report").select("InspectionID, WordFile").eq("InspectionID", req.InspectionID).execute
+        )
+        if req.ReportDate is None and existing.data and \
+                generated_version(existing.data[0].get("WordFile"), req.InspectionID) == version:
+            print(f"✅ DOCX for inspection {req.InspectionID} already generated (version {version})")
+            return {"url": existing.data[0]["WordFile"], "cached": True}
+
+        print(f"📝 Generating DOCX for inspection {req.InspectionID} ({len(bundle['photos'])} photos)")
+        docx_bytes = await render_inspection_docx(bundle, report_date=req.ReportDate)
+
+        if req.ReportDate is None:
+            filename = f"Generated-Word-{req.InspectionID}-{version}.docx"
+        else:
+            filename = f"Word-{req.InspectionID}-{int(time.time())}.docx"
+        docx_url = await asyncio.to_thread(
+            _store_word_file, req.InspectionID, filename, docx_bytes, bool(existing.data)
+        )
+
+        print(f"✅ DOCX stored: {docx_url} ({len(docx_bytes)} bytes)")
+        return {"url": docx_url, "size": len(docx_bytes), "cached": False}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"DOCX generation failed: {str(e)}")
+
 # 3. Get Report by InspectionID (PK)
 @router.get("/{inspection_id}")
 def get_report(inspection_id: int):
@@ -216,22 +342,17 @@ def delete_report(inspection_id: int):
 
 # 6. Upload Report File (Word/PDF)
 @router.post("/upload")
-def upload_report_file(file: UploadFile = File(...)):
+async def upload_report_file(file: UploadFile = File(...)):
     try:
         bucket_name = "inspection-reports" 
         filename = f"{int(time.time())}_{file.filename}"
         
-        file_content = file.file.read()
-        
-        response = supabase.storage.from_(bucket_name).upload(
-            path=filename,
-            file=file_content,
-            file_options={"content-type": file.content_type}
-        )
-        
-        public_url = supabase.storage.from_(bucket_name).get_public_url(filename)
+        # Streamed in chunks, never held in memory as a whole
+        public_url = await stream_to_storage(bucket_name, filename, file)
         
         return {"url": public_url}
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to upload file: {str(e)}")
@@ -262,28 +383,38 @@ def get_reports_by_inspector(user_id: int):
 
 # 8. Approve report with Upload (Admin action)
 @router.post("/{inspection_id}/approve-upload")
-async def approve_report_upload(inspection_id: int, file: UploadFile = File(...)):
+async def approve_report_upload(inspection_id: int, file: UploadFile = File(...),
+                                idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    """
+    Store the signed Word file, convert it to PDF and mark the report approved
+
+    A retry with the same Idempotency-Key returns the first approval instead
+    of uploading and converting again.
+    """
+    return await run_idempotent(
+        idempotency_key, f"approve-upload:{inspection_id}",
+        {"filename": file.filename, "size": file.size},
+        lambda: _approve_report_upload(inspection_id, file)
+    )
+
+async def _approve_report_upload(inspection_id: int, file: UploadFile):
     try:
-        # 1. Upload Signed Word File
-        bucket_name = "inspection-reports"
-        filename_docx = f"Approved-Word-{inspection_id}-{int(time.time())}.docx"
-        file_content = await file.read()
-        
-        supabase.storage.from_(bucket_name).upload(
-            path=filename_docx,
-            file=file_content,
-            file_options={"content-type": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"}
-        )
-        url_docx = supabase.storage.from_(bucket_name).get_public_url(filename_docx)
-
-        # 2. Convert to PDF using LibreOffice
+        # 1. Save DOCX to temp (oversized photos shrunk so the PDF stays small).
+        # A file that is not a DOCX is rejected here, before anything is stored.
         temp_dir = tempfile.mkdtemp()
         docx_path = os.path.join(temp_dir, "input.docx")
         pdf_path = os.path.join(temp_dir, "input.pdf")
+        await asyncio.to_thread(compact_docx_images, file.file, docx_path)
+
+        # 2. Upload Signed Word File
+        bucket_name = "inspection-reports"
+        filename_docx = f"Approved-Word-{inspection_id}-{int(time.time())}.docx"
 
-        # Save DOCX to temp
-        with open(docx_path, "wb") as f:
-            f.write(file_content)
+        # Streamed in chunks, never held in memory as a whole
+        await file.seek(0)
+        url_docx = await stream_to_storage(bucket_name, filename_docx, file, DOCX_CONTENT_TYPE)
+
+        # 3. Convert to PDF using LibreOffice
 
         # Find LibreOffice
         soffice_path = find_libreoffice()
@@ -337,7 +468,7 @@ async def approve_report_upload(inspection_id: int, file: UploadFile = File(...)
         if not conversion_success or not os.path.exists(pdf_path):
             raise Exception(f"PDF conversion failed. LibreOffice path: {soffice_path}")
 
-        # 3. Upload Generated PDF
+        # 4. Upload Generated PDF
         filename_pdf = f"Approved-PDF-{inspection_id}-{int(time.time())}.pdf"
         with open(pdf_path, "rb") as f:
             pdf_content = f.read()
@@ -349,7 +480,7 @@ async def approve_report_upload(inspection_id: int, file: UploadFile = File(...)
         )
         url_pdf = supabase.storage.from_(bucket_name).get_public_url(filename_pdf)
 
-        # 4. Update Database
+        # 5. Update Database
         supabase.table("Report").update({
             "ApprovedWordFile": url_docx,
             "ApprovedPdfFile": url_pdf
@@ -382,6 +513,12 @@ async def approve_report_upload(inspection_id: int, file: UploadFile = File(...)
 
         return {"message": "Report approved and uploaded", "docx_url": url_docx, "pdf_url": url_pdf}
 
+    except zipfile.BadZipFile:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail="Uploaded file is not a valid DOCX document")
+    except UploadTooLarge as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         traceback.print_exc()
         if 'temp_dir' in locals():
@@ -390,7 +527,7 @@ async def approve_report_upload(inspection_id: int, file: UploadFile = File(...)
 
 # 9. Revert Approval (Admin action)
 @router.put("/{inspection_id}/revert-approval")
-def revert_approval(inspection_id: int):
+def revert_approval(inspection_id: int, background_tasks: BackgroundTasks):
     try:
         supabase.table("Report").update({
             "ApprovedWordFile": None,
@@ -400,6 +537,9 @@ def revert_approval(inspection_id: int):
 
         supabase.table("Inspection").update({"Status": "Completed"}).eq("InspectionID", inspection_id).execute()
 
+        # Back to Completed: make sure the generated files are ready again
+        background_tasks.add_task(refresh_reports, inspection_id)
+
         return {"message": "Report reverted to Completed status"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -412,9 +552,11 @@ async def convert_docx_to_pdf_endpoint(file: UploadFile = File(...)):
     pdf_path = os.path.join(temp_dir, "input.pdf")
 
     try:
-        # Save uploaded DOCX
-        with open(docx_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        # Save uploaded DOCX (oversized photos shrunk so the PDF stays small)
+        try:
+            await asyncio.to_thread(compact_docx_images, file.file, docx_path)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="Uploaded file is not a valid DOCX document")
 
         # Find LibreOffice
         soffice_path = find_libreoffice()
@@ -479,6 +621,8 @@ async def convert_docx_to_pdf_endpoint(file: UploadFile = File(...)):
             media_type="application/pdf"
         )
 
+    except HTTPException as he:
+        raise he
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Conversion failed: {str(e)}")
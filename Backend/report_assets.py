@@ -0,0 +1,205 @@
+# report_assets.py
+"""
+Report Image Asset Pipeline - Pillow
+Prepares photos for PDF/DOCX reports: EXIF-orient, resize to the printed box
+at REPORT_IMAGE_DPI, stamp the photo number and recompress as JPEG without
+metadata. Results are memoized per (photo, size) so regenerating a report
+does not download or re-encode unchanged photos.
+"""
+
+from collections import OrderedDict
+from typing import Optional, Tuple
+import io
+import os
+import re
+import asyncio
+import zipfile
+import threading
+import httpx
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from image_fetch import fetch_image
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+# Print resolution used to size report images
+REPORT_IMAGE_DPI = int(os.environ.get("REPORT_IMAGE_DPI", "150"))
+
+# JPEG quality (1-95) of recompressed report images
+REPORT_JPEG_QUALITY = int(os.environ.get("REPORT_JPEG_QUALITY", "80"))
+
+# Memory used by the memoized assets
+ASSET_CACHE_BYTES = int(os.environ.get("REPORT_ASSET_CACHE_MB", "64")) * 1024 * 1024
+
+# Longest side of images kept inside uploaded DOCX files (full A4 width at print DPI)
+DOCX_MEDIA_MAX_PX = int(8.27 * REPORT_IMAGE_DPI)
+
+# ---------------------------------------------------------
+# Memo Cache
+# ---------------------------------------------------------
+
+class AssetCache:
+    """LRU cache bounded by total bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, cache_key: tuple) -> Optional[bytes]:
+        with self.lock:
+            data = self.items.get(cache_key)
+            if data is not None:
+                self.items.move_to_end(cache_key)
+            return data
+
+    def put(self, cache_key: tuple, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            if cache_key in self.items:
+                self.size -= len(self.items.pop(cache_key))
+            self.items[cache_key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= len(evicted)
+
+_cache = AssetCache(ASSET_CACHE_BYTES)
+
+# ---------------------------------------------------------
+# Image Processing
+# ---------------------------------------------------------
+
+def load_stamp_font(size: int):
+    for font_name in ("DejaVuSans-Bold.ttf", "LiberationSans-Bold.ttf", "arialbd.ttf"):
+        try:
+            return ImageFont.truetype(font_name, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+def stamp_image(img: Image.Image, text: str) -> Image.Image:
+    """Draw the photo number (white box, red border) at the top-left corner"""
+    font_size = max(12, int(img.width * 0.1))
+    font = load_stamp_font(font_size)
+    draw = ImageDraw.Draw(img)
+    padding = int(font_size * 0.3)
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    box = (0, 0, (right - left) + padding * 2, font_size + padding * 2)
+    draw.rectangle(box, fill="white", outline="red", width=max(2, int(img.width * 0.01)))
+    draw.text((padding - left, padding), text, fill="black", font=font)
+    return img
+
+def target_pixels(width_pt: float, height_pt: float, dpi: int = REPORT_IMAGE_DPI) -> Tuple[int, int]:
+    """Pixel size of a printed box (points are 1/72 inch)"""
+    return max(1, int(width_pt / 72 * dpi)), max(1, int(height_pt / 72 * dpi))
+
+def to_rgb(img: Image.Image) -> Image.Image:
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        background = Image.new("RGB", img.size, "white")
+        rgba = img.convert("RGBA")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+def process_image(data: bytes, max_w: int, max_h: int, stamp: Optional[str] = None,
+                  quality: int = REPORT_JPEG_QUALITY) -> bytes:
+    """
+    Resize (never upscale) to fit max_w x max_h and re-encode as JPEG
+
+    EXIF, ICC and other metadata are dropped; orientation is applied to the
+    pixels first so the photo still shows the right way up.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("RGB", (max_w, max_h))
+        img = ImageOps.exif_transpose(img)
+        img = to_rgb(img)
+        if img.width > max_w or img.height > max_h:
+            img.thumbnail((max_w, max_h), Image.LANCZOS)
+        if stamp:
+            stamp_image(img, stamp)
+
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+        return out.getvalue()
+
+def prepare_image(data: bytes, width_pt: float, height_pt: float, stamp: Optional[str] = None,
+                  dpi: int = REPORT_IMAGE_DPI, quality: int = REPORT_JPEG_QUALITY) -> bytes:
+    """process_image() for a printed box; returns the original bytes if decoding fails"""
+    max_w, max_h = target_pixels(width_pt, height_pt, dpi)
+    try:
+        return process_image(data, max_w, max_h, stamp, quality)
+    except Exception as e:
+        print(f"⚠️ Could not process report image: {e}")
+        return data
+
+async def load_report_image(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, image_url: str,
+                            width_pt: float, height_pt: float, stamp: Optional[str] = None,
+                            dpi: int = REPORT_IMAGE_DPI, quality: int = REPORT_JPEG_QUALITY) -> Optional[bytes]:
+    """
+    Fetch a photo and prepare it for a printed box, memoized per (photo, size)
+
+    Returns:
+        JPEG bytes, or None when the photo could not be downloaded
+    """
+    max_w, max_h = target_pixels(width_pt, height_pt, dpi)
+    cache_key = (image_url, max_w, max_h, stamp, quality)
+
+    cached = _cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    data = await fetch_image(client, semaphore, image_url)
+    if not data:
+        return None
+
+    prepared = await asyncio.to_thread(prepare_image, data, width_pt, height_pt, stamp, dpi, quality)
+    _cache.put(cache_key, prepared)
+    return prepared
+
+# ---------------------------------------------------------
+# Uploaded Documents
+# ---------------------------------------------------------
+
+def compact_docx_images(source, target, max_px: int = DOCX_MEDIA_MAX_PX,
+                        quality: int = REPORT_JPEG_QUALITY) -> bool:
+    """
+    Copy a DOCX, shrinking oversized JPEG photos embedded in it (word/media/*)
+
+    Only JPEGs are touched so the package's content types stay valid. Parts
+    are copied one at a time, so memory is bounded by the largest part.
+
+    Args:
+        source, target: Paths or binary file objects
+
+    Returns:
+        True if any image was shrunk
+    """
+    changed = False
+    with zipfile.ZipFile(source) as src, zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            data = src.read(item.filename)
+            if item.filename.startswith("word/media/") and re.search(r"\.jpe?g$", item.filename, re.I):
+                try:
+                    with Image.open(io.BytesIO(data)) as img:
+                        too_big = max(img.size) > max_px
+                    if too_big:
+                        smaller = process_image(data, max_px, max_px, quality=quality)
+                        if len(smaller) < len(data):
+                            data = smaller
+                            changed = True
+                except Exception as e:
+                    print(f"⚠️ Could not compact {item.filename}: {e}")
+            dst.writestr(item, data)
+            del data
+
+    if changed:
+        print("📉 Compacted oversized DOCX images")
+    return changed
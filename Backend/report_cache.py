@@ -0,0 +1,296 @@
+# report_cache.py
+"""
+Report Pre-generation Cache
+Generates the DOCX/PDF report in the background once an inspection is
+marked "Completed", so the files are ready when the admin opens Reports.
+
+Generated files are named Generated-{Word|PDF}-{InspectionID}-{version}.ext,
+where version is a hash of everything printed in the report. A file whose
+version no longer matches the inspection content is stale: it is removed
+from the Report row and regenerated if the inspection is still Completed.
+Files the inspector uploaded are never replaced; pre-generation only fills
+fields that are empty or hold an earlier generated file.
+"""
+
+from typing import Dict, Iterable, Optional
+import os
+import re
+import json
+import hashlib
+import asyncio
+import traceback
+from supabase import create_client, Client
+from dotenv import load_dotenv
+
+from report_data import load_report_bundle, extract_text
+from report_docx import DOCX_CONTENT_TYPE, render_inspection_docx
+
+try:
+    from report_pdf import build_inspection_pdf
+    REPORTLAB_AVAILABLE = True
+except ImportError:
+    REPORTLAB_AVAILABLE = False
+
+load_dotenv()
+
+# Initialize Supabase
+url = os.environ.get("SUPABASE_URL")
+key = os.environ.get("SUPABASE_ANON_KEY")
+
+if not url:
+    raise ValueError("SUPABASE_URL environment variable is not set.")
+if not key:
+    raise ValueError("SUPABASE_ANON_KEY environment variable is not set.")
+
+supabase: Client = create_client(url, key)
+
+BUCKET_NAME = "inspection-reports"
+
+# PhotoReport columns that end up in the generated report
+_PHOTO_FIELDS = (
+    "PhotoID", "PhotoURL", "AnnotatedPhotoURL", "CanvasPhotoURL",
+    "PhotoNumbering", "Category", "Caption", "FindingID", "RecommendID",
+)
+
+_GENERATED_RE = re.compile(r"Generated-(?:Word|PDF)-(\d+)-([0-9a-f]{16})\.(?:docx|pdf)$")
+
+# Inspections currently being generated, and ones that changed meanwhile
+_running: set = set()
+_dirty: set = set()
+
+# ---------------------------------------------------------
+# Versioning
+# ---------------------------------------------------------
+
+def content_version(bundle: dict) -> str:
+    """Hash of all report content (status changes do not change the version)"""
+    inspection = {k: v for k, v in bundle["inspection"].items() if k != "Status"}
+    photos = []
+    for photo in bundle["photos"]:
+        item = {field: photo.get(field) for field in _PHOTO_FIELDS}
+        item["Finding"] = extract_text(photo.get("Finding"))
+        item["Recommendation"] = extract_text(photo.get("Recommendation"))
+        photos.append(item)
+
+    payload = json.dumps({
+        "inspection": inspection,
+        "equipment": bundle["equipment"],
+        "inspector": (bundle["inspector"] or {}).get("FullName"),
+        "photos": photos,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def generated_version(file_url: Optional[str], inspection_id: int) -> Optional[str]:
+    """Version of a generated report file, None for uploaded/unknown files"""
+    if not file_url:
+        return None
+    match = _GENERATED_RE.search(file_url.split("?")[0])
+    if not match or int(match.group(1)) != inspection_id:
+        return None
+    return match.group(2)
+
+# ---------------------------------------------------------
+# Generation
+# ---------------------------------------------------------
+
+def _upload(filename: str, data: bytes, content_type: str) -> str:
+    supabase.storage.from_(BUCKET_NAME).upload(
+        path=filename,
+        file=data,
+        file_options={"content-type": content_type, "upsert": "true"}
+    )
+    return supabase.storage.from_(BUCKET_NAME).get_public_url(filename)
+
+def _set_file(inspection_id: int, field: str, current: Optional[str], file_url: Optional[str]) -> bool:
+    """
+    Set one file field, only if it still holds the value we read
+
+    Returns:
+        False if someone else (e.g. the inspector's upload) changed it meanwhile
+    """
+    query = supabase.table("Report")\
+        .update({field: file_url})\
+        .eq("InspectionID", inspection_id)
+    query = query.is_(field, "null") if current is None else query.eq(field, current)
+    return bool(query.execute().data)
+
+def _remove_objects(file_urls: Iterable[str], what: str):
+    names = [u.split("?")[0].split("/")[-1] for u in file_urls]
+    if not names:
+        return
+    try:
+        supabase.storage.from_(BUCKET_NAME).remove(names)
+    except Exception as e:
+        print(f"⚠️ Could not delete {what} report files {names}: {e}")
+
+def _free_fields(report: Optional[dict], inspection_id: int) -> list:
+    """File fields pre-generation may fill: empty or holding a generated file"""
+    fields = ["WordFile", "PdfFile"] if REPORTLAB_AVAILABLE else ["WordFile"]
+    if report is None:
+        return fields
+    return [f for f in fields if not report.get(f) or generated_version(report.get(f), inspection_id)]
+
+def _load_state(inspection_id: int):
+    report_res = supabase.table("Report").select("*").eq("InspectionID", inspection_id).execute()
+    status_res = supabase.table("Inspection").select("Status").eq("InspectionID", inspection_id).execute()
+    return (
+        report_res.data[0] if report_res.data else None,
+        status_res.data[0].get("Status") if status_res.data else None,
+    )
+
+def _remove_stale(report: dict, inspection_id: int, version: str) -> dict:
+    """Remove generated files that do not match the current version"""
+    cleared = {}
+    for field in ("WordFile", "PdfFile"):
+        file_version = generated_version(report.get(field), inspection_id)
+        if file_version and file_version != version and _set_file(inspection_id, field, report[field], None):
+            cleared[field] = None
+
+    if cleared:
+        _remove_objects([report[f] for f in cleared], "stale")
+        print(f"🗑️ Invalidated cached report files for inspection {inspection_id}")
+    return cleared
+
+def _publish(inspection_id: int, files: Dict[str, str]) -> Dict[str, str]:
+    """
+    Store generated file URLs on the Report row
+
+    The row is created if missing (upsert on InspectionID that never touches
+    an existing row). Otherwise only fields that are empty or hold an earlier
+    generated file are filled, each conditional on the value read, so a file
+    the inspector uploads is never replaced - not even one saved while we
+    were rendering. Files that were not stored are deleted again.
+
+    Returns:
+        The fields written
+    """
+    inserted = supabase.table("Report")\
+        .upsert({"InspectionID": inspection_id, **files}, on_conflict="InspectionID", ignore_duplicates=True)\
+        .execute()
+    if inserted.data:
+        return files
+
+    report_res = supabase.table("Report").select("*").eq("InspectionID", inspection_id).execute()
+    report = report_res.data[0] if report_res.data else {}
+    free = _free_fields(report, inspection_id)
+    written = {
+        field: file_url for field, file_url in files.items()
+        if field in free and _set_file(inspection_id, field, report.get(field), file_url)
+    }
+    _remove_objects([u for f, u in files.items() if f not in written], "unused")
+    # The earlier generated files were replaced
+    _remove_objects([report[f] for f in written if report.get(f) and report[f] != written[f]], "replaced")
+    return written
+
+async def _generate(inspection_id: int, bundle: dict, version: str, fields: list) -> Dict[str, str]:
+    files = {}
+
+    if "WordFile" in fields:
+        docx_bytes = await render_inspection_docx(bundle)
+        files["WordFile"] = await asyncio.to_thread(
+            _upload, f"Generated-Word-{inspection_id}-{version}.docx", docx_bytes, DOCX_CONTENT_TYPE
+        )
+        del docx_bytes
+
+    if "PdfFile" in fields:
+        spool = await build_inspection_pdf(bundle)
+        try:
+            pdf_bytes = spool.read()
+        finally:
+            spool.close()
+        files["PdfFile"] = await asyncio.to_thread(
+            _upload, f"Generated-PDF-{inspection_id}-{version}.pdf", pdf_bytes, "application/pdf"
+        )
+
+    # Only publish if nothing changed while we were rendering
+    latest = await asyncio.to_thread(load_report_bundle, inspection_id)
+    if not latest or content_version(latest) != version:
+        print(f"⚠️ Inspection {inspection_id} changed during generation, discarding result")
+        await asyncio.to_thread(_remove_objects, files.values(), "discarded")
+        _dirty.add(inspection_id)
+        return {}
+
+    return await asyncio.to_thread(_publish, inspection_id, files)
+
+async def _refresh(inspection_id: int):
+    report, status = await asyncio.to_thread(_load_state, inspection_id)
+
+    has_generated = report is not None and any(
+        generated_version(report.get(f), inspection_id) for f in ("WordFile", "PdfFile")
+    )
+
+    # Nothing cached and nothing to pre-generate (e.g. inspection still in progress)
+    if not has_generated and status != "Completed":
+        return
+
+    bundle = await asyncio.to_thread(load_report_bundle, inspection_id)
+    if not bundle:
+        return
+    version = content_version(bundle)
+
+    if report is not None:
+        cleared = await asyncio.to_thread(_remove_stale, report, inspection_id, version)
+        report.update(cleared)
+
+    if status != "Completed":
+        return
+
+    # Files the inspector uploaded are theirs; only the other fields are generated
+    missing = [
+        f for f in _free_fields(report, inspection_id)
+        if report is None or generated_version(report.get(f), inspection_id) != version
+    ]
+    if not missing:
+        print(f"✅ Reports for inspection {inspection_id} already cached (version {version})")
+        return
+
+    print(f"⚙️ Pre-generating reports for inspection {inspection_id} (version {version})")
+    files = await _generate(inspection_id, bundle, version, missing)
+    if files:
+        print(f"✅ Pre-generated reports for inspection {inspection_id}: {files}")
+
+async def refresh_reports(inspection_id: int):
+    """
+    Bring the cached report files of an inspection up to date
+
+    Safe to call after any change: it only regenerates when the content
+    version changed, and concurrent calls for the same inspection are merged.
+    """
+    if inspection_id in _running:
+        _dirty.add(inspection_id)
+        return
+
+    _running.add(inspection_id)
+    try:
+        while True:
+            _dirty.discard(inspection_id)
+            try:
+                await _refresh(inspection_id)
+            except Exception as e:
+                print(f"❌ Report pre-generation failed for inspection {inspection_id}: {e}")
+                traceback.print_exc()
+                break
+            if inspection_id not in _dirty:
+                break
+    finally:
+        _running.discard(inspection_id)
+
+async def refresh_reports_many(inspection_ids: Iterable[int]):
+    for inspection_id in dict.fromkeys(i for i in inspection_ids if i):
+        await refresh_reports(inspection_id)
+
+# ---------------------------------------------------------
+# Lookups for edits that do not know their inspection
+# ---------------------------------------------------------
+
+def inspections_for_photos(photo_ids: Iterable[int]) -> list:
+    ids = [p for p in photo_ids if p]
+    if not ids:
+        return []
+    res = supabase.table("PhotoReport").select("InspectionID").in_("PhotoID", ids).execute()
+    return [r["InspectionID"] for r in res.data or []]
+
+def inspections_for_field(field: str, value: int) -> list:
+    """Inspections whose photos reference a FindingID/RecommendID"""
+    res = supabase.table("PhotoReport").select("InspectionID").eq(field, value).execute()
+    return [r["InspectionID"] for r in res.data or []]
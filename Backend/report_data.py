@@ -0,0 +1,216 @@
+# report_data.py
+"""
+Report Data Module
+Loads everything a generated report needs (inspection, equipment, inspector,
+photos with findings/recommendations) and groups the photos the same way the
+frontend generators do. Report images are fetched with image_fetch.py.
+"""
+
+from typing import Dict, List, Optional
+import os
+import math
+from supabase import create_client, Client
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Initialize Supabase
+url = os.environ.get("SUPABASE_URL")
+key = os.environ.get("SUPABASE_ANON_KEY")
+
+if not url:
+    raise ValueError("SUPABASE_URL environment variable is not set.")
+if not key:
+    raise ValueError("SUPABASE_ANON_KEY environment variable is not set.")
+
+supabase: Client = create_client(url, key)
+
+# ---------------------------------------------------------
+# Text Helpers
+# ---------------------------------------------------------
+
+def extract_text(value) -> str:
+    """Get the description out of an embedded Finding/Recommendation"""
+    if not value:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return extract_text(value[0]) if value else ""
+    if isinstance(value, dict):
+        for field in ("Description", "description", "text", "content"):
+            if value.get(field):
+                return str(value[field])
+        return ""
+    return str(value)
+
+def _is_blank(text: str, allow_nil: bool = True) -> bool:
+    text = text.strip()
+    if not text or text in ("-", "{}"):
+        return True
+    return not allow_nil and text.lower() in ("nil", "nil.")
+
+def has_valid_data(photo: dict) -> bool:
+    """A photo is reported only if it has a finding or a recommendation"""
+    finding = extract_text(photo.get("Finding"))
+    recommendation = extract_text(photo.get("Recommendation"))
+    return not _is_blank(finding, allow_nil=False) or not _is_blank(recommendation, allow_nil=False)
+
+def format_photo_number(value) -> str:
+    """1 -> "1.0", 1.2 -> "1.2" (same as the report template)"""
+    if value is None or value == "":
+        return "-"
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    if number.is_integer():
+        return f"{int(number)}.0"
+    return str(value)
+
+def group_number(photo: dict) -> int:
+    try:
+        return int(math.floor(float(photo.get("PhotoNumbering") or 0)))
+    except (TypeError, ValueError):
+        return 0
+
+def _numbering(photo: dict) -> float:
+    try:
+        return float(photo.get("PhotoNumbering") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _canvas_url(photo: dict) -> Optional[str]:
+    canvas_url = photo.get("CanvasPhotoURL")
+    if canvas_url and canvas_url != "-" and canvas_url.strip():
+        return canvas_url
+    return None
+
+# ---------------------------------------------------------
+# Data Loading
+# ---------------------------------------------------------
+
+def load_report_bundle(inspection_id: int) -> Optional[dict]:
+    """
+    Load inspection, equipment, inspector and photos for one report
+
+    Returns:
+        dict with "inspection", "equipment", "inspector", "photos",
+        or None if the inspection does not exist
+    """
+    insp_res = supabase.table("Inspection")\
+        .select("*, Equipment(*)")\
+        .eq("InspectionID", inspection_id)\
+        .execute()
+
+    if not insp_res.data:
+        return None
+
+    inspection = insp_res.data[0]
+    equipment = inspection.pop("Equipment", None) or {}
+
+    inspector = {}
+    if inspection.get("UserID_Inspector"):
+        inspector_res = supabase.table("Inspector")\
+            .select("*")\
+            .eq("UserID", inspection["UserID_Inspector"])\
+            .execute()
+        if inspector_res.data:
+            inspector = inspector_res.data[0]
+
+    photos_res = supabase.table("PhotoReport")\
+        .select("*, Finding(Description), Recommendation(Description)")\
+        .eq("InspectionID", inspection_id)\
+        .order("PhotoNumbering", desc=False)\
+        .execute()
+
+    return {
+        "inspection": inspection,
+        "equipment": equipment,
+        "inspector": inspector,
+        "photos": photos_res.data or []
+    }
+
+def header_fields(bundle: dict) -> Dict[str, str]:
+    """Header values with the same fallbacks the frontend generators use"""
+    inspection = bundle["inspection"]
+    equipment = bundle["equipment"] or {}
+    inspector = bundle["inspector"] or {}
+
+    return {
+        "TagNo": equipment.get("EquipTagNo") or equipment.get("TagNo") or "-",
+        "EquipDescription": equipment.get("EquipDescription") or "-",
+        "PlantName": equipment.get("Plant") or equipment.get("PlantName") or "-",
+        "DOSH": equipment.get("DOSHRegNo") or equipment.get("DOSH") or "-",
+        "ReportNo": inspection.get("ReportNo") or f"INS-{inspection.get('InspectionID')}",
+        "ReportDate": inspection.get("ReportDate") or "-",
+        "Findings": inspection.get("Findings") or "-",
+        "NDTs": inspection.get("NDTs") or "-",
+        "Recommendations": inspection.get("Recommendations") or "-",
+        "Post_Final_Inspection": inspection.get("Post_Final_Inspection") or "-",
+        "FullName": inspector.get("FullName") or "Unknown Inspector",
+    }
+
+# ---------------------------------------------------------
+# Photo Grouping
+# ---------------------------------------------------------
+
+def group_report_photos(photos: List[dict], valid_only: bool = True) -> List[dict]:
+    """
+    Group photos into report blocks (same rules as pdfGenerator.js)
+
+    - Photos sharing a CanvasPhotoURL form one canvas block
+    - Remaining photos are grouped by the integer part of PhotoNumbering
+    - Only photos with a finding or recommendation are kept, unless
+      valid_only is False
+
+    Returns:
+        List of {"number", "canvas_url", "photos"}: canvas blocks first, then
+        the numbered blocks in order
+    """
+    canvas_groups: Dict[str, List[dict]] = {}
+    number_groups: Dict[int, List[dict]] = {}
+
+    for photo in photos:
+        if valid_only and not has_valid_data(photo):
+            continue
+        canvas_url = _canvas_url(photo)
+        if canvas_url:
+            canvas_groups.setdefault(canvas_url, []).append(photo)
+        else:
+            number_groups.setdefault(group_number(photo), []).append(photo)
+
+    groups = []
+    for canvas_url, members in canvas_groups.items():
+        members.sort(key=_numbering)
+        groups.append({
+            "number": group_number(members[0]),
+            "canvas_url": canvas_url,
+            "photos": members
+        })
+
+    for number in sorted(number_groups):
+        members = sorted(number_groups[number], key=_numbering)
+        groups.append({
+            "number": number,
+            "canvas_url": None,
+            "photos": members
+        })
+
+    return groups
+
+def group_text(group: dict, field: str) -> str:
+    """Combined Finding/Recommendation text of a block, sub-photos prefixed"""
+    members = group["photos"]
+    lines = []
+    for idx, photo in enumerate(members):
+        text = extract_text(photo.get(field)).strip()
+        if _is_blank(text, allow_nil=(field == "Finding")):
+            continue
+        if group["canvas_url"] and len(members) > 1 and photo.get("PhotoNumbering"):
+            lines.append(f"Photo {photo['PhotoNumbering']}: {text}")
+        elif not group["canvas_url"] and idx > 0:
+            lines.append(f"{photo.get('PhotoNumbering')} {text}")
+        else:
+            lines.append(text)
+    return "\n\n".join(lines) or "-"
@@ -0,0 +1,347 @@
+# report_docx.py
+"""
+DOCX Report Generator - docxtpl
+Server-side version of Frontend/src/model/docGenerator.js.
+
+The Word template uses docxtemplater tags ([[Field]], [[#Loop]]...[[/Loop]],
+[[%image]]) so the frontend and backend can share one file. Tags are translated
+to Jinja once per template version and the compiled Jinja template is cached,
+so each render only fills in data.
+"""
+
+from typing import Dict, List, Optional, Tuple
+import io
+import os
+import re
+import asyncio
+import zipfile
+import threading
+from datetime import date
+import httpx
+from jinja2 import Environment
+from docx.shared import Emu
+from docxtpl import DocxTemplate, InlineImage, Listing
+
+from report_assets import load_report_image
+from image_fetch import IMAGE_FETCH_CONCURRENCY, IMAGE_FETCH_TIMEOUT
+from report_data import (
+    extract_text,
+    format_photo_number,
+    group_report_photos,
+    header_fields,
+)
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+TEMPLATE_PATH = os.environ.get(
+    "REPORT_TEMPLATE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "report-template.docx")
+)
+
+# docxtemplater image sizes are pixels at 96 DPI
+EMU_PER_PX = 9525
+
+DOCX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# ---------------------------------------------------------
+# Template Cache
+# ---------------------------------------------------------
+
+_TAG_RE = re.compile(r"\[(?:<[^>]+>)*\[((?:(?!\]).)*?)\](?:<[^>]+>)*\]", re.DOTALL)
+_PARAGRAPH_RE = re.compile(r"<w:p[ >].*?</w:p>", re.DOTALL)
+_TEXT_RE = re.compile(r"<w:t(?: [^>]*)?>([^<]*)</w:t>")
+
+_template_lock = threading.Lock()
+_template_cache: Dict[str, Tuple[float, bytes]] = {}
+
+class _CachingEnvironment(Environment):
+    """Jinja environment that keeps compiled templates for identical sources"""
+
+    max_cached = 8
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._compiled = {}
+        self._compiled_lock = threading.Lock()
+
+    def from_string(self, source, globals=None, template_class=None):
+        with self._compiled_lock:
+            template = self._compiled.get(source)
+        if template is None:
+            template = super().from_string(source, globals, template_class)
+            with self._compiled_lock:
+                if len(self._compiled) >= self.max_cached:
+                    self._compiled.pop(next(iter(self._compiled)))
+                self._compiled[source] = template
+        return template
+
+_jinja_env = _CachingEnvironment(autoescape=True)
+
+def _normalize_tags(xml: str) -> str:
+    """Join [[tags]] that Word split across several runs"""
+    def join(match):
+        body = re.sub(r"<[^>]+>", "", match.group(1)).strip()
+        if not re.fullmatch(r"[#/%]?\w+", body):
+            return match.group(0)
+        return f"[[{body}]]"
+    return _TAG_RE.sub(join, xml)
+
+def _translate_tags(xml: str) -> str:
+    """
+    Convert docxtemplater tags to docxtpl/Jinja tags
+
+    Loop variables are named by depth (_l0, _l1, ...). Each loop item is built
+    with its parent's fields merged in, so [[Field]] always resolves from the
+    innermost loop item like docxtemplater's scope lookup.
+    """
+    stack: List[str] = []
+
+    def field(name: str) -> str:
+        return f"_l{len(stack) - 1}.{name}" if stack else name
+
+    def translate(tag: str, paragraph_level: bool) -> str:
+        prefix = "p " if paragraph_level else " "
+        if tag.startswith("#"):
+            source = field(tag[1:])
+            stack.append(tag[1:])
+            return "{%" + prefix + f"for _l{len(stack) - 1} in {source} %}}"
+        if tag.startswith("/"):
+            if stack:
+                stack.pop()
+            return "{%" + prefix + "endfor %}"
+        if tag.startswith("%"):
+            return "{{ " + field(tag[1:]) + " }}"
+        return "{{ " + field(tag) + " }}"
+
+    def paragraph(match):
+        para = match.group(0)
+        tags = re.findall(r"\[\[([#/%]?\w+)\]\]", para)
+        if not tags:
+            return para
+        text = "".join(_TEXT_RE.findall(para)).strip()
+        alone = len(tags) == 1 and tags[0][0] in "#/" and text == f"[[{tags[0]}]]"
+        return re.sub(r"\[\[([#/%]?\w+)\]\]", lambda m: translate(m.group(1), alone), para)
+
+    return _PARAGRAPH_RE.sub(paragraph, xml)
+
+def _load_template_bytes(path: str) -> bytes:
+    """Translated template (.docx bytes), cached until the file changes"""
+    mtime = os.path.getmtime(path)
+    with _template_lock:
+        cached = _template_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+    out = io.BytesIO()
+    with zipfile.ZipFile(path) as src, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            data = src.read(item.filename)
+            if item.filename.startswith("word/") and item.filename.endswith(".xml"):
+                xml = data.decode("utf-8")
+                if "[[" in xml or "[<" in xml:
+                    data = _translate_tags(_normalize_tags(xml)).encode("utf-8")
+            dst.writestr(item, data)
+
+    template_bytes = out.getvalue()
+    with _template_lock:
+        _template_cache[path] = (mtime, template_bytes)
+    print(f"📄 Loaded report template {path}")
+    return template_bytes
+
+# ---------------------------------------------------------
+# Context Building (mirrors docGenerator.js)
+# ---------------------------------------------------------
+
+def _pick_photo_url(photo: dict) -> Optional[str]:
+    for field in ("AnnotatedPhotoURL", "PhotoURL"):
+        value = photo.get(field)
+        if value and value != "-" and str(value).strip():
+            return str(value)
+    return None
+
+def _is_sub_photo(photo: dict) -> bool:
+    try:
+        return not float(photo.get("PhotoNumbering")).is_integer()
+    except (TypeError, ValueError):
+        return False
+
+def _docx_groups(photos: List[dict]) -> List[dict]:
+    """
+    Report blocks in PhotoNumbering order
+
+    Same grouping as the PDF, but like docGenerator.js every photo is kept
+    (no finding reads "Nil.") and canvas blocks are not moved to the front.
+    """
+    return sorted(group_report_photos(photos, valid_only=False), key=lambda g: g["number"])
+
+def _image_size(group: dict) -> Tuple[int, int]:
+    if group["canvas_url"]:
+        return 250, 200
+    count = len(group["photos"])
+    if count == 1:
+        return 250, 200
+    if count == 2:
+        return 145, 120
+    return 140, 100
+
+def _image_jobs(groups: List[dict]) -> Dict[tuple, str]:
+    """(url, stamp, w, h) -> url for every image the document embeds"""
+    jobs = {}
+    for group in groups:
+        w, h = _image_size(group)
+        if group["canvas_url"]:
+            jobs[(group["canvas_url"], None, w, h)] = group["canvas_url"]
+            continue
+        for photo in group["photos"]:
+            photo_url = _pick_photo_url(photo)
+            if photo_url:
+                stamp = format_photo_number(photo["PhotoNumbering"]) if photo.get("PhotoNumbering") else None
+                jobs[(photo_url, stamp, w, h)] = photo_url
+    return jobs
+
+def _description(photo: dict, field: str, id_field: str) -> str:
+    prefix = f"{photo['PhotoNumbering']} " if _is_sub_photo(photo) else ""
+    if photo.get(id_field) is None:
+        return prefix + "Nil."
+    text = extract_text(photo.get(field)).strip()
+    if text.lower() in ("nil", "nil."):
+        text = "Nil."
+    return prefix + (text or "-")
+
+def _row_context(tpl: DocxTemplate, group: Optional[dict], images: Dict[tuple, Optional[bytes]]) -> dict:
+    if not group:
+        return {"PhotoNumbering": "", "photoNumber": "-", "Photos": [], "FindingDesc": "", "RecommendDesc": ""}
+
+    members = group["photos"]
+    number = group["number"] or "-"
+    w, h = _image_size(group)
+
+    def inline(image_key):
+        data = images.get(image_key)
+        if not data:
+            return ""
+        return InlineImage(tpl, io.BytesIO(data), width=Emu(w * EMU_PER_PX), height=Emu(h * EMU_PER_PX))
+
+    if group["canvas_url"]:
+        photos = [{"image": inline((group["canvas_url"], None, w, h))}]
+    else:
+        photos = []
+        for photo in members:
+            photo_url = _pick_photo_url(photo)
+            stamp = format_photo_number(photo["PhotoNumbering"]) if photo.get("PhotoNumbering") else None
+            photos.append({"image": inline((photo_url, stamp, w, h)) if photo_url else ""})
+
+    return {
+        "PhotoNumbering": number,
+        "photoNumber": format_photo_number(number) if number != "-" else "-",
+        "Photos": photos,
+        "FindingDesc": Listing("\n".join(_description(p, "Finding", "FindingID") for p in members) or "-"),
+        "RecommendDesc": Listing("\n".join(_description(p, "Recommendation", "RecommendID") for p in members) or "-"),
+    }
+
+def _scoped(parent: dict, child: dict) -> dict:
+    merged = dict(parent)
+    merged.update(child)
+    return merged
+
+def _build_context(tpl: DocxTemplate, bundle: dict, groups: List[dict], images: Dict[tuple, Optional[bytes]],
+                   report_date: Optional[str]) -> dict:
+    fields = header_fields(bundle)
+    inspector = bundle["inspector"] or {}
+    equipment = bundle["equipment"] or {}
+
+    year_match = re.search(r"/TA(\d{4})", fields["ReportNo"])
+    year = year_match.group(1) if year_match else "-"
+    if report_date is None:
+        report_date = bundle["inspection"].get("ReportDate") or date.today().isoformat()
+
+    root = {
+        "TagNo": fields["TagNo"],
+        "Year": year,
+        "PlantName": fields["PlantName"],
+        "DOSH": fields["DOSH"],
+        "FullName": fields["FullName"],
+        "EquipmentTagNo": fields["TagNo"],
+        "EquipDescription": fields["EquipDescription"],
+        "Plant": fields["PlantName"],
+        "DOSHRegNo": fields["DOSH"],
+        "Manufacturer": equipment.get("Manufacturer") or "-",
+        "YearBuilt": year,
+        "DesignPressure": equipment.get("DesignPressure") or "-",
+        "DesignTemperature": equipment.get("DesignTemperature") or "-",
+        "ReportNo": fields["ReportNo"],
+        "ReportDate": report_date,
+        "InspectionDate": fields["ReportDate"],
+        "Findings": Listing(fields["Findings"]),
+        "NDTs": Listing(fields["NDTs"]),
+        "Recommendations": Listing(fields["Recommendations"]),
+        "Post_Final_Inspection": Listing(fields["Post_Final_Inspection"]),
+        "InspectorName": fields["FullName"],
+        "InspectorID": inspector.get("UserID") or "-",
+    }
+
+    pages = []
+    for start in range(0, len(groups), 3):
+        page = {}
+        for row in range(3):
+            group = groups[start + row] if start + row < len(groups) else None
+            row_ctx = _row_context(tpl, group, images)
+            page[f"Row{row + 1}_PhotoNumbering"] = row_ctx["PhotoNumbering"]
+            page[f"Row{row + 1}_photoNumber"] = row_ctx["photoNumber"]
+            page[f"Row{row + 1}_Photos"] = row_ctx["Photos"]
+            page[f"Row{row + 1}_FindingDesc"] = row_ctx["FindingDesc"]
+            page[f"Row{row + 1}_RecommendDesc"] = row_ctx["RecommendDesc"]
+        page = _scoped(root, page)
+        for row in range(3):
+            page[f"Row{row + 1}_Photos"] = [_scoped(page, p) for p in page[f"Row{row + 1}_Photos"]]
+        pages.append(page)
+
+    root["PhotoPages"] = pages
+    return root
+
+# ---------------------------------------------------------
+# Rendering
+# ---------------------------------------------------------
+
+async def _load_images(jobs: Dict[tuple, str]) -> Dict[tuple, Optional[bytes]]:
+    """Fetch concurrently and prepare each image (report_assets) as soon as it arrives"""
+    semaphore = asyncio.Semaphore(IMAGE_FETCH_CONCURRENCY)
+
+    async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as client:
+        async def load(job):
+            image_url, stamp, w, h = job
+            # Template sizes are 96 DPI pixels, report_assets works in points
+            return await load_report_image(client, semaphore, image_url, w * 0.75, h * 0.75, stamp)
+
+        keys = list(jobs)
+        results = await asyncio.gather(*[load(k) for k in keys])
+
+    return dict(zip(keys, results))
+
+def _render(template_bytes: bytes, bundle: dict, groups: List[dict], images: Dict[tuple, Optional[bytes]],
+            report_date: Optional[str]) -> bytes:
+    tpl = DocxTemplate(io.BytesIO(template_bytes))
+    context = _build_context(tpl, bundle, groups, images, report_date)
+    tpl.render(context, jinja_env=_jinja_env)
+
+    out = io.BytesIO()
+    tpl.save(out)
+    return out.getvalue()
+
+async def render_inspection_docx(bundle: dict, report_date: Optional[str] = None) -> bytes:
+    """
+    Render the inspection report as a .docx
+
+    Args:
+        bundle: Result of report_data.load_report_bundle()
+        report_date: Overrides the report date printed in the document
+
+    Returns:
+        DOCX file bytes
+    """
+    template_bytes = await asyncio.to_thread(_load_template_bytes, TEMPLATE_PATH)
+    groups = _docx_groups(bundle["photos"])
+    images = await _load_images(_image_jobs(groups))
+    return await asyncio.to_thread(_render, template_bytes, bundle, groups, images, report_date)
@@ -0,0 +1,217 @@
+# report_export.py
+"""
+Bulk Report Export
+Streams approved report files (ApprovedPdfFile / ApprovedWordFile) as one ZIP.
+
+Files are downloaded a few at a time into small bounded queues and written
+into the archive as the chunks arrive, so memory stays at roughly
+EXPORT_CONCURRENCY x EXPORT_QUEUE_CHUNKS x chunk size no matter how many
+reports are exported. Nothing is written to disk.
+"""
+
+from collections import deque
+from typing import AsyncIterator, List, Optional
+import io
+import os
+import re
+import time
+import asyncio
+import zipfile
+import httpx
+from supabase import create_client, Client
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Initialize Supabase
+url = os.environ.get("SUPABASE_URL")
+key = os.environ.get("SUPABASE_ANON_KEY")
+
+if not url:
+    raise ValueError("SUPABASE_URL environment variable is not set.")
+if not key:
+    raise ValueError("SUPABASE_ANON_KEY environment variable is not set.")
+
+supabase: Client = create_client(url, key)
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+# Files downloaded at the same time
+EXPORT_CONCURRENCY = int(os.environ.get("REPORT_EXPORT_CONCURRENCY", "4"))
+
+# Chunks buffered per file before the download waits for the ZIP writer
+EXPORT_QUEUE_CHUNKS = int(os.environ.get("REPORT_EXPORT_QUEUE_CHUNKS", "16"))
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_PAGE_SIZE = 500
+EXPORT_FETCH_TIMEOUT = 120.0
+
+FILE_FIELDS = {"pdf": ("ApprovedPdfFile",), "word": ("ApprovedWordFile",), "both": ("ApprovedPdfFile", "ApprovedWordFile")}
+
+_UNSAFE_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+# ---------------------------------------------------------
+# Selecting Reports
+# ---------------------------------------------------------
+
+def _safe(value) -> str:
+    return _UNSAFE_RE.sub("-", str(value)).strip("-") or "unknown"
+
+def _matches(inspection: dict, equip_id: Optional[int], plant: Optional[str], year: Optional[int]) -> bool:
+    equipment = inspection.get("Equipment") or {}
+    if equip_id is not None and inspection.get("EquipID") != equip_id:
+        return False
+    if plant and (equipment.get("PlantName") or "").strip().lower() != plant.strip().lower():
+        return False
+    if year is not None and not str(inspection.get("ReportDate") or "").startswith(str(year)):
+        return False
+    return True
+
+def list_export_files(equip_id: Optional[int] = None, plant: Optional[str] = None,
+                      year: Optional[int] = None, kind: str = "pdf") -> List[dict]:
+    """
+    Approved report files matching the filter
+
+    Args:
+        equip_id: Only this vessel (Equipment.EquipID)
+        plant: Only vessels of this plant (Equipment.PlantName, case-insensitive)
+        year: Only reports whose ReportDate falls in this year
+        kind: "pdf", "word" or "both"
+
+    Returns:
+        List of {"name", "url"} with unique archive names
+    """
+    fields = FILE_FIELDS[kind]
+    files = []
+    used_names = set()
+    start = 0
+
+    while True:
+        res = (
+            supabase.table("Report")
+            .select("InspectionID, ApprovedPdfFile, ApprovedWordFile, Inspection(InspectionID, EquipID, ReportNo, ReportDate, Equipment(TagNo, PlantName))")
+            .or_(",".join(f"{f}.not.is.null" for f in fields))
+            .order("InspectionID")
+            .range(start, start + EXPORT_PAGE_SIZE - 1)
+            .execute()
+        )
+        rows = res.data or []
+
+        for row in rows:
+            inspection = row.get("Inspection") or {}
+            if not _matches(inspection, equip_id, plant, year):
+                continue
+            equipment = inspection.get("Equipment") or {}
+            folder = _safe(equipment.get("PlantName") or "No-Plant") + "/" + _safe(equipment.get("TagNo") or "No-Tag")
+            stem = _safe(inspection.get("ReportNo") or f"INS-{row['InspectionID']}")
+
+            for field in fields:
+                file_url = row.get(field)
+                if not file_url:
+                    continue
+                ext = os.path.splitext(file_url.split("?")[0])[1] or (".pdf" if field == "ApprovedPdfFile" else ".docx")
+                name = f"{folder}/{stem}{ext}"
+                if name in used_names:
+                    name = f"{folder}/{stem}-{row['InspectionID']}{ext}"
+                used_names.add(name)
+                files.append({"name": name, "url": file_url})
+
+        if len(rows) < EXPORT_PAGE_SIZE:
+            break
+        start += EXPORT_PAGE_SIZE
+
+    return files
+
+# ---------------------------------------------------------
+# ZIP Streaming
+# ---------------------------------------------------------
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, non-seekable target for ZipFile; output is drained after each write"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.buffer.extend(data)
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.offset
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+async def _download(client: httpx.AsyncClient, file_url: str, queue: asyncio.Queue):
+    """Stream one file into its queue; ends with None, or with the exception on failure"""
+    try:
+        async with client.stream("GET", file_url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(EXPORT_CHUNK_SIZE):
+                await queue.put(chunk)
+        await queue.put(None)
+    except Exception as e:
+        await queue.put(e)
+
+async def stream_export_zip(files: List[dict]) -> AsyncIterator[bytes]:
+    """
+    Yield a ZIP archive of the given files while they are being downloaded
+
+    Files that fail to download are listed in export-errors.txt at the end
+    of the archive instead of aborting the whole export.
+    """
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED)
+    errors = []
+    pending = deque()
+    remaining = iter(files)
+
+    async with httpx.AsyncClient(timeout=EXPORT_FETCH_TIMEOUT, follow_redirects=True) as client:
+        def start_next():
+            item = next(remaining, None)
+            if item is not None:
+                queue = asyncio.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+                pending.append((item, queue, asyncio.create_task(_download(client, item["url"], queue))))
+
+        try:
+            for _ in range(EXPORT_CONCURRENCY):
+                start_next()
+
+            while pending:
+                item, queue, task = pending.popleft()
+                first = await queue.get()
+                if first is None or isinstance(first, Exception):
+                    errors.append(f"{item['name']}: {first or 'empty file'} ({item['url']})")
+                    start_next()
+                    continue
+
+                info = zipfile.ZipInfo(item["name"], time.localtime()[:6])
+                with archive.open(info, "w") as entry:
+                    chunk = first
+                    while chunk is not None:
+                        if isinstance(chunk, Exception):
+                            errors.append(f"{item['name']}: incomplete, {chunk} ({item['url']})")
+                            break
+                        entry.write(chunk)
+                        yield sink.drain()
+                        chunk = await queue.get()
+                await task
+                start_next()
+
+            if errors:
+                print(f"⚠️ Report export: {len(errors)} file(s) could not be added")
+                archive.writestr("export-errors.txt", "\n".join(errors) + "\n")
+            archive.close()
+            yield sink.drain()
+        finally:
+            for _, _, task in pending:
+                task.cancel()
@@ -0,0 +1,497 @@
+# report_pdf.py
+"""
+PDF Report Generator - ReportLab
+Server-side version of Frontend/src/model/pdfGenerator.js.
+ReportLab keeps every drawn image in memory until the document is saved, so
+the report is rendered in parts of PDF_PART_PAGES pages. Each part is saved
+to a temp file and its objects are copied into the output before the next
+part starts. Memory is bounded by one part: at most PDF_PART_PAGES pages of
+PAGE_IMAGE_BUDGET image bytes each, plus the page list. Images are fetched
+page by page and go through report_assets (print DPI, recompressed JPEG);
+pages still above PAGE_IMAGE_BUDGET are reduced further before drawing.
+Drawing and saving run in worker threads.
+"""
+
+from typing import Dict, Iterator, List, Optional
+import io
+import os
+import asyncio
+import tempfile
+import httpx
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.pdfgen import canvas
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+from report_assets import REPORT_IMAGE_DPI, load_report_image, prepare_image
+from image_fetch import IMAGE_FETCH_CONCURRENCY, IMAGE_FETCH_TIMEOUT
+from report_data import (
+    format_photo_number,
+    group_report_photos,
+    group_text,
+    header_fields,
+)
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+# Max bytes of image data drawn on a single page before images get downscaled
+PAGE_IMAGE_BUDGET = int(os.environ.get("REPORT_PAGE_MEMORY_MB", "8")) * 1024 * 1024
+
+# Photo pages rendered into one part before it is copied to the output
+PDF_PART_PAGES = max(1, int(os.environ.get("REPORT_PDF_PART_PAGES", "4")))
+
+# Generated PDFs stay in memory up to this size, then spill to a temp file
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 15 * mm
+CONTENT_WIDTH = PAGE_WIDTH - 2 * MARGIN
+
+# Same photo layout as the frontend generator (sizes in mm)
+CANVAS_IMAGE_HEIGHT = 100 * mm
+PHOTO_WIDTH = 45 * mm
+TEXT_BOX_X = MARGIN + 105 * mm
+TEXT_BOX_WIDTH = PAGE_WIDTH - TEXT_BOX_X - MARGIN
+
+# ---------------------------------------------------------
+# Layout Helpers
+# ---------------------------------------------------------
+
+class _Page:
+    """Small wrapper so layout code can use top-down mm coordinates"""
+
+    def __init__(self, pdf: canvas.Canvas):
+        self.pdf = pdf
+
+    def text(self, value: str, x: float, top: float, font="Helvetica", size=9, align="left"):
+        self.pdf.setFont(font, size)
+        y = PAGE_HEIGHT - top
+        if align == "center":
+            self.pdf.drawCentredString(x, y, value)
+        else:
+            self.pdf.drawString(x, y, value)
+
+    def lines(self, lines: List[str], x: float, top: float, leading: float, size=8):
+        self.pdf.setFont("Helvetica", size)
+        for idx, line in enumerate(lines):
+            self.pdf.drawString(x, PAGE_HEIGHT - top - idx * leading, line)
+
+    def rule(self, top: float):
+        self.pdf.setStrokeGray(0.78)
+        self.pdf.line(MARGIN, PAGE_HEIGHT - top, PAGE_WIDTH - MARGIN, PAGE_HEIGHT - top)
+        self.pdf.setStrokeGray(0)
+
+    def image(self, data: Optional[bytes], x: float, top: float, width: float, height: float, stamp: Optional[str] = None):
+        if not data:
+            self.text("Image could not be loaded", x, top + 5 * mm, font="Helvetica-Oblique", size=9)
+            return
+        try:
+            self.pdf.drawImage(ImageReader(io.BytesIO(data)), x, PAGE_HEIGHT - top - height, width, height)
+        except Exception as e:
+            print(f"❌ PDF image error: {e}")
+            self.text("Image error", x, top + 5 * mm, font="Helvetica-Oblique", size=9)
+            return
+        if stamp:
+            self.stamp(stamp, x, top, width)
+
+    def stamp(self, value: str, x: float, top: float, image_width: float):
+        """White box with red border and the photo number (top-left of photo)"""
+        size = max(6, image_width * 0.1)
+        padding = size * 0.3
+        box_w = self.pdf.stringWidth(value, "Helvetica-Bold", size) + padding * 2
+        box_h = size + padding * 2
+        self.pdf.setFillColorRGB(1, 1, 1)
+        self.pdf.setStrokeColorRGB(1, 0, 0)
+        self.pdf.setLineWidth(max(0.5, image_width * 0.01))
+        self.pdf.rect(x, PAGE_HEIGHT - top - box_h, box_w, box_h, stroke=1, fill=1)
+        self.pdf.setFillColorRGB(0, 0, 0)
+        self.pdf.setStrokeColorRGB(0, 0, 0)
+        self.pdf.setLineWidth(1)
+        self.text(value, x + padding, top + padding + size * 0.8, font="Helvetica-Bold", size=size)
+
+def _split(text: str, width: float, size: float) -> List[str]:
+    lines = []
+    for paragraph in (text or "-").split("\n"):
+        lines.extend(simpleSplit(paragraph, "Helvetica", size, width) or [""])
+    return lines
+
+def _photo_height(count: int) -> float:
+    if count == 1:
+        return 60 * mm
+    if count == 2:
+        return 35 * mm
+    return 25 * mm
+
+# ---------------------------------------------------------
+# Blocks
+# ---------------------------------------------------------
+
+def _plan_block(group: dict) -> dict:
+    """Pre-compute wrapped text and height of a photo block"""
+    if group["canvas_url"]:
+        finding = _split(group_text(group, "Finding"), CONTENT_WIDTH, 8)
+        recommendation = _split(group_text(group, "Recommendation"), CONTENT_WIDTH, 8)
+        height = (8 * mm + CANVAS_IMAGE_HEIGHT + 10 * mm
+                  + 10 * mm + len(finding) * 4 * mm
+                  + 5 * mm + len(recommendation) * 4 * mm + 20 * mm)
+        images = [(group["canvas_url"], CONTENT_WIDTH, CANVAS_IMAGE_HEIGHT)]
+    else:
+        finding = _split(group_text(group, "Finding"), TEXT_BOX_WIDTH, 8)
+        recommendation = _split(group_text(group, "Recommendation"), TEXT_BOX_WIDTH, 8)
+        photo_h = _photo_height(len(group["photos"]))
+        photos_height = len(group["photos"]) * (photo_h + 2 * mm)
+        text_height = 22 * mm + (len(finding) + len(recommendation)) * 4 * mm
+        height = max(5 * mm + photos_height, text_height) + 15 * mm
+        images = [(p.get("PhotoURL"), PHOTO_WIDTH, photo_h) for p in group["photos"] if p.get("PhotoURL")]
+
+    return {
+        "group": group,
+        "finding": finding,
+        "recommendation": recommendation,
+        "height": height,
+        "images": images
+    }
+
+def _draw_canvas_block(page: _Page, block: dict, top: float, images: Dict[str, Optional[bytes]]) -> float:
+    group = block["group"]
+    numbers = [str(p["PhotoNumbering"]) for p in group["photos"] if p.get("PhotoNumbering") is not None]
+    page.text(", ".join(numbers) or "-", MARGIN, top, font="Helvetica-Bold", size=10)
+    top += 8 * mm
+
+    page.image(images.get(group["canvas_url"]), MARGIN, top, CONTENT_WIDTH, CANVAS_IMAGE_HEIGHT)
+    top += CANVAS_IMAGE_HEIGHT + 10 * mm
+
+    page.text("Finding:", MARGIN, top, font="Helvetica-Bold", size=9)
+    top += 5 * mm
+    page.lines(block["finding"], MARGIN, top, 4 * mm)
+    top += len(block["finding"]) * 4 * mm + 5 * mm
+
+    page.text("Recommendation:", MARGIN, top, font="Helvetica-Bold", size=9)
+    top += 5 * mm
+    page.lines(block["recommendation"], MARGIN, top, 4 * mm)
+    top += len(block["recommendation"]) * 4 * mm + 10 * mm
+
+    page.rule(top)
+    return top + 10 * mm
+
+def _draw_photo_block(page: _Page, block: dict, top: float, images: Dict[str, Optional[bytes]]) -> float:
+    group = block["group"]
+    members = group["photos"]
+    start = top
+
+    label = f"Photo {group['number']}" if len(members) > 1 else f"Photo {group['number']}.0"
+    page.text(label, MARGIN, top, font="Helvetica-Bold", size=10)
+    top += 5 * mm
+
+    photo_h = _photo_height(len(members))
+    for photo in members:
+        if not photo.get("PhotoURL"):
+            continue
+        stamp = str(photo["PhotoNumbering"]) if photo.get("PhotoNumbering") else None
+        page.image(images.get(photo["PhotoURL"]), MARGIN, top, PHOTO_WIDTH, photo_h, stamp=stamp)
+        top += photo_h + 2 * mm
+
+    text_top = start + 5 * mm
+    page.text("Finding:", TEXT_BOX_X, text_top, font="Helvetica-Bold", size=9)
+    page.lines(block["finding"], TEXT_BOX_X, text_top + 6 * mm, 4 * mm)
+    text_top += 6 * mm + len(block["finding"]) * 4 * mm + 5 * mm
+
+    page.text("Recommendation:", TEXT_BOX_X, text_top, font="Helvetica-Bold", size=9)
+    page.lines(block["recommendation"], TEXT_BOX_X, text_top + 6 * mm, 4 * mm)
+    text_top += 6 * mm + len(block["recommendation"]) * 4 * mm
+
+    top = max(top, text_top) + 10 * mm
+    page.rule(top)
+    return top + 5 * mm
+
+# ---------------------------------------------------------
+# Pages
+# ---------------------------------------------------------
+
+def _draw_summary_page(page: _Page, fields: Dict[str, str]):
+    page.text("MAJOR TURNAROUND 2026", PAGE_WIDTH / 2, 15 * mm, font="Helvetica-Bold", size=12, align="center")
+    page.text("PRESSURE VESSEL INSPECTION REPORT", PAGE_WIDTH / 2, 22 * mm, font="Helvetica-Bold", size=12, align="center")
+
+    top = 35 * mm
+    for label, value in [
+        ("Equipment tag no:", fields["TagNo"]),
+        ("Equipment description:", fields["EquipDescription"]),
+        ("Plant/Unit/Area:", fields["PlantName"]),
+        ("DOSH registration no.:", fields["DOSH"]),
+        ("Report no.:", fields["ReportNo"]),
+        ("Report date.:", fields["ReportDate"]),
+    ]:
+        page.text(label, MARGIN, top, font="Helvetica-Bold", size=9)
+        page.text(str(value), MARGIN + 55 * mm, top, size=9)
+        top += 6 * mm
+
+    top += 5 * mm
+    page.text("FINDINGS, NDTs & RECOMMENDATIONS", MARGIN, top, font="Helvetica-Bold", size=11)
+    top += 8 * mm
+
+    for title, content in [
+        ("FINDINGS", fields["Findings"]),
+        ("NON-DESTRUCTIVE TESTINGS", fields["NDTs"]),
+        ("RECOMMENDATIONS", fields["Recommendations"]),
+    ]:
+        if top > PAGE_HEIGHT - 30 * mm:
+            page.pdf.showPage()
+            top = 20 * mm
+        page.text(title, MARGIN, top, font="Helvetica-Bold", size=10)
+        top += 6 * mm
+        lines = _split(content, CONTENT_WIDTH, 9)
+        page.lines(lines, MARGIN, top, 5 * mm, size=9)
+        top += len(lines) * 5 * mm + 8 * mm
+
+    if top > PAGE_HEIGHT - 30 * mm:
+        page.pdf.showPage()
+        top = 20 * mm
+    else:
+        top = max(top, PAGE_HEIGHT - 40 * mm)
+
+    page.text(f"Inspected by: {fields['FullName']}", MARGIN, top, size=9)
+    page.text("Reviewed by: __________", MARGIN + 85 * mm, top, size=9)
+    page.text("Approved by (Client): __________", MARGIN, top + 10 * mm, size=9)
+
+def _paginate(blocks: List[dict]) -> List[List[dict]]:
+    """Split photo blocks into pages (a block never spans two pages)"""
+    pages, current, top = [], [], 30 * mm
+    for block in blocks:
+        if current and top + block["height"] > PAGE_HEIGHT - MARGIN:
+            pages.append(current)
+            current, top = [], 30 * mm
+        current.append(block)
+        top += block["height"]
+    if current:
+        pages.append(current)
+    return pages
+
+async def _load_page_images(client: httpx.AsyncClient, semaphore: asyncio.Semaphore,
+                            sizes: Dict[str, tuple]) -> Dict[str, Optional[bytes]]:
+    """Fetch a page's images at print size, reducing them further if the page exceeds PAGE_IMAGE_BUDGET"""
+    urls = list(sizes)
+    results = await asyncio.gather(*[load_report_image(client, semaphore, u, *sizes[u]) for u in urls])
+    images = dict(zip(urls, results))
+
+    total = sum(len(data) for data in images.values() if data)
+    if total <= PAGE_IMAGE_BUDGET:
+        return images
+
+    dpi = max(72, int(REPORT_IMAGE_DPI * (PAGE_IMAGE_BUDGET / total) ** 0.5))
+    print(f"📉 Page images use {total} bytes, reducing to {dpi} DPI to fit {PAGE_IMAGE_BUDGET}")
+    for image_url, data in images.items():
+        if data:
+            images[image_url] = await asyncio.to_thread(prepare_image, data, *sizes[image_url], None, dpi)
+    return images
+
+def _draw_photo_page(page: _Page, page_index: int, page_blocks: List[dict],
+                     images: Dict[str, Optional[bytes]], fields: Dict[str, str], last: bool):
+    title = "PHOTOS REPORT" if page_index == 0 else "PHOTOS REPORT (continued)"
+    page.text(title, MARGIN, 15 * mm, font="Helvetica-Bold", size=12)
+
+    top = 30 * mm
+    for block in page_blocks:
+        if block["group"]["canvas_url"]:
+            top = _draw_canvas_block(page, block, top, images)
+        else:
+            top = _draw_photo_block(page, block, top, images)
+
+    if last and top < PAGE_HEIGHT - 30 * mm:
+        page.text(f"Inspected by: {fields['FullName']}", MARGIN, PAGE_HEIGHT - 20 * mm, size=9)
+        page.text(f"Date: {fields['ReportDate']}", PAGE_WIDTH - MARGIN - 40 * mm, PAGE_HEIGHT - 20 * mm, size=9)
+    page.pdf.showPage()
+
+# ---------------------------------------------------------
+# Part Assembly
+# ---------------------------------------------------------
+
+class _PdfConcatenator:
+    """
+    Writes the pages of several PDFs into one output, part by part
+
+    A part's objects are renumbered and written out as soon as it is
+    appended, so only that part is held in memory. What is kept across
+    parts is the page list and the object offsets for the xref table.
+    """
+
+    PAGES = 1
+    CATALOG = 2
+
+    def __init__(self, output):
+        self.output = output
+        self.start = output.tell()
+        self.offsets: Dict[int, int] = {}
+        self.next_number = 3
+        self.pages: List[int] = []
+        self.info: Optional[int] = None
+        output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, number: int, obj):
+        self.offsets[number] = self.output.tell() - self.start
+        self.output.write(f"{number} 0 obj\n".encode())
+        obj.write_to_stream(self.output)
+        self.output.write(b"\nendobj\n")
+
+    def append(self, part):
+        """Copy every page of a PDF file object (and what the pages use) to the output"""
+        reader = PdfReader(part)
+        numbers: Dict[tuple, int] = {}
+        queue: List[IndirectObject] = []
+
+        def ref(indirect: IndirectObject) -> IndirectObject:
+            if indirect.pdf is not reader:
+                return indirect  # already renumbered (shared inherited object)
+            key = (indirect.idnum, indirect.generation)
+            if key not in numbers:
+                numbers[key] = self.next_number
+                self.next_number += 1
+                queue.append(indirect)
+            return IndirectObject(numbers[key], 0, None)
+
+        def remap(obj):
+            if isinstance(obj, IndirectObject):
+                return ref(obj)
+            if isinstance(obj, DictionaryObject):
+                for key, value in list(dict.items(obj)):
+                    dict.__setitem__(obj, key, remap(value))
+            elif isinstance(obj, ArrayObject):
+                for i in range(len(obj)):
+                    list.__setitem__(obj, i, remap(list.__getitem__(obj, i)))
+            return obj
+
+        # Inherited attributes are copied onto each page by pypdf, so the
+        # part's own page tree is not needed
+        for page in reader.pages:
+            self.pages.append(ref(page.indirect_reference).idnum)
+        if self.info is None and "/Info" in reader.trailer:
+            self.info = ref(dict.__getitem__(reader.trailer, "/Info")).idnum
+
+        while queue:
+            indirect = queue.pop()
+            obj = indirect.get_object()
+            if isinstance(obj, DictionaryObject) and obj.get("/Type") == "/Page":
+                dict.__setitem__(obj, NameObject("/Parent"), IndirectObject(self.PAGES, 0, None))
+            self._write(numbers[(indirect.idnum, indirect.generation)], remap(obj))
+
+    def close(self):
+        """Write the page tree, catalog, xref table and trailer"""
+        self._write(self.PAGES, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject([IndirectObject(n, 0, None) for n in self.pages]),
+            NameObject("/Count"): NumberObject(len(self.pages)),
+        }))
+        self._write(self.CATALOG, DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(self.PAGES, 0, None),
+        }))
+
+        xref_offset = self.output.tell() - self.start
+        self.output.write(f"xref\n0 {self.next_number}\n".encode())
+        self.output.write(b"0000000000 65535 f \n")
+        for number in range(1, self.next_number):
+            self.output.write(f"{self.offsets[number]:010d} 00000 n \n".encode())
+
+        trailer = DictionaryObject({
+            NameObject("/Size"): NumberObject(self.next_number),
+            NameObject("/Root"): IndirectObject(self.CATALOG, 0, None),
+        })
+        if self.info is not None:
+            trailer[NameObject("/Info")] = IndirectObject(self.info, 0, None)
+        self.output.write(b"trailer\n")
+        trailer.write_to_stream(self.output)
+        self.output.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+def _new_part(fields: Dict[str, str]):
+    part = tempfile.TemporaryFile()
+    pdf = canvas.Canvas(part, pagesize=A4, pageCompression=1)
+    pdf.setTitle(f"Inspection Report {fields['ReportNo']}")
+    return pdf, part
+
+def _append_part(writer: _PdfConcatenator, pdf: canvas.Canvas, part):
+    """Save a part and copy it to the output (frees its images)"""
+    try:
+        pdf.save()
+        part.seek(0)
+        writer.append(part)
+    finally:
+        part.close()
+
+# ---------------------------------------------------------
+# Rendering
+# ---------------------------------------------------------
+
+async def render_inspection_pdf(bundle: dict, output):
+    """
+    Render the inspection report PDF into a writable binary file object
+
+    The summary page is one part, then every PDF_PART_PAGES photo pages are
+    another (see module docstring).
+
+    Args:
+        bundle: Result of report_data.load_report_bundle()
+        output: Seekable file-like object the PDF is written to
+    """
+    fields = header_fields(bundle)
+    blocks = [_plan_block(g) for g in group_report_photos(bundle["photos"])]
+    pages = _paginate(blocks)
+
+    writer = _PdfConcatenator(output)
+    pdf, part = _new_part(fields)
+    try:
+        await asyncio.to_thread(_draw_summary_page, _Page(pdf), fields)
+
+        semaphore = asyncio.Semaphore(IMAGE_FETCH_CONCURRENCY)
+        async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as client:
+            for page_index, page_blocks in enumerate(pages):
+                if page_index % PDF_PART_PAGES == 0:
+                    await asyncio.to_thread(_append_part, writer, pdf, part)
+                    pdf, part = _new_part(fields)
+
+                sizes = {}
+                for block in page_blocks:
+                    for image_url, width, height in block["images"]:
+                        sizes[image_url] = (width, height)
+                images = await _load_page_images(client, semaphore, sizes)
+                await asyncio.to_thread(
+                    _draw_photo_page, _Page(pdf), page_index, page_blocks, images, fields,
+                    page_index == len(pages) - 1
+                )
+                del images
+
+        await asyncio.to_thread(_append_part, writer, pdf, part)
+    finally:
+        part.close()
+    await asyncio.to_thread(writer.close)
+
+async def build_inspection_pdf(bundle: dict):
+    """
+    Render the report into a spooled file (memory first, disk for large reports)
+
+    Returns:
+        SpooledTemporaryFile positioned at the start
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        await render_inspection_pdf(bundle, spool)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+def iter_file(spool, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Stream a spooled file in chunks and close it afterwards"""
+    try:
+        while True:
+            chunk = spool.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        spool.close()
@@ -0,0 +1,203 @@
+# storage_stream.py
+"""
+Streaming Uploads to Supabase Storage
+Sends an UploadFile to the storage REST API chunk by chunk instead of
+reading the whole body into memory first.
+
+Starlette spools a multipart body to disk before the endpoint runs, so the
+size limit is enforced in two places: RequestSizeLimit (ASGI middleware)
+rejects an oversized request body while it arrives, and stream_to_storage()
+checks each file again against MAX_UPLOAD_BYTES.
+"""
+
+from typing import AsyncIterator, Optional
+from urllib.parse import quote
+import os
+import json
+import httpx
+from fastapi import UploadFile
+from supabase import create_client, Client
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Initialize Supabase
+url = os.environ.get("SUPABASE_URL")
+key = os.environ.get("SUPABASE_ANON_KEY")
+
+if not url:
+    raise ValueError("SUPABASE_URL environment variable is not set.")
+if not key:
+    raise ValueError("SUPABASE_ANON_KEY environment variable is not set.")
+
+supabase: Client = create_client(url, key)
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+# Largest accepted upload
+MAX_UPLOAD_BYTES = int(os.environ.get("UPLOAD_MAX_MB", "50")) * 1024 * 1024
+
+# Largest total upload for endpoints that take several files at once
+MAX_BATCH_UPLOAD_BYTES = int(os.environ.get("UPLOAD_MAX_BATCH_MB", "200")) * 1024 * 1024
+
+# Room for multipart boundaries, part headers and form fields next to the files
+MULTIPART_OVERHEAD = 1024 * 1024
+
+# Endpoints whose requests carry several files
+MULTI_FILE_PATHS = ("/photo/batch-upload",)
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_TIMEOUT = 300.0
+
+class UploadTooLarge(Exception):
+    """Raised when an upload goes over its size limit"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File is larger than the {max_bytes // (1024 * 1024)} MB limit")
+        self.max_bytes = max_bytes
+
+class ObjectExists(Exception):
+    """Raised when the path is taken and upsert is off"""
+
+# ---------------------------------------------------------
+# Request Size Limit
+# ---------------------------------------------------------
+
+def upload_limit(path: str) -> int:
+    """Largest upload accepted in one request to a path"""
+    if path.rstrip("/") in MULTI_FILE_PATHS:
+        return MAX_BATCH_UPLOAD_BYTES
+    return MAX_UPLOAD_BYTES
+
+class RequestSizeLimit:
+    """
+    ASGI middleware: 413 for request bodies over upload_limit() (plus
+    MULTIPART_OVERHEAD)
+
+    A declared Content-Length over the limit is rejected before any of the
+    body is read; a body without one (chunked) is counted as it arrives and
+    cut off as soon as it passes the limit. Nothing more is received either
+    way, so the body is never spooled in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = upload_limit(scope["path"])
+        max_body = limit + MULTIPART_OVERHEAD
+        declared = dict(scope["headers"]).get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > max_body:
+            await self._reject(send, limit)
+            return
+
+        state = {"received": 0, "exceeded": False, "started": False}
+
+        async def limited_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > max_body:
+                    state["exceeded"] = True
+                    raise UploadTooLarge(limit)
+            return message
+
+        async def guarded_send(message):
+            if state["exceeded"]:
+                # Whatever the app answers to the aborted body becomes the 413
+                if message["type"] == "http.response.start" and not state["started"]:
+                    state["started"] = True
+                    await self._reject(send, limit)
+                return
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            if state["started"]:
+                raise
+            state["started"] = True
+            await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send, limit: int):
+        body = json.dumps({"detail": str(UploadTooLarge(limit))}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+# ---------------------------------------------------------
+# Upload
+# ---------------------------------------------------------
+
+async def _read_chunks(upload: UploadFile, max_bytes: int, state: dict) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        state["sent"] += len(chunk)
+        if state["sent"] > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        yield chunk
+
+async def stream_to_storage(bucket: str, path: str, upload: UploadFile, content_type: Optional[str] = None,
+                            max_bytes: int = MAX_UPLOAD_BYTES, upsert: bool = False) -> str:
+    """
+    Stream an uploaded file into a storage bucket
+
+    Args:
+        bucket: Storage bucket name
+        path: Object path inside the bucket
+        upload: The request's UploadFile
+        content_type: Stored content type (defaults to the upload's)
+        max_bytes: Size limit, checked before and during streaming
+
+    Returns:
+        Public URL of the stored object
+
+    Raises:
+        UploadTooLarge: The file is over max_bytes
+        ObjectExists: The path already exists and upsert is False
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    await upload.seek(0)
+    headers = {
+        "Authorization": f"Bearer {key}",
+        "apikey": key,
+        "Content-Type": content_type or upload.content_type or "application/octet-stream",
+        "x-upsert": "true" if upsert else "false",
+    }
+    if upload.size is not None:
+        headers["Content-Length"] = str(upload.size)
+
+    endpoint = f"{url.rstrip('/')}/storage/v1/object/{bucket}/{quote(path)}"
+    state = {"sent": 0}
+    try:
+        async with httpx.AsyncClient(timeout=UPLOAD_TIMEOUT) as client:
+            response = await client.post(endpoint, content=_read_chunks(upload, max_bytes, state), headers=headers)
+    except Exception:
+        # The server may drop the connection first when the stream is aborted
+        if state["sent"] > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        raise
+
+    if response.status_code == 409 or (response.status_code == 400 and "Duplicate" in response.text):
+        raise ObjectExists(path)
+    if response.status_code >= 400:
+        raise Exception(f"Storage upload failed ({response.status_code}): {response.text}")
+
+    return supabase.storage.from_(bucket).get_public_url(path)
@@ -0,0 +1,18 @@
+# conftest.py
+"""
+Shared test setup: the Backend modules are imported as top-level modules and
+create their Supabase client on import, so the path and placeholder
+credentials are set before any test module imports them. Nothing here talks
+to a real Supabase project.
+"""
+
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("SUPABASE_ANON_KEY", "test.anon.key")
@@ -0,0 +1,30 @@
+# test_detect_bench.py
+"""
+Detector replay harness (detect_bench.py): runs fully offline with the stub
+backend, without Supabase credentials.
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_stub_replay_runs_without_supabase_credentials(tmp_path):
+    for idx, color in enumerate(("red", "blue", "green")):
+        Image.new("RGB", (320, 240), color).save(tmp_path / f"{idx}.jpg")
+    env = {k: v for k, v in os.environ.items() if k not in ("SUPABASE_URL", "SUPABASE_ANON_KEY")}
+
+    result = subprocess.run(
+        [sys.executable, os.path.join(BACKEND_DIR, "detect_bench.py"), str(tmp_path),
+         "--backend", "stub", "--json"],
+        capture_output=True, text=True, timeout=120, env=env, cwd=tmp_path,
+    )
+
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout[result.stdout.index("{\n"):])
+    assert report["photos"] == 3
+    assert report["failed"] == 0
@@ -0,0 +1,120 @@
+# test_report_pdf.py
+"""
+Server-side PDF reports (report_pdf.py): the parts are assembled into one
+valid document, and memory stays flat as the report grows.
+"""
+
+import os
+import io
+import sys
+import json
+import asyncio
+import subprocess
+
+import pytest
+from PIL import Image
+from pypdf import PdfReader
+
+import report_assets
+import report_pdf
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _bundle(count: int, canvas: bool = False) -> dict:
+    photos = [
+        {
+            "PhotoID": i,
+            "PhotoURL": f"http://img/{i}",
+            "PhotoNumbering": i + 1,
+            "Finding": {"Description": f"Finding {i}"},
+            "Recommendation": {"Description": f"Recommendation {i}"},
+            "CanvasPhotoURL": f"http://canvas/{i}" if canvas else None,
+        }
+        for i in range(count)
+    ]
+    return {
+        "inspection": {"InspectionID": 1, "ReportNo": "R/1", "ReportDate": "2026-01-01"},
+        "equipment": {},
+        "inspector": {"FullName": "Inspector"},
+        "photos": photos,
+    }
+
+def _render(bundle: dict) -> bytes:
+    spool = asyncio.run(report_pdf.build_inspection_pdf(bundle))
+    return b"".join(report_pdf.iter_file(spool))
+
+# ---------------------------------------------------------
+# Assembly
+# ---------------------------------------------------------
+
+def test_parts_are_assembled_into_one_document(monkeypatch):
+    async def fetch(client, semaphore, url):
+        out = io.BytesIO()
+        Image.new("RGB", (400, 300), "gray").save(out, "JPEG")
+        return out.getvalue()
+
+    monkeypatch.setattr(report_assets, "fetch_image", fetch)
+    monkeypatch.setattr(report_pdf, "PDF_PART_PAGES", 2)
+
+    reader = PdfReader(io.BytesIO(_render(_bundle(7, canvas=True))), strict=True)
+
+    # Summary page, then one canvas block per photo page, in four parts
+    assert len(reader.pages) == 1 + 7
+    assert sum(len(page.images) for page in reader.pages) == 7
+    assert reader.metadata.title == "Inspection Report R/1"
+    assert "Finding 6" in reader.pages[-1].extract_text()
+
+def test_report_without_photos_has_only_the_summary():
+    reader = PdfReader(io.BytesIO(_render(_bundle(0))), strict=True)
+
+    assert len(reader.pages) == 1
+    assert "PRESSURE VESSEL INSPECTION REPORT" in reader.pages[0].extract_text()
+
+# ---------------------------------------------------------
+# Peak memory
+# ---------------------------------------------------------
+
+# Fresh interpreter per report size; every canvas is incompressible noise
+_RENDER_SCRIPT = r"""
+import os, io, sys, json, asyncio, resource
+os.environ["REPORT_ASSET_CACHE_MB"] = "1"
+sys.path.insert(0, sys.argv[2])
+import conftest  # noqa: F401  (placeholder Supabase settings)
+from PIL import Image
+import report_assets, report_pdf
+from test_report_pdf import _bundle
+
+async def fetch(client, semaphore, url):
+    out = io.BytesIO()
+    Image.frombytes("RGB", (2400, 1400), os.urandom(2400 * 1400 * 3)).save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+report_assets.fetch_image = fetch
+
+async def main():
+    with open(os.devnull, "wb") as sink:
+        await report_pdf.render_inspection_pdf(_bundle(int(sys.argv[1]), canvas=True), sink)
+
+asyncio.run(main())
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"peak_rss": peak if sys.platform == "darwin" else peak * 1024}))
+"""
+
+def _peak_rss(photos: int) -> int:
+    tests_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-c", _RENDER_SCRIPT, str(photos), BACKEND_DIR],
+        capture_output=True, text=True, timeout=300,
+        env={**os.environ, "PYTHONPATH": tests_dir},
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])["peak_rss"]
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs the resource module")
+def test_peak_rss_stays_flat_as_report_grows():
+    mb = 1024 * 1024
+    small = _peak_rss(16)
+    large = _peak_rss(64)
+
+    # A single ReportLab document keeps every page's image until save()
+    assert large - small < 25 * mb, f"peak RSS grew from {small // mb} MB to {large // mb} MB"
@@ -0,0 +1,60 @@
+# test_upload_sessions.py
+"""
+Resumable upload sessions (upload_sessions.py): which bytes survive a broken
+or rejected chunk. Only the local .part file is exercised; the last byte is
+never sent, so nothing is uploaded to storage.
+"""
+
+import os
+import base64
+import asyncio
+import hashlib
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+import upload_sessions
+
+DATA = os.urandom(64 * 1024)
+
+@pytest.fixture(autouse=True)
+def session_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_sessions, "SESSION_DIR", str(tmp_path))
+
+def _checksum(data: bytes) -> str:
+    return "sha256 " + base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+async def _stream(*parts: bytes, disconnect: bool = False):
+    for part in parts:
+        yield part
+    if disconnect:
+        raise ClientDisconnect()
+
+def _append(upload_id: str, offset: int, body, checksum=None) -> dict:
+    return asyncio.run(upload_sessions.append_chunk(upload_id, offset, body, checksum))
+
+def _offset(upload_id: str) -> int:
+    return upload_sessions.load_session(upload_id)["offset"]
+
+@pytest.fixture
+def upload_id():
+    return upload_sessions.create_session("photo.jpg", len(DATA), "image/jpeg", "inspection-images")["upload_id"]
+
+def test_disconnect_keeps_received_bytes(upload_id):
+    with pytest.raises(ClientDisconnect):
+        _append(upload_id, 0, _stream(DATA[:1000], DATA[1000:3000], disconnect=True))
+    assert _offset(upload_id) == 3000
+
+def test_disconnect_drops_unverifiable_chunk(upload_id):
+    _append(upload_id, 0, _stream(DATA[:1000]))
+    with pytest.raises(ClientDisconnect):
+        _append(upload_id, 1000, _stream(DATA[1000:2000], disconnect=True), _checksum(DATA[1000:5000]))
+    assert _offset(upload_id) == 1000
+
+def test_rejected_chunks_are_rolled_back(upload_id):
+    _append(upload_id, 0, _stream(DATA[:1000]))
+    with pytest.raises(upload_sessions.ChecksumMismatch):
+        _append(upload_id, 1000, _stream(DATA[1000:2000]), _checksum(b"other"))
+    with pytest.raises(upload_sessions.ChunkTooLarge):
+        _append(upload_id, 1000, _stream(DATA[1000:], b"extra"))
+    assert _offset(upload_id) == 1000
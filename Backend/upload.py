@@ -0,0 +1,231 @@
+# upload.py
+"""
+Direct-to-Storage Uploads
+The client asks for a signed upload URL, PUTs the file straight to Supabase
+Storage, then calls /upload/finalize so the backend can verify the object
+and register it. File bytes never pass through the API workers on the way in.
+
+Uploads are content-addressed like the other photo uploads (content_store):
+the client sends the file's SHA-256 to /upload/sign and gets a staging path
+that carries it. /upload/finalize streams the staged object through SHA-256
+(the stored bytes are never trusted on the client's word) and moves it to
+sha256/ab/<hash>, or drops it when those bytes are already stored. When they
+are stored before the upload starts, /upload/sign says so and the client
+skips the PUT.
+"""
+
+from fastapi import APIRouter, HTTPException, BackgroundTasks
+from pydantic import BaseModel, Field
+from typing import Optional
+from urllib.parse import quote
+import os
+import re
+import time
+import uuid
+import asyncio
+import hashlib
+import traceback
+import httpx
+from supabase import create_client, Client
+from dotenv import load_dotenv
+
+from content_store import HASH_CHUNK_SIZE, adopt_object, claim_content, content_path
+from photo_derivatives import claim_stale, generate_derivatives
+from report_cache import refresh_reports
+from storage_stream import MAX_UPLOAD_BYTES, UploadTooLarge
+
+load_dotenv()
+
+# Initialize Supabase
+url = os.environ.get("SUPABASE_URL")
+key = os.environ.get("SUPABASE_ANON_KEY")
+
+if not url:
+    raise ValueError("SUPABASE_URL environment variable is not set.")
+if not key:
+    raise ValueError("SUPABASE_ANON_KEY environment variable is not set.")
+
+supabase: Client = create_client(url, key)
+
+router = APIRouter(prefix="/upload", tags=["Direct Upload"])
+
+# Buckets clients may upload to directly
+ALLOWED_BUCKETS = ("inspection-images", "inspection-reports")
+
+# Supabase signed upload URLs are valid for 2 hours (not configurable)
+SIGNED_UPLOAD_TTL = 2 * 60 * 60
+
+# Staging paths handed out by /upload/sign: {timestamp}_{token}_{sha256}_{filename}
+_SIGNED_PATH_RE = re.compile(r"^(\d+)_[0-9a-f]{12}_([0-9a-f]{64})_[A-Za-z0-9._-]+$")
+_UNSAFE_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+# ---------------------------------------------------------
+# Pydantic Models
+# ---------------------------------------------------------
+
+class SignedUploadRequest(BaseModel):
+    bucket: str = "inspection-images"
+    filename: str
+    # SHA-256 of the file, hex
+    sha256: str = Field(..., pattern=r"^[0-9a-fA-F]{64}$")
+
+class FinalizeUploadRequest(BaseModel):
+    bucket: str = "inspection-images"
+    path: str
+    # Set to register the file as a photo of this inspection
+    InspectionID: Optional[int] = None
+    PhotoNumbering: Optional[float] = None
+    Category: Optional[str] = None
+    Caption: Optional[str] = None
+    FindingID: Optional[int] = None
+    RecommendID: Optional[int] = None
+
+# ---------------------------------------------------------
+# Helper Functions
+# ---------------------------------------------------------
+
+def _check_bucket(bucket: str):
+    if bucket not in ALLOWED_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of: {', '.join(ALLOWED_BUCKETS)}")
+
+def _public_object_url(bucket: str, path: str) -> str:
+    return f"{url.rstrip('/')}/storage/v1/object/public/{bucket}/{quote(path)}"
+
+def _remove_object(bucket: str, path: str):
+    try:
+        supabase.storage.from_(bucket).remove([path])
+    except Exception as e:
+        print(f"⚠️ Could not remove rejected upload {bucket}/{path}: {e}")
+
+async def _object_digest(client: httpx.AsyncClient, object_url: str) -> str:
+    """SHA-256 of a stored object, streamed (never held in memory)"""
+    digest = hashlib.sha256()
+    total = 0
+    async with client.stream("GET", object_url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes(HASH_CHUNK_SIZE):
+            total += len(chunk)
+            if total > MAX_UPLOAD_BYTES:
+                raise UploadTooLarge(MAX_UPLOAD_BYTES)
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# ---------------------------------------------------------
+# Routes
+# ---------------------------------------------------------
+
+# 1. Issue a signed upload URL
+@router.post("/sign")
+def create_signed_upload(req: SignedUploadRequest):
+    try:
+        _check_bucket(req.bucket)
+        digest = req.sha256.lower()
+        safe_name = _UNSAFE_RE.sub("_", os.path.basename(req.filename)).strip("_") or "file"
+        path = f"{int(time.time())}_{uuid.uuid4().hex[:12]}_{digest}_{safe_name}"
+        storage = supabase.storage.from_(req.bucket)
+
+        result = {
+            "bucket": req.bucket,
+            "path": path,
+            "exists": False,
+            "signed_url": None,
+            "token": None,
+            "expires_in": SIGNED_UPLOAD_TTL,
+            "max_bytes": MAX_UPLOAD_BYTES
+        }
+
+        # Same bytes already stored: nothing to upload, /finalize registers them
+        if storage.exists(content_path(digest)):
+            result["exists"] = True
+            return result
+
+        signed = storage.create_signed_upload_url(path)
+        result["signed_url"] = signed["signed_url"]
+        result["token"] = signed["token"]
+        return result
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Failed to create upload URL: {str(e)}")
+
+# 2. Verify an uploaded object and register it
+@router.post("/finalize")
+async def finalize_upload(req: FinalizeUploadRequest, background_tasks: BackgroundTasks):
+    try:
+        _check_bucket(req.bucket)
+        match = _SIGNED_PATH_RE.match(req.path)
+        if not match:
+            raise HTTPException(status_code=400, detail="Path was not issued by /upload/sign")
+        if time.time() - int(match.group(1)) > SIGNED_UPLOAD_TTL + 60:
+            raise HTTPException(status_code=410, detail="Upload URL has expired")
+        digest = match.group(2)
+
+        # Before looking for the stored object (see content_store.store_upload)
+        await asyncio.to_thread(claim_content, digest)
+
+        # HEAD the object: confirms it exists and gives size/type without downloading it
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            head = await client.head(_public_object_url(req.bucket, req.path))
+            staged = head.status_code not in (400, 404)
+            if not staged:
+                # /sign found the bytes already stored, or this is a retry after the move
+                head = await client.head(_public_object_url(req.bucket, content_path(digest)))
+            if head.status_code in (400, 404):
+                raise HTTPException(status_code=404, detail="Uploaded file not found in storage")
+            head.raise_for_status()
+
+            size = int(head.headers.get("content-length") or 0)
+            content_type = head.headers.get("content-type", "")
+            if size > MAX_UPLOAD_BYTES:
+                if staged:
+                    _remove_object(req.bucket, req.path)
+                raise HTTPException(status_code=413, detail=f"File is larger than the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit")
+            if req.bucket == "inspection-images" and not content_type.startswith("image/"):
+                if staged:
+                    _remove_object(req.bucket, req.path)
+                raise HTTPException(status_code=415, detail=f"Expected an image, got {content_type or 'unknown type'}")
+
+            if staged:
+                try:
+                    actual = await _object_digest(client, _public_object_url(req.bucket, req.path))
+                except UploadTooLarge:
+                    actual = None
+                if actual != digest:
+                    _remove_object(req.bucket, req.path)
+                    raise HTTPException(status_code=400, detail="Uploaded file does not match its sha256")
+
+        if staged:
+            public_url = await asyncio.to_thread(adopt_object, req.bucket, req.path, digest)
+        else:
+            public_url = supabase.storage.from_(req.bucket).get_public_url(content_path(digest))
+        result = {"url": public_url, "size": size, "content_type": content_type, "sha256": digest, "photo": None}
+
+        if req.InspectionID is not None:
+            if req.bucket != "inspection-images":
+                raise HTTPException(status_code=400, detail="Only inspection-images can be registered as photos")
+            # Finalizing twice (e.g. a client retry), or the same bytes twice
+            # for one inspection, returns the existing row
+            existing = supabase.table("PhotoReport")\
+                .select("*")\
+                .eq("InspectionID", req.InspectionID)\
+                .eq("ContentHash", digest)\
+                .execute()
+            if existing.data:
+                result["photo"] = existing.data[0]
+            else:
+                row = req.dict(exclude={"bucket", "path"})
+                row["PhotoURL"] = public_url
+                row["ContentHash"] = digest
+                insert_res = supabase.table("PhotoReport").insert(row).execute()
+                result["photo"] = insert_res.data[0] if insert_res.data else None
+                background_tasks.add_task(refresh_reports, req.InspectionID)
+                background_tasks.add_task(generate_derivatives, claim_stale(insert_res.data or []))
+
+        print(f"✅ Direct upload finalized: {req.bucket}/{req.path} ({size} bytes)")
+        return result
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Failed to finalize upload: {str(e)}")
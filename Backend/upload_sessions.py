@@ -0,0 +1,237 @@
+# upload_sessions.py
+"""
+Resumable Upload Sessions (tus-style)
+A session is a .part file plus a small .json record on local disk. Chunks are
+appended at the session's current offset, optionally verified with a SHA-256
+checksum, and once the last byte arrives the assembled file is streamed to
+storage. A client that loses its connection asks for the offset and only
+re-sends the missing bytes.
+
+Sessions live on the local disk of the API instance, so with several
+instances the upload must keep hitting the same one (or share the directory).
+"""
+
+from typing import AsyncIterator, Dict, Optional
+import os
+import re
+import json
+import time
+import uuid
+import base64
+import asyncio
+import hashlib
+import tempfile
+from starlette.datastructures import Headers, UploadFile
+
+from content_store import store_upload
+from storage_stream import MAX_UPLOAD_BYTES
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+
+SESSION_DIR = os.environ.get("UPLOAD_SESSION_DIR", os.path.join(tempfile.gettempdir(), "edaa-upload-sessions"))
+
+# Unfinished sessions are discarded after this long
+SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL_HOURS", "24")) * 60 * 60
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# One lock per session so two PATCHes cannot write at the same time
+_locks: Dict[str, asyncio.Lock] = {}
+
+class SessionNotFound(Exception):
+    pass
+
+class OffsetMismatch(Exception):
+    def __init__(self, offset: int):
+        super().__init__(f"Upload-Offset does not match the current offset ({offset})")
+        self.offset = offset
+
+class ChecksumMismatch(Exception):
+    pass
+
+class ChunkTooLarge(Exception):
+    pass
+
+# ---------------------------------------------------------
+# Session Files
+# ---------------------------------------------------------
+
+def _paths(upload_id: str):
+    if not _ID_RE.match(upload_id):
+        raise SessionNotFound(upload_id)
+    base = os.path.join(SESSION_DIR, upload_id)
+    return base + ".json", base + ".part"
+
+def _save(session: dict):
+    meta_path, _ = _paths(session["upload_id"])
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(session, f)
+    os.replace(tmp_path, meta_path)
+
+def _remove(upload_id: str):
+    for path in _paths(upload_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    _locks.pop(upload_id, None)
+
+def load_session(upload_id: str) -> dict:
+    """Session record; raises SessionNotFound if missing or expired"""
+    meta_path, part_path = _paths(upload_id)
+    try:
+        with open(meta_path) as f:
+            session = json.load(f)
+    except (FileNotFoundError, ValueError):
+        raise SessionNotFound(upload_id)
+
+    if session["expires_at"] < time.time():
+        _remove(upload_id)
+        raise SessionNotFound(upload_id)
+
+    # The .part file is the source of truth for the offset (survives a crash mid-write)
+    if not session.get("url"):
+        session["offset"] = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    return session
+
+def purge_expired():
+    """Delete sessions past their expiry"""
+    if not os.path.isdir(SESSION_DIR):
+        return
+    now = time.time()
+    for name in os.listdir(SESSION_DIR):
+        if not name.endswith(".json"):
+            continue
+        upload_id = name[:-5]
+        try:
+            with open(os.path.join(SESSION_DIR, name)) as f:
+                expired = json.load(f)["expires_at"] < now
+        except (OSError, ValueError, KeyError):
+            expired = True
+        if expired:
+            _remove(upload_id)
+
+def create_session(filename: str, length: int, content_type: Optional[str], bucket: str) -> dict:
+    """Start a resumable upload of `length` bytes"""
+    if length <= 0 or length > MAX_UPLOAD_BYTES:
+        raise ChunkTooLarge(f"Upload length must be between 1 and {MAX_UPLOAD_BYTES} bytes")
+
+    os.makedirs(SESSION_DIR, exist_ok=True)
+    purge_expired()
+
+    upload_id = uuid.uuid4().hex
+    session = {
+        "upload_id": upload_id,
+        "bucket": bucket,
+        "filename": os.path.basename(filename) or "upload",
+        "content_type": content_type or "application/octet-stream",
+        "length": length,
+        "offset": 0,
+        "created_at": time.time(),
+        "expires_at": time.time() + SESSION_TTL,
+        "url": None,
+    }
+    open(_paths(upload_id)[1], "wb").close()
+    _save(session)
+    return session
+
+def delete_session(upload_id: str):
+    load_session(upload_id)
+    _remove(upload_id)
+
+# ---------------------------------------------------------
+# Chunks
+# ---------------------------------------------------------
+
+def _parse_checksum(header: Optional[str]) -> Optional[bytes]:
+    """tus checksum header: "sha256 <base64 digest>" """
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(" ")
+    if algorithm.lower() != "sha256":
+        raise ChecksumMismatch(f"Unsupported checksum algorithm: {algorithm}")
+    try:
+        return base64.b64decode(value)
+    except ValueError:
+        raise ChecksumMismatch("Checksum is not valid base64")
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+async def append_chunk(upload_id: str, offset: int, body: AsyncIterator[bytes],
+                       checksum: Optional[str] = None) -> dict:
+    """
+    Write one chunk at `offset`
+
+    A chunk that fails its checksum or goes past the declared length is rolled
+    back. If the stream breaks, the bytes already written are kept so the
+    client resumes from there, unless the chunk carried a checksum (a partial
+    chunk cannot be verified). When the last byte arrives the file is uploaded
+    to storage. Disk I/O runs in worker threads.
+
+    Returns:
+        Updated session record ("url" is set once the upload is complete)
+    """
+    expected_digest = _parse_checksum(checksum)
+    lock = _locks.setdefault(upload_id, asyncio.Lock())
+
+    async with lock:
+        session = await asyncio.to_thread(load_session, upload_id)
+        if session.get("url"):
+            return session
+        if offset != session["offset"]:
+            raise OffsetMismatch(session["offset"])
+
+        _, part_path = _paths(upload_id)
+        digest = hashlib.sha256()
+        written = 0
+        f = await asyncio.to_thread(open, part_path, "r+b")
+        try:
+            f.seek(offset)
+            try:
+                async for data in body:
+                    if offset + written + len(data) > session["length"]:
+                        raise ChunkTooLarge("Chunk goes past the declared upload length")
+                    await asyncio.to_thread(f.write, data)
+                    digest.update(data)
+                    written += len(data)
+                if expected_digest is not None and digest.digest() != expected_digest:
+                    raise ChecksumMismatch("Chunk checksum does not match")
+            except (ChecksumMismatch, ChunkTooLarge):
+                await asyncio.to_thread(f.truncate, offset)
+                raise
+            except BaseException:
+                # Disconnect or cancellation: keep what arrived unless it cannot be verified
+                if expected_digest is not None:
+                    await asyncio.to_thread(f.truncate, offset)
+                else:
+                    await asyncio.to_thread(_sync, f)
+                raise
+            await asyncio.to_thread(_sync, f)
+        finally:
+            f.close()
+
+        session["offset"] = offset + written
+        session["expires_at"] = time.time() + SESSION_TTL
+
+        if session["offset"] == session["length"]:
+            session["url"] = await _assemble(session, part_path)
+            await asyncio.to_thread(os.remove, part_path)
+        await asyncio.to_thread(_save, session)
+        return session
+
+async def _assemble(session: dict, part_path: str) -> str:
+    """Store the completed file (content-addressed, so re-sent photos are reused)"""
+    with open(part_path, "rb") as f:
+        upload = UploadFile(
+            f,
+            size=session["length"],
+            filename=session["filename"],
+            headers=Headers({"content-type": session["content_type"]})
+        )
+        public_url, _, _ = await store_upload(session["bucket"], upload)
+        return public_url
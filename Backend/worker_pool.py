@@ -0,0 +1,34 @@
+# worker_pool.py
+"""
+Shared Process Pool
+CPU-heavy Pillow work (annotation drawing, detector preprocessing) runs in a
+small pool of worker processes so it does not hold the event loop or the GIL.
+The pool is created on first use and shut down with the app.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import os
+import asyncio
+
+# Worker processes for image work
+IMAGE_WORKER_PROCESSES = int(os.environ.get("IMAGE_WORKER_PROCESSES", "2"))
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def get_pool() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKER_PROCESSES)
+    return _executor
+
+async def run_in_pool(func, *args):
+    """Run a module-level function in the pool (arguments must be picklable)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), func, *args)
+
+def shutdown_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
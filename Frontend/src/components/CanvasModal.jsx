@@ -479,11 +479,98 @@ export default function CanvasModal({ isOpen, onClose, photos, onSave, canvasSta
     return croppedCanvas;
   };
 
+  // Vector layout for /photo/canvas/compose: same crop as cropCanvasWhitespace,
+  // coordinates normalized to the cropped canvas (see canvas_compositor.py).
+  // Returns null when a placed image is a local file the server cannot fetch.
+  const buildCanvasLayout = () => {
+    if (images.some(img => !img.photoId)) return null;
+
+    const ctx = canvasRef.current.getContext('2d');
+    const labelBox = label => {
+      ctx.font = `${label.fontSize || 20}px Arial`;
+      return [label.x, label.y - (label.fontSize || 20), label.x + ctx.measureText(label.text).width, label.y];
+    };
+    const shapeBox = shape => {
+      if (shape.type === 'circle') {
+        const cx = (shape.startX + shape.endX) / 2;
+        const cy = (shape.startY + shape.endY) / 2;
+        const r = Math.hypot(shape.endX - shape.startX, shape.endY - shape.startY) / 2;
+        return [cx - r, cy - r, cx + r, cy + r];
+      }
+      return [
+        Math.min(shape.startX, shape.endX), Math.min(shape.startY, shape.endY),
+        Math.max(shape.startX, shape.endX), Math.max(shape.startY, shape.endY)
+      ];
+    };
+    const boxes = [
+      ...images.map(img => [img.x, img.y, img.x + img.width, img.y + img.height]),
+      ...shapes.map(shapeBox),
+      ...labels.map(labelBox)
+    ];
+    if (boxes.length === 0) return null;
+
+    const padding = 20;
+    const minX = Math.min(...boxes.map(b => b[0])) - padding;
+    const minY = Math.min(...boxes.map(b => b[1])) - padding;
+    const width = Math.max(...boxes.map(b => b[2])) + padding - minX;
+    const height = Math.max(...boxes.map(b => b[3])) + padding - minY;
+    const nx = x => (x - minX) / width;
+    const ny = y => (y - minY) / height;
+
+    return {
+      aspect: width / height,
+      background: '#ffffff',
+      images: images.map(img => ({
+        photo_id: img.photoId,
+        x: nx(img.x),
+        y: ny(img.y),
+        w: img.width / width,
+        h: img.height / height
+      })),
+      shapes: shapes.map(shape => ({
+        type: shape.type,
+        x1: nx(shape.startX),
+        y1: ny(shape.startY),
+        x2: nx(shape.endX),
+        y2: ny(shape.endY),
+        color: '#ef4444',
+        width: 3 / width
+      })),
+      labels: [
+        // Photo number badges, drawn by the editor on each image
+        ...images.filter(img => img.photoNumbering).map(img => ({
+          x: nx(img.x + 5),
+          y: ny(img.y + 18),
+          text: `#${img.photoNumbering.toFixed(1)}`,
+          size: 14 / width,
+          color: '#ffffff',
+          background: '#ef4444'
+        })),
+        ...labels.map(label => ({
+          x: nx(label.x),
+          y: ny(label.y),
+          text: label.text,
+          size: (label.fontSize || 20) / width,
+          color: '#ffffff'
+        }))
+      ]
+    };
+  };
+
   const handleSave = async () => {
     const canvas = canvasRef.current;
     if (!canvas) return;
 
     try {
+      // Send the layout and let the server render it; raster upload only
+      // when the canvas holds images that are not inspection photos
+      const layout = buildCanvasLayout();
+      if (layout) {
+        await onSave({ layout, images, shapes, labels });
+        onClose();
+        return;
+      }
+
       // ✅ Create new canvas with white background
       const exportCanvas = document.createElement('canvas');
       exportCanvas.width = canvas.width;
@@ -193,16 +193,16 @@ export default function useInspectionPart2ViewModel(inspectionId) {
             console.log('AI Detection Response:', response.data); // 🐛 DEBUG
 
             if (response.data.success) {
-                // ✨ Convert base64 to data URLs and update state
+                // ✨ Map annotated image URLs and update state
                 const resultsMap = {};
                 response.data.results.forEach(result => {
                     console.log(`Photo ${result.photo_id}:`, { // 🐛 DEBUG
-                        has_base64: !!result.annotated_image_base64,
-                        base64_length: result.annotated_image_base64?.length
+                        annotated_photo_url: result.annotated_photo_url,
+                        detections: result.detections?.length
                     });
 
-                    if (result.annotated_image_base64) {
-                        resultsMap[result.photo_id] = `data:image/jpeg;base64,${result.annotated_image_base64}`;
+                    if (result.annotated_photo_url) {
+                        resultsMap[result.photo_id] = result.annotated_photo_url;
                     }
                 });
 
@@ -259,10 +259,7 @@ export default function useInspectionPart2ViewModel(inspectionId) {
             const response = await api.post(`/photo/redetect/${photoId}`, {});
 
             if (response.data.success) {
-                // ✨ Convert base64 to data URL
-                const annotatedImageUrl = response.data.annotated_image_base64
-                    ? `data:image/jpeg;base64,${response.data.annotated_image_base64}`
-                    : null;
+                const annotatedImageUrl = response.data.annotated_photo_url || null;
 
                 setPhotosByCategory(prev => ({
                     ...prev,
@@ -126,11 +126,18 @@ export default function InspectionPart2({ inspectionId }) {
         try {
             const photoIds = selectedGroupPhotos.map(p => p.id);
             
-            const response = await api.post("/photo/save-canvas-annotation", {
-                inspection_id: inspectionId,
-                group_photo_ids: photoIds,
-                canvas_image_base64: canvasData.canvas
-            });
+            // Vector layouts are rendered by the server; raster canvases are uploaded as-is
+            const response = canvasData.layout
+                ? await api.post("/photo/canvas/compose", {
+                    inspection_id: inspectionId,
+                    group_photo_ids: photoIds,
+                    layout: canvasData.layout
+                })
+                : await api.post("/photo/save-canvas-annotation", {
+                    inspection_id: inspectionId,
+                    group_photo_ids: photoIds,
+                    canvas_image_base64: canvasData.canvas
+                });
 
             if (response.data.success) {
                 alert(`Canvas saved successfully! ${response.data.updated_photos} photos updated.`);